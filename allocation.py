@@ -0,0 +1,158 @@
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from incremental import concat_entries
+from ledger_rollup import group_codes
+from rule_engine import BUSINESS_LINES
+
+# --- Allocation (分摊) of Group-level Amounts ---
+# 亏损部分等按合同分组计量的金额，按分摊参考表中该合同分组各维度行的分摊动因（默认 期初未经过保费）
+# 分摊到这些维度行上，替代原来的 sql_alloc 查询和手工 Excel 分摊。
+# 分摊比例只加载一次：参考表按 (评估方法, 合同分组编号) 排序，每个合同分组占连续的一段行。
+# 分录先按分摊键以外的属性汇总到合同分组（每条规则一行），再用 searchsorted 定位各组的比例段，
+# 一次展开为 组 × 维度行，金额（分）乘比例后向下取整，差额按小数部分从大到小逐分补齐，
+# 每个合同分组的分摊结果精确加总回原金额，分到 0 分的行不输出。参考表中没有的合同分组和其他规则的分录原样保留。
+# 参考表按期间命名（<yyyyMM>分摊计量.xlsx），期间与评估月份不一致时拒绝分摊。
+
+# 按评估月份取参考表，{val_month} 为 yyyyMM
+ALLOCATION_SOURCE = os.path.join('给翟总', '{val_month}分摊计量.xlsx')
+ALLOCATION_SHEET = 'Sheet1'
+
+# 参考表列名 -> 分录列名
+ALLOCATION_COLUMNS = {
+    '评估方法': '评估方法', '合同分组编码': '合同分组编号', '归属机构': '归属机构', '业务渠道': '业务渠道',
+    '车辆种类': '车辆种类', '使用性质代码': '使用性质代码', '险种代码': '险种代码', '险类代码': '险类代码',
+}
+ALLOCATION_KEY = '合同分组编号'
+# 分摊后取参考表值的维度列（分录中没有的列忽略）；合同组合编号保留源数据的值
+TARGET_COLUMNS = ['归属机构', '业务渠道', '车辆种类', '使用性质代码', '险种代码', '险类代码']
+
+DEFAULT_DRIVER = '期初未经过保费'
+
+# 各业务线按合同分组分摊的规则（类型）。参考表只有评估方法 8/11/7，没有分出（10）的分摊动因，分出不分摊
+ALLOCATED_TYPES = {'direct': ['亏损(保费不足)'], 'assumed': ['亏损']}
+
+def allocation_source_for(val_month, source=ALLOCATION_SOURCE):
+    """Returns the allocation reference path of `val_month` ({val_month} in `source` is filled in)."""
+    return source.format(val_month=val_month)
+
+def reference_period(path):
+    """Returns the yyyyMM period in the reference file name, or None."""
+    match = re.search(r'(\d{6})分摊计量', os.path.basename(path))
+    return match.group(1) if match else None
+
+def load_allocation_ratios(path, val_month, sheet=ALLOCATION_SHEET, driver=DEFAULT_DRIVER):
+    """
+    Loads the allocation reference and normalizes the driver within each
+    (评估方法, 合同分组编号). Contract groups whose driver sums to zero are dropped.
+    Raises ValueError unless the period in the file name is `val_month`.
+
+    Returns:
+        按 (评估方法, 合同分组编号) 排序的 DataFrame：评估方法、合同分组编号、TARGET_COLUMNS、ratio
+    """
+    period = reference_period(path)
+    if period != val_month:
+        found = f"期间为 {period}" if period else "文件名中没有期间（应为 <yyyyMM>分摊计量.xlsx）"
+        raise ValueError(f"分摊参考表 {path} {found}，与评估月份 {val_month} 不一致，拒绝分摊")
+    ref = pd.read_excel(path, sheet_name=sheet, usecols=list(ALLOCATION_COLUMNS) + [driver],
+                        dtype={col: str for col in ALLOCATION_COLUMNS})
+    ref = ref.rename(columns=ALLOCATION_COLUMNS).dropna(subset=['评估方法', ALLOCATION_KEY])
+    for col in ALLOCATION_COLUMNS.values():
+        ref[col] = ref[col].str.strip()
+    weight = pd.to_numeric(ref.pop(driver), errors='coerce').fillna(0.0)
+    total = weight.groupby([ref['评估方法'], ref[ALLOCATION_KEY]]).transform('sum')
+    usable = (total != 0).to_numpy()
+    if not usable.all():
+        dropped = ref.loc[~usable, ['评估方法', ALLOCATION_KEY]].drop_duplicates()
+        print(f"警告：{len(dropped)} 个合同分组的分摊动因 {driver} 合计为 0，不参与分摊。")
+    ref = ref[usable].assign(ratio=(weight / total)[usable].to_numpy())
+    ref = ref.sort_values(['评估方法', ALLOCATION_KEY], kind='stable').reset_index(drop=True)
+    print(f"分摊比例已加载: {path} [{sheet}]，{ref[ALLOCATION_KEY].nunique()} 个合同分组，{len(ref)} 行")
+    return ref
+
+def split_fen(amounts, ratios, counts):
+    """
+    Splits each integer fen amount over its `counts[i]` consecutive ratios.
+
+    Every part is amount × ratio rounded down; the remaining fen of each amount go one
+    each to its parts with the largest fractional remainders, so the parts sum back to
+    the amount exactly. Returns the int64 parts.
+    """
+    n_parts = len(ratios)
+    owner = np.repeat(np.arange(len(amounts)), counts)
+    seg_starts = np.cumsum(counts) - counts
+    raw = amounts[owner].astype('float64') * ratios
+    base = np.floor(raw)
+    frac = raw - base
+    base = base.astype('int64')
+    residual = amounts - (np.add.reduceat(base, seg_starts) if n_parts else np.zeros(0, dtype='int64'))
+    # 组内按小数部分降序排名
+    order = np.lexsort((-frac, owner))
+    rank = np.empty(n_parts, dtype='int64')
+    rank[order] = np.arange(n_parts) - seg_starts[owner[order]]
+    counts_per_part = counts[owner]
+    return base + residual[owner] // counts_per_part + (rank < residual[owner] % counts_per_part)
+
+def allocate_entries(entries, ratios, line, types=None):
+    """
+    Allocates one line's group-level entries to the reference dimension rows.
+
+    Args:
+        entries: process_* 的输出（金额为分）
+        ratios: load_allocation_ratios 的结果
+        line: 业务线，用于按评估方法选取比例和默认的分摊规则
+        types: 参与分摊的规则类型，默认 ALLOCATED_TYPES 中该业务线的规则（没有则不分摊）
+
+    Returns:
+        分录 DataFrame：未分摊的分录在前，分摊结果在后，列与输入相同
+    """
+    if not len(entries):
+        return entries
+    types = ALLOCATED_TYPES.get(line, []) if types is None else types
+    if not types:
+        return entries
+    line_ratios = ratios[ratios['评估方法'] == BUSINESS_LINES[line]['val_method']]
+    if not len(line_ratios):
+        return entries
+    group_keys, starts, counts = np.unique(line_ratios[ALLOCATION_KEY].to_numpy(dtype=str),
+                                           return_index=True, return_counts=True)
+
+    # 在排好序的分组键上定位每个分录的比例段：每个不同的键值查一次，再按编码取回行
+    key_codes, key_values = pd.factorize(entries[ALLOCATION_KEY], use_na_sentinel=True)
+    key_values = np.asarray(key_values.astype(str), dtype=str)
+    value_pos = np.minimum(np.searchsorted(group_keys, key_values), len(group_keys) - 1)
+    value_found = group_keys[value_pos] == key_values
+    selected = np.zeros(len(entries), dtype=bool)
+    valid = key_codes >= 0
+    selected[valid] = value_found[key_codes[valid]]
+    selected &= entries['类型'].isin(types).to_numpy()
+    if not selected.any():
+        return entries
+
+    targets = [col for col in TARGET_COLUMNS if col in entries.columns]
+    to_allocate = entries[selected]
+    # 分摊前先按分摊键以外的属性汇总到合同分组
+    key_columns = [col for col in to_allocate.columns if col not in targets and col != '金额']
+    groups, n_groups = group_codes(to_allocate, key_columns)
+    order = np.argsort(groups, kind='stable')
+    group_starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0])
+    heads = to_allocate.iloc[order[group_starts]].reset_index(drop=True)
+    amounts = np.add.reduceat(to_allocate['金额'].to_numpy(dtype='int64')[order], group_starts)
+
+    group_pos = value_pos[key_codes[selected][order[group_starts]]]
+    part_counts = counts[group_pos]
+    owner = np.repeat(np.arange(n_groups), part_counts)
+    ratio_rows = starts[group_pos][owner] + (np.arange(len(owner)) - (np.cumsum(part_counts) - part_counts)[owner])
+
+    allocated = heads.take(owner).reset_index(drop=True)
+    for col in targets:
+        allocated[col] = pd.Categorical(line_ratios[col].to_numpy()[ratio_rows])
+    allocated['金额'] = split_fen(amounts, line_ratios['ratio'].to_numpy()[ratio_rows], part_counts)
+    # 比例很小的维度行可能分到 0 分，不产生分录
+    allocated = allocated[allocated['金额'].to_numpy() != 0]
+    label = BUSINESS_LINES[line]['label']
+    print(f"{label}分摊: {int(selected.sum())} 行分录（{n_groups} 个合同分组 × 规则）-> {len(allocated)} 行")
+    return concat_entries([entries[~selected], allocated])
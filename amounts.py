@@ -0,0 +1,28 @@
+import numpy as np
+import pandas as pd
+
+# --- Fixed-point Amounts ---
+# 金额在规则展开时由元转换为分（int64），此后的符号、按列求和、借贷取反、汇总都是整数运算，
+# 借贷合计精确到分；只有写出时才换算回元。
+# 源金额（SUM 的结果，可能是 float 或 Decimal）按四舍五入（远离零）取到分，NULL 按 0 处理，
+# 与 PostgreSQL 的 round(numeric, 2) 一致。
+
+# 最终格式中以分存储的金额列
+FEN_COLUMNS = ['origin_currency_amt', 'local_currency_amt', 'dc_local_currency_amt']
+
+def to_fen(values):
+    """Converts yuan amounts (float, Decimal or int; NULL as 0) to an int64 array of fen."""
+    yuan = np.nan_to_num(np.asarray(pd.to_numeric(values), dtype='float64'))
+    # 先去掉 *100 引入的二进制表示误差，再按远离零的方向舍入 0.5
+    cents = np.round(yuan * 100, 4)
+    return (np.sign(cents) * np.floor(np.abs(cents) + 0.5)).astype('int64')
+
+def to_yuan(fen):
+    """Converts fen back to yuan as float64 (the nearest double to the two-decimal value)."""
+    return np.asarray(fen, dtype='float64') / 100
+
+def with_yuan_amounts(df):
+    """Returns `df` with its int64 fen amount columns converted to yuan for output."""
+    converted = {col: to_yuan(df[col].to_numpy()) for col in FEN_COLUMNS
+                 if col in df.columns and pd.api.types.is_integer_dtype(df[col])}
+    return df.assign(**converted) if converted else df
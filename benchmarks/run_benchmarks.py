@@ -0,0 +1,244 @@
+"""
+Synthetic-data benchmark for the entry pipeline.
+
+Runs extraction, process_*, transform_to_final_format and output writing on generated
+source tables and records wall time, rows/s and peak RSS per stage. Run from the
+repository root:
+
+    python -m benchmarks.run_benchmarks --rows 1000000
+    python -m benchmarks.run_benchmarks --rows 10000000 --source postgres   # 临时本地 PostgreSQL
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+import generate_entries as ge
+from extraction import INGEST_METHODS, build_period_query, encode_dimensions, extract_concurrently
+from instrumentation import PeakRSSSampler
+from output_writers import OUTPUT_FORMATS, write_sheets
+
+from benchmarks.synthetic_data import (DEFAULT_CHUNK_ROWS, DEFAULT_PROFILES, DIRECT_TABLE, REIN_TABLE, SCHEMA,
+                                       aggregate_in_memory, build_value_pools, copy_chunks, create_source_tables,
+                                       generate_direct_chunks, generate_rein_chunks)
+
+RESULTS_PATH = os.path.join('benchmarks', 'results.jsonl')
+
+# --- Measurement ---
+
+def measure(records, stage, func, rows_in=None, rows_out=None):
+    """
+    Runs one stage and appends its record. `rows_out` maps the stage result to a row
+    count (default len(result)); throughput is computed on rows_in when given.
+    """
+    start = time.perf_counter()
+    with PeakRSSSampler() as rss:
+        result = func()
+    seconds = max(time.perf_counter() - start, 1e-9)
+    out = rows_out(result) if rows_out else len(result)
+    rows = rows_in if rows_in is not None else out
+    records.append({
+        'stage': stage, 'seconds': seconds, 'rows_in': rows_in, 'rows_out': out,
+        'rows_per_sec': rows / seconds, 'peak_rss_mb': rss.peak / 1024 / 1024,
+    })
+    return result
+
+# --- Throwaway PostgreSQL ---
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def temporary_postgres():
+    """
+    Starts a scratch PostgreSQL cluster (initdb/pg_ctl from PATH) in a temp directory
+    and removes it afterwards. Yields psycopg2 connection parameters.
+    """
+    initdb, pg_ctl = shutil.which('initdb'), shutil.which('pg_ctl')
+    if not initdb or not pg_ctl:
+        raise RuntimeError("未找到 initdb/pg_ctl，请安装 PostgreSQL 或用 --pg-host 指定已有数据库")
+    root = tempfile.mkdtemp(prefix='bench_pg_')
+    data_dir = os.path.join(root, 'data')
+    port = _free_port()
+    subprocess.run([initdb, '-D', data_dir, '-U', 'postgres', '--auth=trust', '-E', 'UTF8'],
+                   check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([pg_ctl, '-D', data_dir, '-l', os.path.join(root, 'server.log'), '-w',
+                    '-o', f"-p {port} -k {root} -c listen_addresses=''", 'start'],
+                   check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield {'host': root, 'port': str(port), 'database': 'postgres', 'user': 'postgres'}
+    finally:
+        subprocess.run([pg_ctl, '-D', data_dir, '-m', 'fast', '-w', 'stop'], stdout=subprocess.DEVNULL)
+        shutil.rmtree(root, ignore_errors=True)
+
+@contextmanager
+def postgres_source(args):
+    if args.pg_host:
+        yield {'host': args.pg_host, 'port': args.pg_port, 'database': args.pg_database,
+               'user': args.pg_user, 'password': args.pg_password}
+    else:
+        with temporary_postgres() as db_params:
+            yield db_params
+
+# --- Stages ---
+
+def _empty_mappings():
+    return {name: pd.Series(dtype=object) for name in ('product', 'org', 'cost_center', 'channel', 'car')}
+
+def _generators(args, pools):
+    direct = generate_direct_chunks(args.rows, args.val_month, pools=pools, seed=args.seed,
+                                    chunk_rows=args.chunk_rows, n_profiles=args.profiles)
+    rein = generate_rein_chunks(args.rein_rows, args.val_month, pools=pools, seed=args.seed + 1,
+                                chunk_rows=args.chunk_rows, n_profiles=args.profiles)
+    return direct, rein
+
+def extract_in_memory(records, args, pools):
+    direct, rein = _generators(args, pools)
+    direct = measure(records, 'generate_direct', lambda: list(direct), rows_out=lambda c: sum(map(len, c)))
+    rein = measure(records, 'generate_rein', lambda: list(rein), rows_out=lambda c: sum(map(len, c)))
+    specs = ge.EXTRACTION_SPECS
+    results = measure(records, 'extract', lambda: {
+        **aggregate_in_memory(direct, {'8': specs['8']}, args.val_month),
+        **aggregate_in_memory(rein, {'11': specs['11'], '10': specs['10']}, args.val_month),
+    }, rows_in=args.rows + args.rein_rows, rows_out=lambda r: sum(map(len, r.values())))
+    return results
+
+def extract_from_postgres(records, args, pools):
+    import psycopg2
+
+    with postgres_source(args) as db_params:
+        conn = psycopg2.connect(**db_params)
+        try:
+            create_source_tables(conn)
+            direct, rein = _generators(args, pools)
+            measure(records, 'load_direct', lambda: copy_chunks(conn, DIRECT_TABLE, direct), rows_out=int)
+            measure(records, 'load_rein', lambda: copy_chunks(conn, REIN_TABLE, rein), rows_out=int)
+
+            queries = {val_method: build_period_query(val_method, spec, args.val_month)
+                       for val_method, spec in ge.EXTRACTION_SPECS.items()}
+            results = measure(records, 'extract', lambda: extract_concurrently(
+                queries, db_params, max_workers=args.max_workers, ingest=args.ingest)[0],
+                rows_in=args.rows + args.rein_rows,
+                rows_out=lambda r: sum(len(df) for df in r.values() if df is not None))
+            if not args.keep_data:
+                with conn.cursor() as cur:
+                    cur.execute(f'DROP SCHEMA "{SCHEMA}" CASCADE')
+                conn.commit()
+        finally:
+            conn.close()
+    if any(df is None for df in results.values()):
+        raise RuntimeError("基准数据提取失败")
+    return results
+
+def run_pipeline(records, results, mappings, args):
+    df_8, df_11, df_10 = (encode_dimensions(results[val_method]) for val_method in ('8', '11', '10'))
+    lines = [
+        ('direct', df_8, ge.process_direct_business, '1'),
+        ('assumed', df_11, ge.process_assumed_reinsurance, '2'),
+        ('ceded', df_10, ge.process_ceded_reinsurance, '2'),
+    ]
+    entries = {line: measure(records, f'process_{line}', lambda df=df, process=process: process(df),
+                             rows_in=len(df))
+               for line, df, process, _ in lines}
+    finals = {line: measure(records, f'transform_{line}',
+                            lambda line=line, insurance_type=insurance_type: ge.transform_to_final_format(
+                                entries[line], insurance_type, mappings, account_period=args.val_month))
+              for line, _, _, insurance_type in lines}
+
+    sheets = {'直保': finals['direct'], '分入': finals['assumed'], '分出': finals['ceded']}
+    with tempfile.TemporaryDirectory(prefix='bench_out_') as out_dir:
+        measure(records, f'write_{args.output_format}',
+                lambda: write_sheets(sheets, os.path.join(out_dir, '未到期分录结果.xlsx'),
+                                     default_format=args.output_format),
+                rows_in=sum(len(df) for df in sheets.values()), rows_out=lambda s: sum(x['rows'] for x in s))
+
+# --- Reporting ---
+
+def _config(args):
+    return {key: getattr(args, key) for key in ('source', 'rows', 'rein_rows', 'profiles', 'ingest',
+                                                'output_format', 'val_month', 'seed')}
+
+def _previous_run(path, config):
+    """Returns the latest recorded run with the same configuration, if any."""
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get('config') == config:
+                previous = run
+    return previous
+
+def print_report(records, previous=None):
+    """Prints one line per stage, with the change against a previous run when given."""
+    before = {r['stage']: r for r in previous['stages']} if previous else {}
+    print(f"\n{'stage':<20}{'seconds':>10}{'rows_in':>12}{'rows_out':>12}{'rows/s':>14}{'peak RSS MB':>13}  vs 上次")
+    for r in records:
+        delta = ''
+        if r['stage'] in before:
+            delta = f"{r['seconds'] / max(before[r['stage']]['seconds'], 1e-9):.2f}x"
+        rows_in = '' if r['rows_in'] is None else r['rows_in']
+        print(f"{r['stage']:<20}{r['seconds']:>10.3f}{rows_in:>12}{r['rows_out']:>12}"
+              f"{r['rows_per_sec']:>14,.0f}{r['peak_rss_mb']:>13.1f}  {delta}")
+
+def save_run(path, config, records):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    run = {'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'), 'config': config, 'stages': records}
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run, ensure_ascii=False) + '\n')
+
+def run_benchmark(args):
+    mappings = ge.load_segment_mappings() or _empty_mappings()
+    pools = build_value_pools(mappings=mappings)
+
+    records = []
+    if args.source == 'postgres':
+        results = extract_from_postgres(records, args, pools)
+    else:
+        results = extract_in_memory(records, args, pools)
+    run_pipeline(records, results, mappings, args)
+
+    config = _config(args)
+    print_report(records, _previous_run(args.results, config))
+    if args.results:
+        save_run(args.results, config, records)
+        print(f"\n基准结果已追加到 {args.results}")
+    return records
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='未到期分录流程的合成数据基准测试')
+    parser.add_argument('--rows', type=int, default=100000, help='直保源表行数（1e5 ~ 1e8）')
+    parser.add_argument('--rein-rows', type=int, help='再保源表行数，默认与 --rows 相同')
+    parser.add_argument('--profiles', type=int, default=DEFAULT_PROFILES, help='维度组合个数（聚合后行数上限）')
+    parser.add_argument('--chunk-rows', type=int, default=DEFAULT_CHUNK_ROWS, help='生成数据的分块行数')
+    parser.add_argument('--source', choices=('memory', 'postgres'), default='memory',
+                        help='memory：内存中模拟取数 SQL；postgres：装载到本地 PostgreSQL 后真实取数')
+    parser.add_argument('--pg-host', help='已有的测试数据库；不指定时用 initdb 启动临时实例')
+    parser.add_argument('--pg-port', default='5432')
+    parser.add_argument('--pg-database', default='postgres')
+    parser.add_argument('--pg-user', default='postgres')
+    parser.add_argument('--pg-password', default='')
+    parser.add_argument('--keep-data', action='store_true', help='结束后保留 measure_platform 中的合成数据')
+    parser.add_argument('--ingest', choices=INGEST_METHODS, default='pandas', help='数据库取数方式')
+    parser.add_argument('--max-workers', type=int, default=3, help='并发提取的最大连接数')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='xlsx', help='写出格式')
+    parser.add_argument('--val-month', default=ge.VAL_MONTH, help='评估月份（yyyyMM）')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--results', default=RESULTS_PATH, help='结果追加写入的 JSON lines 文件，空字符串表示不保存')
+    args = parser.parse_args(argv)
+    if args.rein_rows is None:
+        args.rein_rows = args.rows
+    return args
+
+if __name__ == '__main__':
+    run_benchmark(parse_args())
@@ -0,0 +1,299 @@
+import io
+import re
+
+import numpy as np
+import pandas as pd
+
+from periods import period_params
+
+# --- Synthetic Source Tables ---
+# 与 measure_platform 中两张源表同列的合成数据，用于在本地 PostgreSQL 或内存中做性能测试。
+# 只生成取数 SQL 用到的列：维度列、金额列以及 WHERE 条件用到的日期列。
+
+SCHEMA = 'measure_platform'
+DIRECT_TABLE = 'measure_cx_unexpired'
+REIN_TABLE = 'int_measure_cx_unexpired_rein'
+
+# 列名 -> PostgreSQL 类型（维度和日期与源表一样以文本存储）
+DIRECT_COLUMNS = {
+    'val_month': 'text', 'val_method': 'text', 'com_code': 'text', 'business_nature': 'text',
+    'car_kind_code': 'text', 'use_nature_code': 'text', 'portfolio_id': 'text', 'group_id': 'text',
+    'risk_code': 'text', 'class_code': 'text', 'ini_confirm': 'text', 'start_date': 'text', 'end_date': 'text',
+    'total_premium': 'numeric', 'total_iacf_amt': 'numeric', 'acc_confirmed_premium': 'numeric',
+    'acc_iacf_premium': 'numeric', 'lrc_loss_cost_policy': 'numeric', 'ifie_amt': 'numeric',
+}
+
+REIN_COLUMNS = {
+    'val_month': 'text', 'val_method': 'text', 'com_code': 'text', 'car_kind_code': 'text',
+    'use_nature_code': 'text', 'portfolio_id': 'text', 'group_id': 'text', 'risk_code': 'text',
+    'class_code': 'text', 'contract_flag': 'text', 'enquiry_type': 'text', 'contract_type': 'text',
+    'rein_type': 'text', 'certi_no': 'text', 'under_write_date': 'text', 'certi_write_date': 'text',
+    'start_date': 'text', 'end_date': 'text',
+    'premium': 'numeric', 'commission': 'numeric', 'brokerage': 'numeric', 'net_premium_amortization': 'numeric',
+    'cumulative_ifie_amt_amortization': 'numeric', 'cumulative_no_iacf_amortization': 'numeric',
+    'no_iacf_cash_flow': 'numeric', 'loss_component_allocation': 'numeric', 'loss_component': 'numeric',
+    'base_investment_amortization': 'numeric', 'cumulative_ifie_amt': 'numeric',
+}
+
+TABLE_COLUMNS = {DIRECT_TABLE: DIRECT_COLUMNS, REIN_TABLE: REIN_COLUMNS}
+
+# 各维度的取值个数，接近生产数据（机构 ~140、险种 ~110、渠道 16 ...）
+DEFAULT_CARDINALITY = {
+    'com_code': 140, 'business_nature': 16, 'car_kind_code': 21, 'use_nature_code': 12,
+    'portfolio_id': 24, 'groups_per_portfolio': 2, 'risk_code': 110, 'class_code': 11,
+}
+
+# 分入（val_method=11）只占再保表的一小部分，其余为分出（10）
+ASSUMED_SHARE = 0.01
+
+DEFAULT_CHUNK_ROWS = 1000000
+
+# 维度组合个数（聚合后的行数上限），源表行数远大于分组数
+DEFAULT_PROFILES = 20000
+
+# --- Value Pools ---
+
+def _code_pool(prefix, size, width):
+    return np.array([f"{prefix}{i:0{width}d}" for i in range(size)], dtype=object)
+
+def build_value_pools(cardinality=None, mappings=None):
+    """
+    Builds the dimension value pools. With `mappings` (see mapping_registry.load_mappings)
+    organisation, risk, channel and car codes are drawn from the real mapping keys, so
+    segment lookups hit at a realistic rate.
+    """
+    card = {**DEFAULT_CARDINALITY, **(cardinality or {})}
+    pools = {
+        'com_code': _code_pool('44', card['com_code'], 4),
+        'business_nature': _code_pool('1900', card['business_nature'], 6),
+        'car_kind_code': _code_pool('3650', card['car_kind_code'], 2),
+        'use_nature_code': _code_pool('364113', card['use_nature_code'], 3),
+        'risk_code': _code_pool('6', card['risk_code'], 4),
+        'class_code': _code_pool('', card['class_code'], 3),
+    }
+    if mappings is not None:
+        for col, name in (('com_code', 'org'), ('risk_code', 'product'), ('business_nature', 'channel')):
+            keys = np.asarray(mappings[name].index, dtype=object)
+            if len(keys):
+                pools[col] = keys[:card[col]]
+        car_keys = [key.split('_', 1) for key in mappings['car'].index if '_' in key]
+        if car_keys:
+            uses, kinds = zip(*car_keys)
+            pools['use_nature_code'] = np.array(sorted(set(uses)), dtype=object)[:card['use_nature_code']]
+            pools['car_kind_code'] = np.array(sorted(set(kinds)), dtype=object)[:card['car_kind_code']]
+
+    portfolios = _code_pool('QHP', card['portfolio_id'], 3)
+    pools['portfolio_id'] = np.repeat(portfolios, card['groups_per_portfolio'])
+    pools['group_id'] = np.array([f"{p}APAA{g}0000" for p in portfolios
+                                  for g in range(1, card['groups_per_portfolio'] + 1)], dtype=object)
+    return pools
+
+def _skewed_choice(rng, size, n):
+    """Zipf-like draw: a few organisations and risks carry most of the business."""
+    weights = 1.0 / np.arange(1, size + 1)
+    return rng.choice(size, size=n, p=weights / weights.sum())
+
+# --- Row Generation ---
+
+# 起期分布在评估月末前两年内，约 10% 落在下一个月（会被过滤掉），保险期间一年
+_HISTORY_DAYS = 730
+_LEAD_DAYS = 31
+
+def _date_pools(val_month):
+    cutoff = pd.Timestamp(period_params(val_month)['cutoff_iso'])
+    dates = pd.date_range(cutoff - pd.Timedelta(days=_HISTORY_DAYS + _LEAD_DAYS),
+                          periods=_HISTORY_DAYS + 2 * _LEAD_DAYS + 366, freq='D')
+    return dates.strftime('%Y-%m-%d').to_numpy(dtype=object), dates.strftime('%Y%m%d').to_numpy(dtype=object)
+
+def _policy_days(rng, n):
+    """Returns (sign, start, end) day indices into the date pools."""
+    start = rng.integers(_LEAD_DAYS, _LEAD_DAYS + _HISTORY_DAYS, n)
+    late = rng.random(n) < 0.1
+    start[late] = rng.integers(_LEAD_DAYS + _HISTORY_DAYS, _HISTORY_DAYS + 2 * _LEAD_DAYS, late.sum())
+    sign = start - rng.integers(0, _LEAD_DAYS, n)
+    return sign, start, start + 365
+
+def _dimension_profiles(rng, pools, n_profiles):
+    """
+    Draws the distinct dimension combinations (GROUP BY keys) rows are spread over;
+    n_profiles bounds the size of the aggregated extraction result.
+    """
+    risk = _skewed_choice(rng, len(pools['risk_code']), n_profiles)
+    group = rng.integers(0, len(pools['group_id']), n_profiles)
+    return {
+        'com_code': pools['com_code'][_skewed_choice(rng, len(pools['com_code']), n_profiles)],
+        'business_nature': pools['business_nature'][rng.integers(0, len(pools['business_nature']), n_profiles)],
+        'car_kind_code': pools['car_kind_code'][rng.integers(0, len(pools['car_kind_code']), n_profiles)],
+        'use_nature_code': pools['use_nature_code'][rng.integers(0, len(pools['use_nature_code']), n_profiles)],
+        'portfolio_id': pools['portfolio_id'][group],
+        'group_id': pools['group_id'][group],
+        'risk_code': pools['risk_code'][risk],
+        # 险类由险种决定
+        'class_code': pools['class_code'][risk % len(pools['class_code'])],
+        'contract_flag': np.where(rng.random(n_profiles) < 0.7, '2', '1').astype(object),
+        'rein_type': np.where(rng.random(n_profiles) < 0.8, '1', '2').astype(object),
+    }
+
+def _take_profiles(profiles, rows, columns):
+    return {col: profiles[col][rows] for col in columns}
+
+def _amount(rng, base, low, high, decimals=6):
+    return np.round(base * rng.uniform(low, high, len(base)), decimals)
+
+def _premium(rng, n):
+    premium = np.round(rng.lognormal(mean=8.0, sigma=1.5, size=n), 2)
+    # 少量批退产生负保费
+    premium[rng.random(n) < 0.02] *= -1
+    return premium
+
+_DIRECT_DIMENSIONS = ['com_code', 'business_nature', 'car_kind_code', 'use_nature_code', 'portfolio_id',
+                      'group_id', 'risk_code', 'class_code']
+_REIN_DIMENSIONS = ['com_code', 'car_kind_code', 'use_nature_code', 'portfolio_id', 'group_id', 'risk_code',
+                    'class_code', 'contract_flag', 'rein_type']
+
+def generate_direct_chunks(n_rows, val_month='202412', pools=None, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS,
+                           n_profiles=DEFAULT_PROFILES):
+    """Yields synthetic measure_cx_unexpired rows (val_method '8') in chunks."""
+    pools = pools or build_value_pools()
+    rng = np.random.default_rng(seed)
+    profiles = _dimension_profiles(rng, pools, n_profiles)
+    iso_dates, _ = _date_pools(val_month)
+    for offset in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - offset)
+        sign, start, end = _policy_days(rng, n)
+        premium = _premium(rng, n)
+        chunk = {
+            'val_month': np.full(n, val_month, dtype=object), 'val_method': np.full(n, '8', dtype=object),
+            **_take_profiles(profiles, _skewed_choice(rng, n_profiles, n), _DIRECT_DIMENSIONS),
+            'ini_confirm': iso_dates[sign], 'start_date': iso_dates[start], 'end_date': iso_dates[end],
+            'total_premium': premium,
+            'total_iacf_amt': _amount(rng, premium, 0.05, 0.4),
+            'acc_confirmed_premium': _amount(rng, premium, 0.0, 1.0),
+            'acc_iacf_premium': _amount(rng, premium, 0.0, 0.2),
+            'lrc_loss_cost_policy': _amount(rng, premium, 0.0, 0.1),
+            'ifie_amt': _amount(rng, premium, 0.0, 0.01),
+        }
+        yield pd.DataFrame(chunk, columns=list(DIRECT_COLUMNS))
+
+def generate_rein_chunks(n_rows, val_month='202412', pools=None, seed=1, chunk_rows=DEFAULT_CHUNK_ROWS,
+                         n_profiles=DEFAULT_PROFILES, assumed_share=ASSUMED_SHARE):
+    """Yields synthetic int_measure_cx_unexpired_rein rows (val_method '10' and '11') in chunks."""
+    pools = pools or build_value_pools()
+    rng = np.random.default_rng(seed)
+    profiles = _dimension_profiles(rng, pools, n_profiles)
+    assumed_profiles = rng.random(n_profiles) < assumed_share
+    _, compact_dates = _date_pools(val_month)
+    for offset in range(0, n_rows, chunk_rows):
+        n = min(chunk_rows, n_rows - offset)
+        sign, start, end = _policy_days(rng, n)
+        premium = _premium(rng, n)
+        rows = _skewed_choice(rng, n_profiles, n)
+        assumed = assumed_profiles[rows]
+        has_certi = rng.random(n) < 0.2
+        dims = _take_profiles(profiles, rows, _REIN_DIMENSIONS)
+        # 分入业务没有车辆维度和分出类型
+        for col in ('car_kind_code', 'use_nature_code', 'rein_type'):
+            dims[col] = np.where(assumed, None, dims[col])
+        chunk = {
+            'val_month': np.full(n, val_month, dtype=object),
+            'val_method': np.where(assumed, '11', '10').astype(object),
+            **dims,
+            'enquiry_type': np.full(n, 'PF', dtype=object),
+            'contract_type': np.full(n, 'PT', dtype=object),
+            'certi_no': np.where(has_certi, 'E' + pd.Series(np.arange(offset, offset + n)).astype(str).to_numpy(),
+                                 None).astype(object),
+            'under_write_date': compact_dates[sign],
+            'certi_write_date': np.where(has_certi, compact_dates[np.minimum(sign + 10, start)], None),
+            'start_date': compact_dates[start], 'end_date': compact_dates[end],
+            'premium': premium,
+            'commission': _amount(rng, premium, 0.1, 0.35),
+            'brokerage': np.where(rng.random(n) < 0.1, _amount(rng, premium, 0.0, 0.05), 0.0),
+            'net_premium_amortization': _amount(rng, premium, 0.0, 1.0),
+            'cumulative_ifie_amt_amortization': _amount(rng, premium, 0.0, 0.01),
+            'cumulative_no_iacf_amortization': _amount(rng, premium, 0.0, 0.05),
+            'no_iacf_cash_flow': _amount(rng, premium, 0.0, 0.05),
+            'loss_component_allocation': _amount(rng, premium, 0.0, 0.1),
+            'loss_component': _amount(rng, premium, 0.0, 0.1),
+            'base_investment_amortization': _amount(rng, premium, 0.0, 0.9),
+            'cumulative_ifie_amt': _amount(rng, premium, 0.0, 0.01),
+        }
+        yield pd.DataFrame(chunk, columns=list(REIN_COLUMNS))
+
+# --- Local PostgreSQL Loading ---
+
+def create_source_tables(conn, schema=SCHEMA):
+    """(Re)creates both source tables, unindexed like a plain staging copy."""
+    with conn.cursor() as cur:
+        cur.execute(f'CREATE SCHEMA IF NOT EXISTS "{schema}"')
+        for table, columns in TABLE_COLUMNS.items():
+            cur.execute(f'DROP TABLE IF EXISTS "{schema}"."{table}"')
+            column_defs = ', '.join(f'"{col}" {pg_type}' for col, pg_type in columns.items())
+            cur.execute(f'CREATE TABLE "{schema}"."{table}" ({column_defs})')
+    conn.commit()
+
+def copy_chunks(conn, table, chunks, schema=SCHEMA):
+    """Loads DataFrame chunks into a table with COPY FROM STDIN. Returns the row count."""
+    rows = 0
+    with conn.cursor() as cur:
+        for chunk in chunks:
+            buf = io.StringIO()
+            chunk.to_csv(buf, header=False, index=False, na_rep='\\N')
+            buf.seek(0)
+            columns = ', '.join(f'"{col}"' for col in chunk.columns)
+            cur.copy_expert(f'COPY "{schema}"."{table}" ({columns}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')', buf)
+            rows += len(chunk)
+        cur.execute(f'ANALYZE "{schema}"."{table}"')
+    conn.commit()
+    return rows
+
+# --- In-memory Extraction ---
+
+_DIMENSION_RE = re.compile(r'"(\w+)" AS "([^"]+)"')
+_SUM_RE = re.compile(r'SUM\("(\w+)"\) AS "([^"]+)"')
+
+def _period_mask(chunk, spec, val_month):
+    # 与 EXTRACTION_SPECS 中 additional_where_clause 的含义一致
+    period = period_params(val_month)
+    if DIRECT_TABLE in spec['table_name']:
+        return (chunk['end_date'] > period['cutoff_iso']) & (chunk['start_date'] <= period['cutoff_iso'])
+    return chunk['end_date'] > period['cutoff_compact']
+
+def aggregate_in_memory(chunks, specs, val_month='202412'):
+    """
+    Emulates the extraction queries over in-memory chunks of one source table.
+
+    Args:
+        chunks: 源表数据块（generate_*_chunks 的输出）
+        specs: dict，val_method -> EXTRACTION_SPECS 条目（需来自同一张表）
+
+    Returns:
+        dict，val_method -> 与数据库取数结果同列同名的 DataFrame
+    """
+    partials = {val_method: [] for val_method in specs}
+    plans = {}
+    for val_method, spec in specs.items():
+        sums = _SUM_RE.findall(spec['sql_query'])
+        plans[val_method] = (_DIMENSION_RE.findall(spec['sql_query']), sums)
+
+    for chunk in chunks:
+        for val_method, spec in specs.items():
+            dims, sums = plans[val_method]
+            mask = (chunk['val_month'] == val_month) & (chunk['val_method'] == val_method)
+            part = chunk[mask & _period_mask(chunk, spec, val_month)]
+            partials[val_method].append(
+                part.groupby(spec['group_by_columns'], dropna=False, sort=False)[[col for col, _ in sums]]
+                .sum(min_count=1).reset_index()
+            )
+
+    results = {}
+    for val_method, spec in specs.items():
+        dims, sums = plans[val_method]
+        # 分块聚合后再合并一次，和 SUM 在全表上的结果相同
+        combined = pd.concat(partials[val_method], ignore_index=True)
+        combined = (combined.groupby(spec['group_by_columns'], dropna=False, sort=False)[[col for col, _ in sums]]
+                    .sum(min_count=1).reset_index())
+        frame = pd.DataFrame({alias: combined[col] for col, alias in dims})
+        for col, alias in sums:
+            frame[alias] = combined[col].astype('float64')
+        results[val_method] = frame
+    return results
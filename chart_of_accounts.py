@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+# --- I17 Chart of Accounts ---
+# 所有业务线共用的科目代码 -> 科目名称
+I17_ACCOUNTS = {
+    # 直保
+    "2606010801": "未到期责任负债-未来现金流-现金流/保费-保费收入",
+    "2606011002": "未到期责任负债-未来现金流-现金流/获取费用-手续费及佣金支出/佣金",
+    "2606011102": "未到期责任负债-未来现金流-保费分配法分摊的收入-保费收入/直接业务",
+    "2606011603": "未到期责任负债-未来现金流-获取费用摊销计入支出-保费分配法/直接业务",
+    "2606011202": "未到期责任负债-未来现金流-保费分配法亏损合同损益-亏损提转差/直接业务",
+    "2606011302": "未到期责任负债-未来现金流-保险财务费用-当期计提利息/保费分配法/直接业务",
+    # 分入
+    "2606010901": "未到期责任负债-未来现金流-现金流/分入保费-分保费收入/比例合同",
+    "2606010904": "未到期责任负债-未来现金流-现金流/分入保费-分保费收入/比例临分",
+    "2606010911": "未到期责任负债-未来现金流-现金流/分入保费-分保费用/比例合同",
+    "2606010913": "未到期责任负债-未来现金流-现金流/分入保费-分保费用/比例临分",
+    "2606010921": "未到期责任负债-未来现金流-现金流/分入保费-分保费用/经纪费/比例合同",
+    "2606010923": "未到期责任负债-未来现金流-现金流/分入保费-分保费用/经纪费/比例临分",
+    "2606010990": "未到期责任负债-未来现金流-现金流/分入保费-分保费用/业务及管理费结转",
+    "2606011101": "未到期责任负债-未来现金流-保费分配法分摊的收入-保费收入/分入业务",
+    "2606011602": "未到期责任负债-未来现金流-获取费用摊销计入支出-保费分配法/分入业务",
+    "2606011301": "未到期责任负债-未来现金流-保险财务费用-当期计提利息/保费分配法/分入业务",
+    "2606011201": "未到期责任负债-未来现金流-保费分配法亏损合同损益-亏损提转差/分入业务",
+    # 分出
+    "1252010501": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-直接业务/比例合同",
+    "1252010503": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-直接业务/比例临分",
+    "1252010511": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-分入业务/比例合同",
+    "1252010513": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-分入业务/比例临分",
+    "1252010521": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/直接业务/比例合同",
+    "1252010523": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/直接业务/比例临分",
+    "1252010531": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/分入业务/比例合同",
+    "1252010533": "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/分入业务/比例临分",
+    "1252010301": "分保摊回未到期责任资产-未来现金流-保费分配法分摊的分出保费-分出保费/直接业务",
+    "1252010302": "分保摊回未到期责任资产-未来现金流-保费分配法分摊的分出保费-分出保费/分入业务",
+    "1252010401": "分保摊回未到期责任资产-未来现金流-保费分配法亏损摊回调整-亏损摊回调整/直接业务",
+    "1252010402": "分保摊回未到期责任资产-未来现金流-保费分配法亏损摊回调整-亏损摊回调整/分入业务",
+    "1252010201": "分保摊回未到期责任资产-未来现金流-摊回赔付/投资成分-摊回赔付支出/直接业务/比例合同",
+    "1252010202": "分保摊回未到期责任资产-未来现金流-摊回赔付/投资成分-摊回赔付支出/直接业务/比例临分",
+    "1253010501": "分保摊回已发生赔款资产-未来现金流-摊回赔付/投资成分-应收分保账款/摊回分保赔款/直接业务/比例合同",
+    "1253010502": "分保摊回已发生赔款资产-未来现金流-摊回赔付/投资成分-应收分保账款/摊回分保赔款/直接业务/比例临分",
+    "1252010101": "分保摊回未到期责任资产-未来现金流-保险财务费用-计息及金融假设的变化/直接业务",
+    "1252010102": "分保摊回未到期责任资产-未来现金流-保险财务费用-计息及金融假设的变化/分入业务",
+}
+
+# 科目代码和科目名称的分类类型，类别顺序固定，不同业务线的分录可以直接拼接
+ACCOUNT_CODE_DTYPE = pd.CategoricalDtype(list(I17_ACCOUNTS))
+ACCOUNT_NAME_DTYPE = pd.CategoricalDtype(list(dict.fromkeys(I17_ACCOUNTS.values())))
+
+_NAME_CODE_BY_ACCOUNT = ACCOUNT_NAME_DTYPE.categories.get_indexer(list(I17_ACCOUNTS.values()))
+
+def account_code_indices(codes):
+    """
+    Returns the category index of each account code (-1 for missing values).
+    Raises ValueError for a code that is not in the chart of accounts.
+    """
+    codes = pd.Index(codes, dtype=object)
+    indices = ACCOUNT_CODE_DTYPE.categories.get_indexer(codes)
+    unknown = codes[(indices < 0) & codes.notna()]
+    if len(unknown):
+        raise ValueError(f"科目代码不在科目表中: {', '.join(sorted(set(unknown)))}")
+    return indices
+
+def account_codes_from_indices(indices):
+    """Builds the categorical account-code column from category indices."""
+    return pd.Categorical.from_codes(indices, dtype=ACCOUNT_CODE_DTYPE)
+
+def account_names_from_indices(indices):
+    """Builds the categorical account-name column from account-code category indices."""
+    name_codes = np.where(indices < 0, -1, _NAME_CODE_BY_ACCOUNT[indices])
+    return pd.Categorical.from_codes(name_codes, dtype=ACCOUNT_NAME_DTYPE)
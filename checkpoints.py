@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import time
+
+import pandas as pd
+
+from chart_of_accounts import I17_ACCOUNTS
+from parallel_lines import read_arrow_ipc, write_arrow_ipc
+from rule_engine import BUSINESS_LINES
+from snapshot_cache import HAS_PYARROW
+
+# --- Stage Checkpoints ---
+# 流水线按阶段划分：提取（每个 val_method）-> 加载映射 -> 规则展开（每条业务线）-> 转换（每条业务线）-> 写出。
+# 每个阶段的键是其输入的哈希：上游阶段的键（提取阶段为源数据内容的哈希）、规则表、映射、评估月份等。
+# 阶段完成后输出以 Arrow IPC 存为检查点（读回时内存映射），键写在旁边的 JSON 中；
+# 以 resume 方式重跑时，键一致的阶段直接读取检查点，从第一个输入变化或上次失败的阶段开始重新计算。
+# 提取阶段的检查点就是 snapshot_cache 的快照；写出阶段只记录完成标记和写出的文件。
+
+CHECKPOINT_DIR = '.checkpoints'
+CHECKPOINT_VERSION = 2
+
+def digest(*parts):
+    """Returns a short hash of the given strings (stage keys, options, upstream keys)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+def frame_digest(df):
+    """Content hash of a DataFrame: column names, dtypes and every value (order-sensitive)."""
+    h = hashlib.sha256()
+    h.update(repr([(col, str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+    h.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+def rules_digest():
+    """Hash of the rule tables and the chart of accounts, the code-side inputs of expansion."""
+    return digest(repr(BUSINESS_LINES), repr(sorted(I17_ACCOUNTS.items())))
+
+def mappings_digest(mappings):
+    """Hash of the compiled segment mappings."""
+    h = hashlib.sha256()
+    for name in sorted(mappings):
+        h.update(name.encode('utf-8'))
+        h.update(pd.util.hash_pandas_object(mappings[name]).to_numpy().tobytes())
+    return h.hexdigest()[:16]
+
+class CheckpointStore:
+    """
+    Per-period checkpoint directory: one Arrow IPC file plus a JSON key file per stage.
+
+    Args:
+        val_month: 评估月份，检查点按期间分目录
+        resume: True 时键一致的阶段从检查点读取；False 时只写不读
+        checkpoint_dir: 检查点根目录
+    """
+
+    def __init__(self, val_month, resume=False, checkpoint_dir=CHECKPOINT_DIR):
+        self.val_month = val_month
+        self.resume = resume
+        self.path = os.path.join(checkpoint_dir, str(val_month))
+        # 本次运行各阶段的键，下游阶段据此计算自己的键
+        self.keys = {}
+
+    def _files(self, stage):
+        base = os.path.join(self.path, stage)
+        return base + '.arrow', base + '.json'
+
+    def _meta(self, stage):
+        _, meta_path = self._files(stage)
+        if not os.path.exists(meta_path):
+            return None
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except Exception as e:
+            print(f"读取检查点 {meta_path} 时出错: {e}")
+            return None
+        return meta if meta.get('version') == CHECKPOINT_VERSION else None
+
+    def has(self, stage, key):
+        """True if resuming and `stage` has a complete checkpoint for `key`."""
+        meta = self._meta(stage)
+        return (self.resume and meta is not None and meta['key'] == key
+                and os.path.exists(self._files(stage)[0]))
+
+    def load(self, stage, key):
+        """Returns the checkpointed frame of `stage` for `key`, or None."""
+        if not self.has(stage, key):
+            return None
+        data_path, meta_path = self._files(stage)
+        try:
+            df = read_arrow_ipc(data_path)
+        except Exception as e:
+            print(f"读取检查点 {data_path} 时出错，将重新计算: {e}")
+            # 作废该检查点，重算后会重新写入
+            os.remove(meta_path)
+            return None
+        print(f"阶段 {stage} 的输入未变化，已从检查点恢复 ({len(df)} 行)")
+        return df
+
+    def save(self, stage, key, df):
+        """Writes the frame of `stage` under `key`; the key file is written last."""
+        os.makedirs(self.path, exist_ok=True)
+        data_path, meta_path = self._files(stage)
+        # 先删除旧的键，写数据中途失败时不会留下键一致但数据不完整的检查点
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        try:
+            write_arrow_ipc(df, data_path + '.tmp')
+            os.replace(data_path + '.tmp', data_path)
+        except Exception as e:
+            print(f"写入检查点 {data_path} 时出错: {e}")
+            if os.path.exists(data_path + '.tmp'):
+                os.remove(data_path + '.tmp')
+            return
+        self._write_meta(stage, key, rows=len(df))
+
+    def _write_meta(self, stage, key, **fields):
+        _, meta_path = self._files(stage)
+        meta = {'version': CHECKPOINT_VERSION, 'stage': stage, 'key': key,
+                'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), **fields}
+        with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def run(self, stage, key, compute):
+        """
+        Returns the checkpointed output of `stage` if its key is unchanged, otherwise
+        computes it with `compute()` and checkpoints the result.
+        Returns (frame, True if it came from the checkpoint).
+        """
+        self.keys[stage] = key
+        df = self.load(stage, key)
+        if df is not None:
+            return df, True
+        df = compute()
+        self.save(stage, key, df)
+        return df, False
+
+    def is_done(self, stage, key):
+        """
+        True if resuming and a side-effect stage (e.g. writing files) completed for
+        `key` and all the files it recorded still exist.
+        """
+        meta = self._meta(stage)
+        return (self.resume and meta is not None and meta['key'] == key
+                and all(os.path.exists(path) for path in meta.get('files', [])))
+
+    def mark_done(self, stage, key, files=()):
+        """Records that a side-effect stage completed for `key`."""
+        os.makedirs(self.path, exist_ok=True)
+        self._write_meta(stage, key, files=list(files))
+
+def open_checkpoints(val_month, resume=False, checkpoint_dir=CHECKPOINT_DIR):
+    """Returns a CheckpointStore, or None (with a warning) if pyarrow is not installed."""
+    if not HAS_PYARROW:
+        print("警告：未安装 pyarrow，阶段检查点已关闭。")
+        return None
+    return CheckpointStore(val_month, resume=resume, checkpoint_dir=checkpoint_dir)
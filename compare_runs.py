@@ -0,0 +1,220 @@
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from amounts import to_fen, to_yuan
+from generate_entries import FINAL_COLUMNS, SHEET_NAMES
+from incremental import concat_entries
+from ledger_rollup import group_codes
+from output_writers import print_writer_report, output_path_for, write_sheets
+from parallel_lines import read_arrow_ipc
+from snapshot_cache import HAS_PYARROW
+
+# --- Run-to-run Variance of Entry Outputs ---
+# 比较两次运行的最终分录（如规则或映射调整前后），解释金额差异。
+# 每次运行可以是：输出文件的基础路径（优先读同名的 parquet / csv.gz / csv 分表文件，都没有时才读 xlsx）、
+# 阶段检查点目录（.checkpoints/<val_month>，读 transform_<line>.arrow）或增量状态目录（.incremental_state/<val_month>）。
+# 两侧按 分表 + 借贷方向 + 最终段值键（科目、全部 *_segment 段、合同组合/分组）对齐：
+# 两侧的键列拼接后统一哈希编码为组号（即哈希连接），按组和侧别用 bincount 对带符号金额（分）求和，
+# 每个键归为 新增（只在新运行中）、删除（只在基准运行中）、变化（两侧金额不同）或不变，
+# 再按科目和机构段汇总新增、删除、变化的金额。
+
+SEGMENT_KEY_COLUMNS = (['account_code'] + [col for col in FINAL_COLUMNS if col.endswith('_segment')]
+                       + ['portfolio_id', 'insurance_contract_group_id'])
+KEY_COLUMNS = ['sheet', 'dc_cd'] + SEGMENT_KEY_COLUMNS
+AMOUNT_COLUMN = 'dc_local_currency_amt'
+
+# 输出文件的读取顺序：列式格式优先
+RUN_FORMATS = ('parquet', 'csv.gz', 'csv')
+
+STATUS_LABELS = {'added': '新增', 'removed': '删除', 'changed': '变化'}
+
+VARIANCE_COLUMNS = ['added_keys', 'removed_keys', 'changed_keys', 'base_amt', 'new_amt',
+                    'added_amt', 'removed_amt', 'changed_amt', 'difference']
+
+def _str_key(values):
+    """Dictionary-encodes a key column with str categories, keeping missing values missing."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    category_codes, categories = pd.factorize(pd.Index(uniques).astype(str))
+    if len(uniques):
+        codes = np.where(codes >= 0, category_codes[np.maximum(codes, 0)], -1)
+    return pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+
+def _normalize(df, sheet_name, in_fen):
+    """Keeps the key columns and the signed amount (as int64 fen) of one sheet."""
+    missing = [col for col in KEY_COLUMNS[1:] + [AMOUNT_COLUMN] if col not in df.columns]
+    if missing:
+        raise ValueError(f"分表 {sheet_name} 缺少列: {', '.join(missing)}")
+    columns = {'sheet': pd.Categorical([sheet_name] * len(df), categories=pd.Index([sheet_name], dtype=object))}
+    for col in KEY_COLUMNS[1:]:
+        columns[col] = _str_key(df[col])
+    amounts = df[AMOUNT_COLUMN]
+    columns[AMOUNT_COLUMN] = amounts.to_numpy(dtype='int64') if in_fen else to_fen(amounts)
+    return pd.DataFrame(columns)
+
+def _read_sheet_file(path, fmt):
+    columns = KEY_COLUMNS[1:] + [AMOUNT_COLUMN]
+    if fmt == 'parquet':
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype={col: str for col in columns[:-1]},
+                       encoding='utf-8-sig', compression='gzip' if fmt == 'csv.gz' else None)
+
+def load_run(source):
+    """
+    Loads the final entries of one run.
+
+    Args:
+        source: 输出文件的基础路径（如 未到期分录结果.xlsx），或检查点 / 增量状态目录
+
+    Returns:
+        DataFrame：KEY_COLUMNS（键列为 categorical）和带符号金额（分）；
+        找不到任何分表时抛出 FileNotFoundError
+    """
+    frames = []
+    if os.path.isdir(source):
+        if not HAS_PYARROW:
+            raise RuntimeError("读取检查点或增量状态需要安装 pyarrow")
+        for line, sheet_name in SHEET_NAMES.items():
+            arrow_path = os.path.join(source, f'transform_{line}.arrow')
+            parquet_path = os.path.join(source, f'entries_{line}.parquet')
+            if os.path.exists(parquet_path):
+                frames.append(_normalize(pd.read_parquet(parquet_path), sheet_name, in_fen=True))
+            elif os.path.exists(arrow_path):
+                frames.append(_normalize(read_arrow_ipc(arrow_path), sheet_name, in_fen=True))
+    else:
+        xlsx_sheets = []
+        for sheet_name in SHEET_NAMES.values():
+            for fmt in RUN_FORMATS:
+                path = output_path_for(source, sheet_name, fmt)
+                if os.path.exists(path):
+                    frames.append(_normalize(_read_sheet_file(path, fmt), sheet_name, in_fen=False))
+                    break
+            else:
+                xlsx_sheets.append(sheet_name)
+        if xlsx_sheets and source.endswith('.xlsx') and os.path.exists(source):
+            print(f"警告：{source} 没有列式格式的分表文件，读取 xlsx（较慢）: {', '.join(xlsx_sheets)}")
+            columns = KEY_COLUMNS[1:] + [AMOUNT_COLUMN]
+            workbook = pd.read_excel(source, sheet_name=None, usecols=columns,
+                                     dtype={col: str for col in columns[:-1]})
+            for sheet_name in xlsx_sheets:
+                if sheet_name in workbook:
+                    frames.append(_normalize(workbook[sheet_name], sheet_name, in_fen=False))
+    if not frames:
+        raise FileNotFoundError(f"在 {source} 中找不到任何分录分表")
+    return concat_entries(frames)
+
+def diff_runs(base, new):
+    """
+    Aligns two runs on KEY_COLUMNS and compares their summed amounts.
+
+    Returns:
+        每个键一行的 DataFrame：KEY_COLUMNS、base_rows、new_rows、base_amt、new_amt（分）、status
+        （added / removed / changed / unchanged）
+    """
+    combined = concat_entries([base, new])
+    groups, n_groups = group_codes(combined, KEY_COLUMNS)
+    side = np.repeat([0, 1], [len(base), len(new)])
+    flat = side * n_groups + groups
+    # 每格金额合计低于 2**53 分时 float64 求和是精确的
+    totals = np.rint(np.bincount(flat, weights=combined[AMOUNT_COLUMN].to_numpy(dtype='float64'),
+                                 minlength=2 * n_groups)).astype('int64').reshape(2, n_groups)
+    rows = np.bincount(flat, minlength=2 * n_groups).reshape(2, n_groups)
+
+    _, first = np.unique(groups, return_index=True)
+    keys = combined[KEY_COLUMNS].take(first).reset_index(drop=True)
+    in_base, in_new = rows[0] > 0, rows[1] > 0
+    status = np.select([~in_base, ~in_new, totals[0] != totals[1]], ['added', 'removed', 'changed'], 'unchanged')
+    return keys.assign(base_rows=rows[0], new_rows=rows[1], base_amt=totals[0], new_amt=totals[1],
+                       status=pd.Categorical(status))
+
+def summarize_variance(keyed, by):
+    """
+    Sums the key-level variance per value of `by` (e.g. account_code, org_segment).
+
+    Returns:
+        每个取值一行：VARIANCE_COLUMNS（金额为元），按差额绝对值降序
+    """
+    status = keyed['status'].to_numpy()
+    base_amt, new_amt = keyed['base_amt'].to_numpy(), keyed['new_amt'].to_numpy()
+    parts = pd.DataFrame({
+        by: keyed[by],
+        'added_keys': status == 'added', 'removed_keys': status == 'removed', 'changed_keys': status == 'changed',
+        'base_amt': base_amt, 'new_amt': new_amt,
+        'added_amt': np.where(status == 'added', new_amt, 0),
+        'removed_amt': np.where(status == 'removed', base_amt, 0),
+        'changed_amt': np.where(status == 'changed', new_amt - base_amt, 0),
+    })
+    summary = parts.groupby(by, observed=True, dropna=False).sum()
+    summary['difference'] = summary['new_amt'] - summary['base_amt']
+    summary = summary[summary[['added_keys', 'removed_keys', 'changed_keys']].any(axis=1)]
+    summary = summary.reindex(summary['difference'].abs().sort_values(ascending=False, kind='stable').index)
+    for col in VARIANCE_COLUMNS[3:]:
+        summary[col] = to_yuan(summary[col].to_numpy())
+    return summary.reset_index()[[by] + VARIANCE_COLUMNS]
+
+def print_variance_report(keyed, by_account, by_org, max_rows=10):
+    """Prints the key counts per status, the totals and the largest account and org variances."""
+    counts = keyed['status'].value_counts()
+    base_total, new_total = to_yuan(keyed['base_amt'].sum()), to_yuan(keyed['new_amt'].sum())
+    print(f"\n共 {len(keyed)} 个键: " + '，'.join(f"{label} {int(counts.get(status, 0))}"
+                                          for status, label in STATUS_LABELS.items())
+          + f"，不变 {int(counts.get('unchanged', 0))}")
+    print(f"带符号金额合计: 基准 {base_total:,.2f}，新 {new_total:,.2f}，差额 {new_total - base_total:,.2f}")
+    for label, summary, col in (('科目', by_account, 'account_code'), ('机构', by_org, 'org_segment')):
+        if summary.empty:
+            continue
+        print(f"\n按{label}，差额最大的 {min(max_rows, len(summary))} 个（共 {len(summary)} 个有差异）:")
+        for row in summary.head(max_rows).itertuples(index=False):
+            key = getattr(row, col)
+            key = '<空值>' if pd.isna(key) else key
+            print(f"  {key}: 新增 {row.added_amt:,.2f}，删除 {row.removed_amt:,.2f}，"
+                  f"变化 {row.changed_amt:,.2f}，差额 {row.difference:,.2f}")
+
+def main(base, new, output=None, max_rows=10):
+    """
+    Compares two runs' final entries and reports the variance by account and by org.
+    """
+    print("--- 开始比较两次运行的分录 ---")
+    runs = []
+    for source in (base, new):
+        start = time.perf_counter()
+        try:
+            run = load_run(source)
+        except Exception as e:
+            print(f"读取 {source} 时出错: {e}")
+            return None
+        print(f"已读取 {source}: {len(run)} 行 ({time.perf_counter() - start:.2f} 秒)")
+        runs.append(run)
+
+    start = time.perf_counter()
+    keyed = diff_runs(*runs)
+    by_account = summarize_variance(keyed, 'account_code')
+    by_org = summarize_variance(keyed, 'org_segment')
+    print(f"对齐与汇总完成 ({time.perf_counter() - start:.2f} 秒)")
+    print_variance_report(keyed, by_account, by_org, max_rows=max_rows)
+
+    if output:
+        details = keyed[keyed['status'] != 'unchanged'].reset_index(drop=True)
+        details = details.assign(difference=to_yuan(details['new_amt'].to_numpy() - details['base_amt'].to_numpy()),
+                                 base_amt=to_yuan(details['base_amt'].to_numpy()),
+                                 new_amt=to_yuan(details['new_amt'].to_numpy()),
+                                 status=details['status'].map(STATUS_LABELS).astype(object))
+        fmt = 'csv' if output.endswith('.csv') else 'xlsx'
+        print("\n正在写出差异明细...")
+        print_writer_report(write_sheets({'按科目': by_account, '按机构': by_org, '差异明细': details},
+                                         output, default_format=fmt))
+
+    print("\n--- 比较完成 ---")
+    return keyed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='比较两次运行的最终分录，按科目和机构报告新增、删除、变化的金额')
+    parser.add_argument('base', help='基准运行：输出文件的基础路径（如 未到期分录结果.xlsx），或检查点 / 增量状态目录')
+    parser.add_argument('new', help='新运行，格式同 base')
+    parser.add_argument('--output', help='将差异汇总和明细写出到 xlsx/csv 文件')
+    parser.add_argument('--top', type=int, default=10, help='按科目 / 机构各打印差额最大的行数')
+    args = parser.parse_args()
+    main(args.base, args.new, output=args.output, max_rows=args.top)
@@ -1,7 +1,15 @@
+import argparse
+
 import pandas as pd
 import psycopg2
 from psycopg2 import OperationalError
 
+from extraction import render_where_clause
+from generate_entries import EXTRACTION_SPECS, VAL_MONTH
+from mapping_registry import MAPPING_DIR, SEGMENT_TABLES, copy_mappings_to_temp_tables, load_mappings
+from output_writers import print_writer_report, write_sheets
+from periods import validate_val_month
+
 # --- Database Connection Parameters ---
 DB_PARAMS = {
     'host': '10.128.21.148',
@@ -11,30 +19,85 @@ DB_PARAMS = {
     'password': 'readonly_cas25_test'
 }
 
-def get_distinct_risk_codes_from_db():
+# --- Segment Keys per Source Table ---
+# 与 transform_to_final_format 的取键方式一致：源列去空格后作为映射键，
+# 车型段为 使用性质代码_车辆种类，再保没有业务渠道，统一按 '0' 映射。
+
+def _trim(col):
+    return f'btrim("{col}"::text)'
+
+SEGMENT_KEYS = {
+    'product': lambda val_method: _trim('risk_code'),
+    'org': lambda val_method: _trim('com_code'),
+    'cost_center': lambda val_method: _trim('com_code'),
+    'channel': lambda val_method: _trim('business_nature') if val_method == '8' else "'0'",
+    'car': lambda val_method: f"{_trim('use_nature_code')} || '_' || {_trim('car_kind_code')}",
+}
+
+# 用于衡量影响金额的保费列
+AMOUNT_COLUMNS = {'8': 'total_premium', '11': 'premium', '10': 'premium'}
+
+SEGMENT_LABELS = {
+    'product': '产品段 (risk_code)', 'org': '机构段 (com_code)', 'cost_center': '成本中心段 (com_code)',
+    'channel': '渠道段 (business_nature)', 'car': '车型段 (use_nature_code_car_kind_code)',
+}
+
+def build_coverage_query(val_month):
     """
-    Connects to the database and fetches a unique list of risk codes
-    for direct business from the measurement results table.
+    Builds one statement that finds every source key without a mapping, for all
+    five segments across the three val_methods.
+
+    Each val_method's source rows are first collapsed to their distinct key tuples
+    (with row counts and premium), then anti-joined against the temp mapping tables.
     """
+    ctes, selects = [], []
+    for val_method, spec in EXTRACTION_SPECS.items():
+        where_clause = render_where_clause(spec['additional_where_clause'], val_month)
+        key_columns = ', '.join(f"{key(val_method)} AS \"{segment}_key\"" for segment, key in SEGMENT_KEYS.items())
+        ctes.append(f"""
+        src_{val_method} AS (
+            SELECT {key_columns}, count(*) AS n_rows, COALESCE(SUM("{AMOUNT_COLUMNS[val_method]}"), 0) AS amount
+            FROM {spec['table_name']}
+            WHERE "val_month" = '{val_month}' AND "val_method" = '{val_method}' {where_clause}
+            GROUP BY {', '.join(str(i + 1) for i in range(len(SEGMENT_KEYS)))}
+        )""")
+        for segment in SEGMENT_KEYS:
+            selects.append(f"""
+        SELECT '{val_method}' AS val_method, '{segment}' AS segment, s."{segment}_key" AS key,
+               SUM(s.n_rows) AS n_rows, COALESCE(SUM(s.amount), 0) AS amount
+        FROM src_{val_method} AS s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM pg_temp."{SEGMENT_TABLES[segment]}" AS m WHERE m."key" = s."{segment}_key"
+        )
+        GROUP BY s."{segment}_key"
+        """)
+    return f"WITH {','.join(ctes)}\n{' UNION ALL '.join(selects)}\nORDER BY segment, val_method, n_rows DESC"
+
+def find_missing_mappings(val_month=VAL_MONTH, mappings=None):
+    """
+    Uploads the compiled mapping keys and runs the anti-joins in the same session.
+
+    Returns:
+        DataFrame（val_method, segment, key, n_rows, amount），每行是一个缺失映射的键；
+        出错时返回 None
+    """
+    validate_val_month(val_month)
+    if mappings is None:
+        try:
+            mappings = load_mappings()
+        except FileNotFoundError as e:
+            print(f"错误：映射文件未找到 - {e}")
+            print(f"请确保所有映射文件都存在于 '{MAPPING_DIR}/' 目录下。")
+            return None
+
     conn = None
     try:
         conn = psycopg2.connect(**DB_PARAMS)
-        print("数据库连接成功！正在查询直保业务的险种代码...")
-        
-        # This query fetches the distinct risk codes for the same data scope
-        # as the main script's direct business processing.
-        query = """
-        SELECT DISTINCT "risk_code"
-        FROM "measure_platform"."measure_cx_unexpired"
-        WHERE "val_month" = '202412' AND "val_method" = '8' AND "end_date" > '20241231'
-        """
-        
-        df = pd.read_sql_query(query, conn)
-        print("险种代码查询完成！")
-        
-        # Filter out any potential None or NaN values and return as a set
-        return set(df['risk_code'].dropna())
-        
+        print(f"数据库连接成功！正在上传映射并校验覆盖率 (val_month = '{val_month}')...")
+        copy_mappings_to_temp_tables(conn, mappings)
+        df = pd.read_sql_query(build_coverage_query(val_month), conn)
+        print("映射覆盖率校验查询完成！")
+        return df
     except OperationalError as e:
         print(f"数据库连接失败: {e}")
         return None
@@ -46,57 +109,45 @@ def get_distinct_risk_codes_from_db():
             conn.close()
             print("数据库连接已关闭。")
 
-def get_product_mapping_codes():
-    """
-    Loads the product mapping from the Excel file and returns the codes.
-    """
-    try:
-        print("正在加载产品段值转换映射文件...")
-        map_product_df = pd.read_excel(
-            '给翟总/财务段值转换/产品管理导出列表.xls', 
-            header=None, 
-            usecols=[0], 
-            names=['code'],
-            dtype=str
-        )
-        map_product_df.dropna(inplace=True)
-        print("映射文件加载完成。")
-        return set(map_product_df['code'])
-    except FileNotFoundError:
-        print("错误: 映射文件 '给翟总/财务段值转换/产品管理导出列表.xls' 未找到。")
-        return None
-    except Exception as e:
-        print(f"加载映射文件时发生错误: {e}")
-        return None
+def print_coverage_report(missing):
+    """Prints the missing keys per segment with the rows and premium they affect."""
+    if missing.empty:
+        print("\n恭喜！三张来源数据中的所有键都能在五个段值映射中找到。")
+        return
+    for segment, label in SEGMENT_LABELS.items():
+        part = missing[missing['segment'] == segment]
+        if part.empty:
+            print(f"\n{label}: 全部可映射。")
+            continue
+        print(f"\n警告！{label} 有 {len(part)} 个键缺失映射，影响 {int(part['n_rows'].sum())} 行、"
+              f"保费 {part['amount'].sum():,.2f}:")
+        for row in part.itertuples(index=False):
+            key = '<空值>' if row.key is None or pd.isna(row.key) else row.key
+            print(f"  - [val_method {row.val_method}] {key}: {int(row.n_rows)} 行, 保费 {row.amount:,.2f}")
+    print(f"\n请在 '{MAPPING_DIR}/' 下对应的映射文件中补充以上键，以避免输出中的段值空值。")
 
-def main():
+def main(val_month=VAL_MONTH, output=None):
     """
-    Main function to compare risk codes from the database against the mapping file.
+    Checks the five segment mappings against all three source tables server-side.
     """
-    print("--- 开始对比数据库险种代码与映射文件 ---")
-    
-    db_risk_codes = get_distinct_risk_codes_from_db()
-    mapping_codes = get_product_mapping_codes()
-    
-    if db_risk_codes is None or mapping_codes is None:
-        print("由于发生错误，无法进行对比。")
+    print("--- 开始校验段值映射覆盖率 ---")
+
+    missing = find_missing_mappings(val_month)
+    if missing is None:
+        print("由于发生错误，无法进行校验。")
         return
-        
-    print(f"\n数据库中共有 {len(db_risk_codes)} 个不同的险种代码。")
-    print(f"映射文件 '产品管理导出列表.xls' 中共有 {len(mapping_codes)} 个代码。")
-    
-    # Find codes that are in the database but not in the mapping file
-    missing_codes = db_risk_codes - mapping_codes
-    
-    if not missing_codes:
-        print("\n恭喜！所有来自数据库的险种代码都能在映射文件中找到。")
-    else:
-        print(f"\n警告！发现 {len(missing_codes)} 个险种代码存在于数据库但缺失于映射文件中:")
-        for code in sorted(list(missing_codes)):
-            print(f"  - {code}")
-        print("\n请将以上缺失的代码添加到 '产品管理导出列表.xls' 文件中以解决 product_segment 空值问题。")
-        
-    print("\n--- 对比完成 ---")
+
+    print_coverage_report(missing)
+    if output:
+        fmt = 'csv' if output.endswith('.csv') else 'xlsx'
+        print("\n正在写出缺失明细...")
+        print_writer_report(write_sheets({'缺失映射': missing}, output, default_format=fmt))
+
+    print("\n--- 校验完成 ---")
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='校验三张来源数据的段值映射覆盖率')
+    parser.add_argument('--val-month', default=VAL_MONTH, help='评估月份（yyyyMM）')
+    parser.add_argument('--output', help='将缺失明细写出到 xlsx/csv 文件')
+    args = parser.parse_args()
+    main(val_month=args.val_month, output=args.output)
@@ -0,0 +1,376 @@
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pandas as pd
+from psycopg2 import OperationalError
+from psycopg2.extensions import encodings as pg_encodings
+from psycopg2.pool import ThreadedConnectionPool
+
+from periods import period_params
+
+# --- Query Construction ---
+
+def build_extraction_query(val_method, sql_query, group_by_columns, table_name, additional_where_clause="", *,
+                           val_month):
+    """
+    Builds the aggregation query for one val_method from its SELECT list and GROUP BY columns.
+    Rows are ordered by the group key, so the entries come out in the same order on
+    every run and in both engines (see sql_engine.build_entry_sql).
+    """
+    group_list = ', '.join(f'"{col}"' for col in group_by_columns)
+    return f"""
+        {sql_query}
+        FROM
+            {table_name}
+        WHERE
+            "val_month" = '{val_month}' AND "val_method" = '{val_method}' {additional_where_clause}
+        GROUP BY
+            {group_list}
+        ORDER BY
+            {group_list}
+        """
+
+# 批量提取结果中标识评估月份的列
+PERIOD_COLUMN = '评估月份'
+
+def render_where_clause(template, val_month):
+    """Fills the {cutoff_iso}/{cutoff_compact} placeholders of a where-clause template with literals."""
+    params = period_params(val_month)
+    return template.format(cutoff_iso=f"'{params['cutoff_iso']}'", cutoff_compact=f"'{params['cutoff_compact']}'")
+
+def build_period_query(val_method, spec, val_month):
+    """Builds the single-period query for one EXTRACTION_SPECS entry."""
+    return build_extraction_query(
+        val_method, spec['sql_query'], spec['group_by_columns'], spec['table_name'],
+        render_where_clause(spec['additional_where_clause'], val_month), val_month=val_month,
+    )
+
+def build_batch_query(val_method, spec, val_months):
+    """
+    Builds one parameterized query covering several periods.
+
+    Period-dependent cut-offs become CASE expressions on "val_month" whose values are
+    bound parameters, and "val_month" is added to the SELECT list and GROUP BY so the
+    result can be split per period. Rows are ordered by period and then by the group
+    key like build_extraction_query, so each period comes out in the same order as
+    its single-period run. Returns (query, params) for psycopg2.
+    """
+    params = {'val_months': list(val_months), 'val_method': val_method}
+    whens = {'cutoff_iso': [], 'cutoff_compact': []}
+    for i, val_month in enumerate(val_months):
+        period = period_params(val_month)
+        params[f'val_month_{i}'] = val_month
+        for key, clauses in whens.items():
+            params[f'{key}_{i}'] = period[key]
+            clauses.append(f"WHEN %(val_month_{i})s THEN %({key}_{i})s")
+    cutoffs = {key: f'(CASE "val_month" {" ".join(clauses)} END)' for key, clauses in whens.items()}
+    where_clause = spec['additional_where_clause'].format(**cutoffs)
+    select = spec['sql_query'].replace('SELECT', f'SELECT\n    "val_month" AS "{PERIOD_COLUMN}",', 1)
+    group_list = ', '.join(f'"{col}"' for col in ['val_month'] + list(spec['group_by_columns']))
+    query = f"""
+        {select}
+        FROM
+            {spec['table_name']}
+        WHERE
+            "val_month" = ANY(%(val_months)s) AND "val_method" = %(val_method)s {where_clause}
+        GROUP BY
+            {group_list}
+        ORDER BY
+            {group_list}
+        """
+    return query, params
+
+def split_by_period(df, val_months):
+    """Splits a batch result into {val_month: frame}; periods without rows get an empty frame."""
+    if df is None:
+        return {val_month: None for val_month in val_months}
+    columns = [col for col in df.columns if col != PERIOD_COLUMN]
+    parts = {val_month: part[columns].reset_index(drop=True)
+             for val_month, part in df.groupby(PERIOD_COLUMN, sort=False, observed=True)}
+    return {val_month: parts.get(val_month, df.iloc[0:0][columns]) for val_month in val_months}
+
+# --- Sharded Extraction ---
+
+# 可用的分片键；分片键必须是 GROUP BY 列，保证每个分组只落在一个分片中
+SHARD_KEYS = ('group_id', 'com_code')
+
+def shard_predicate(shard_key, shard, n_shards):
+    """SQL predicate selecting one hash shard; NULL keys hash like '' so no row is lost."""
+    return f"AND (hashtext(COALESCE(\"{shard_key}\"::text, '')) & 2147483647) % {n_shards} = {shard}"
+
+def build_sharded_queries(val_method, spec, val_month, n_shards, shard_key='group_id'):
+    """
+    Splits one val_method's aggregation into n disjoint hash shards.
+    Returns {"<val_method>#<shard>": query}.
+    """
+    if shard_key not in SHARD_KEYS:
+        raise ValueError(f"不支持的分片键: {shard_key}，可选: {', '.join(SHARD_KEYS)}")
+    if shard_key not in spec['group_by_columns']:
+        raise ValueError(f"分片键 {shard_key} 不是 val_method = '{val_method}' 的分组列，分片结果无法直接合并")
+    where_clause = render_where_clause(spec['additional_where_clause'], val_month)
+    return {
+        f"{val_method}#{shard}": build_extraction_query(
+            val_method, spec['sql_query'], spec['group_by_columns'], spec['table_name'],
+            f"{where_clause} {shard_predicate(shard_key, shard, n_shards)}", val_month=val_month,
+        )
+        for shard in range(n_shards)
+    }
+
+def merge_shard_results(results):
+    """
+    Merges "<val_method>#<shard>" partial aggregates back into one frame per val_method.
+
+    The shard key is a GROUP BY column, so every group is complete in exactly one shard
+    and the merge is a plain concatenation. A val_method with a failed shard maps to None.
+    """
+    shards = {}
+    merged = {}
+    for name, df in results.items():
+        val_method, sep, _ = name.partition('#')
+        if sep:
+            shards.setdefault(val_method, []).append(df)
+        else:
+            merged[name] = df
+    for val_method, frames in shards.items():
+        if any(df is None for df in frames):
+            print(f"错误：val_method = '{val_method}' 的部分分片查询失败。")
+            merged[val_method] = None
+        else:
+            merged[val_method] = pd.concat(frames, ignore_index=True)
+    return merged
+
+def frames_equal_unordered(left, right):
+    """True if two extraction results hold the same rows, ignoring row order."""
+    if left is None or right is None or list(left.columns) != list(right.columns) or len(left) != len(right):
+        return False
+    columns = list(left.columns)
+    left = left.sort_values(columns, na_position='first', ignore_index=True)
+    right = right.sort_values(columns, na_position='first', ignore_index=True)
+    try:
+        pd.testing.assert_frame_equal(left, right, check_dtype=False)
+    except AssertionError:
+        return False
+    return True
+
+# --- Ingestion ---
+
+# 支持的取数方式：
+#   'pandas' - pd.read_sql_query，整体结果先成为 Python 元组再建 DataFrame
+#   'cursor' - 命名（服务端）游标，分块 fetchmany，内存只保留一个块
+#   'copy'   - COPY ... TO STDOUT 写入临时文件，由 C 解析器直接解析为带类型的列
+INGEST_METHODS = ('pandas', 'cursor', 'copy')
+
+DEFAULT_CHUNKSIZE = 100000
+
+# PostgreSQL 类型 OID -> pandas dtype，未列出的类型按文本读取
+_PG_NUMERIC_DTYPES = {
+    20: 'float64',    # int8（SUM(int) 可能为 NULL，用 float 承载）
+    21: 'float64',    # int2
+    23: 'float64',    # int4
+    700: 'float64',   # float4
+    701: 'float64',   # float8
+    1700: 'float64',  # numeric
+}
+
+_COPY_NULL = r'\N'
+
+def _query_column_dtypes(conn, query):
+    """Returns {column: dtype} for a query without fetching any rows."""
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+        return {col.name: _PG_NUMERIC_DTYPES.get(col.type_code, object) for col in cur.description}
+
+def _copy_to_tempfile(conn, query):
+    """Streams the query result as CSV into an unnamed temporary file and rewinds it."""
+    spool = tempfile.TemporaryFile()
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER true, NULL '{_COPY_NULL}')", spool
+        )
+    spool.seek(0)
+    return spool
+
+def _read_copy_csv(spool, dtypes, chunksize=None):
+    text_cols = [col for col, dtype in dtypes.items() if dtype is object]
+    numeric_cols = {col: dtype for col, dtype in dtypes.items() if dtype is not object}
+    # 文本列保持原样（如 '070020' 的前导零），只有 NULL 标记被识别为缺失值
+    return pd.read_csv(
+        spool, dtype={**{col: str for col in text_cols}, **numeric_cols},
+        na_values=[_COPY_NULL], keep_default_na=False, chunksize=chunksize,
+    )
+
+def iter_cursor_chunks(conn, query, chunksize=DEFAULT_CHUNKSIZE, cursor_name='extract_cursor'):
+    """
+    Yields DataFrame chunks from a named server-side cursor.
+    Only one chunk of rows is ever materialised on the client.
+    """
+    with conn.cursor(name=cursor_name) as cur:
+        cur.itersize = chunksize
+        cur.execute(query)
+        columns = None
+        while True:
+            rows = cur.fetchmany(chunksize)
+            if columns is None:
+                columns = [col.name for col in cur.description]
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+def iter_copy_chunks(conn, query, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Yields typed DataFrame chunks parsed from COPY ... TO STDOUT.
+    """
+    dtypes = _query_column_dtypes(conn, query)
+    with _copy_to_tempfile(conn, query) as spool:
+        yield from _read_copy_csv(spool, dtypes, chunksize=chunksize)
+
+def iter_query_chunks(conn, query, method='cursor', chunksize=DEFAULT_CHUNKSIZE):
+    """Yields DataFrame chunks using the 'cursor' or 'copy' ingestion method."""
+    if method == 'cursor':
+        return iter_cursor_chunks(conn, query, chunksize=chunksize)
+    if method == 'copy':
+        return iter_copy_chunks(conn, query, chunksize=chunksize)
+    raise ValueError(f"不支持分块读取的取数方式: {method}")
+
+def bind_params(conn, query, params):
+    """Inlines bound parameters (as psycopg2 would) for paths that cannot pass them separately."""
+    if not params:
+        return query
+    with conn.cursor() as cur:
+        return cur.mogrify(query, params).decode(pg_encodings.get(conn.encoding, 'utf-8'))
+
+def fetch_dataframe(conn, query, method='pandas', chunksize=DEFAULT_CHUNKSIZE, params=None):
+    """
+    Executes a query and returns one DataFrame using the chosen ingestion method.
+    """
+    if method not in INGEST_METHODS:
+        raise ValueError(f"未知的取数方式: {method}，可选: {', '.join(INGEST_METHODS)}")
+    if method == 'pandas':
+        return pd.read_sql_query(query, conn, params=params)
+    query = bind_params(conn, query, params)
+    if method == 'copy':
+        # 不分块：整个 CSV 一次性解析为列数组，不经过逐行 Python 元组
+        dtypes = _query_column_dtypes(conn, query)
+        with _copy_to_tempfile(conn, query) as spool:
+            return _read_copy_csv(spool, dtypes)
+    chunks = list(iter_cursor_chunks(conn, query, chunksize=chunksize))
+    if not chunks:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT * FROM ({query}) AS q LIMIT 0")
+            return pd.DataFrame(columns=[col.name for col in cur.description])
+    return pd.concat(chunks, ignore_index=True)
+
+def encode_dimensions(df):
+    """
+    Dictionary-encodes the text (dimension) columns of an extracted frame in place.
+    Aggregated rows repeat the same organisation, risk and contract codes many times,
+    so each column is stored as small integer codes plus one copy of each string.
+    """
+    if df is None:
+        return None
+    for col in df.columns:
+        if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].astype('category')
+    return df
+
+# --- Connection Pool ---
+
+def create_connection_pool(db_params, max_connections=3):
+    """
+    Creates a bounded, thread-safe connection pool. Returns None if the database is unreachable.
+    """
+    try:
+        pool = ThreadedConnectionPool(1, max_connections, **db_params)
+        print(f"数据库连接池已创建 (最大连接数: {max_connections})。")
+        return pool
+    except OperationalError as e:
+        print(f"数据库连接失败: {e}")
+        return None
+
+@contextmanager
+def pooled_connection(pool):
+    """
+    Borrows a connection from the pool and returns it in a clean state afterwards.
+    """
+    conn = pool.getconn()
+    try:
+        yield conn
+    finally:
+        # read_sql_query leaves the connection inside a transaction; end it so the
+        # next borrower starts fresh.
+        try:
+            conn.rollback()
+        except Exception:
+            pool.putconn(conn, close=True)
+        else:
+            pool.putconn(conn)
+
+# --- Concurrent Extraction ---
+
+def _run_timed_query(pool, name, query, ingest='pandas'):
+    """
+    Executes one query on a pooled connection and returns (df, elapsed_seconds).
+    `query` is SQL text or a (SQL, params) tuple.
+    """
+    query, params = query if isinstance(query, tuple) else (query, None)
+    start = time.perf_counter()
+    try:
+        with pooled_connection(pool) as conn:
+            print(f"正在执行查询 [{name}]...")
+            df = fetch_dataframe(conn, query, method=ingest, params=params)
+        elapsed = time.perf_counter() - start
+        print(f"查询 [{name}] 完成！耗时 {elapsed:.2f} 秒，共 {len(df)} 行。")
+        return df, elapsed
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        print(f"查询 [{name}] 时发生错误: {e}")
+        return None, elapsed
+
+def extract_concurrently(queries, db_params, max_workers=None, pool=None, ingest='pandas'):
+    """
+    Runs independent extraction queries concurrently over a shared connection pool.
+
+    Args:
+        queries: dict，查询名称（如 val_method）-> SQL 文本或 (SQL, 参数) 元组
+        db_params: 数据库连接参数（pool 为 None 时用于创建连接池）
+        max_workers: 并发数，默认与查询个数相同
+        pool: 可选的已有连接池，传入时不会在结束后关闭
+        ingest: 取数方式，见 INGEST_METHODS
+
+    Returns:
+        (results, latencies)：名称 -> DataFrame（失败为 None），名称 -> 耗时（秒）
+    """
+    max_workers = max_workers or len(queries)
+    owns_pool = pool is None
+    if owns_pool:
+        pool = create_connection_pool(db_params, max_connections=max_workers)
+        if pool is None:
+            return {name: None for name in queries}, {}
+
+    results, latencies = {}, {}
+    wall_start = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {name: executor.submit(_run_timed_query, pool, name, query, ingest)
+                       for name, query in queries.items()}
+            for name, future in futures.items():
+                results[name], latencies[name] = future.result()
+    finally:
+        if owns_pool:
+            pool.closeall()
+            print("数据库连接池已关闭。")
+
+    wall = time.perf_counter() - wall_start
+    print_latency_report(latencies, wall)
+    return results, latencies
+
+def print_latency_report(latencies, wall_seconds):
+    """Prints per-query latency against the overall wall time."""
+    print("各查询耗时：")
+    for name, elapsed in latencies.items():
+        print(f"  [{name}]: {elapsed:.2f} 秒")
+    if latencies:
+        print(f"  总耗时 {wall_seconds:.2f} 秒 (串行合计 {sum(latencies.values()):.2f} 秒，"
+              f"最慢单个查询 {max(latencies.values()):.2f} 秒)")
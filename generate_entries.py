@@ -1,8 +1,32 @@
+import argparse
+
 import pandas as pd
 import numpy as np
 import psycopg2
 from psycopg2 import OperationalError
 
+from extraction import (DEFAULT_CHUNKSIZE, INGEST_METHODS, SHARD_KEYS, build_batch_query, build_period_query, build_sharded_queries,
+                        encode_dimensions, extract_concurrently, frames_equal_unordered,
+                        iter_query_chunks, merge_shard_results, split_by_period)
+from allocation import (ALLOCATION_SOURCE, DEFAULT_DRIVER, allocate_entries, allocation_source_for,
+                        load_allocation_ratios)
+from checkpoints import digest, frame_digest, mappings_digest, open_checkpoints, rules_digest
+from entry_ids import entry_ids
+from incremental import (FINGERPRINT_COLUMNS, FULL_RERUN_FRACTION, build_fingerprint_query, build_group_query,
+                         changed_groups, config_key, load_state, save_state, splice_entries)
+from instrumentation import Instrumentation, frame_bytes
+from ledger_rollup import rollup_entries
+from mapping_registry import MAPPING_DIR, copy_mappings_to_temp_tables, load_mappings
+from output_writers import OUTPUT_FORMATS, StreamingSheetWriter, print_writer_report, write_sheets
+from parallel_lines import run_lines_in_processes
+from periods import validate_val_month
+from reconciliation import print_reconciliation, reconcile_line
+from rule_engine import BUSINESS_LINES, process_business_line
+from snapshot_cache import HAS_PYARROW, find_snapshot, iter_snapshot_chunks, load_snapshot, save_snapshot
+from sql_engine import generate_entries_sql
+from streaming import stream_business_line
+from table_sink import CopyTableSink
+
 # --- Database Connection Parameters ---
 DB_PARAMS = {
     'host': '10.128.21.148',
@@ -12,78 +36,110 @@ DB_PARAMS = {
     'password': 'readonly_cas25_test'
 }
 
-# --- Database Extraction Functions ---
+# 默认评估月份（可通过 --val-month / --batch 覆盖）
+VAL_MONTH = '202412'
 
-def get_data_from_db(val_method, sql_query, group_by_columns, table_name, additional_where_clause=""):
-    """
-    Connects to the database, executes a specified query, and returns a DataFrame.
-    """
-    conn = None
-    try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        print(f"数据库连接成功！正在查询 val_method = '{val_method}' 的数据...")
-        
-        query = f"""
-        {sql_query}
-        FROM
-            {table_name}
-        WHERE
-            "val_month" = '202412' AND "val_method" = '{val_method}' {additional_where_clause}
-        GROUP BY
-            {', '.join(f'"{col}"' for col in group_by_columns)}
-        """
-        
-        df = pd.read_sql_query(query, conn)
-        print(f"val_method = '{val_method}' 查询完成！")
-        return df
-        
-    except OperationalError as e:
-        print(f"数据库连接失败: {e}")
-        return None
-    except Exception as e:
-        print(f"查询 val_method = '{val_method}' 时发生错误: {e}")
-        return None
-    finally:
-        if conn is not None:
-            conn.close()
-            print("数据库连接已关闭。")
+# --- SQL Queries and Groupby Definitions ---
+# 注意：起期大于评估月末的保单已在WHERE条件中排除，不参与查询和聚合
+
+SQL_8 = """
+SELECT
+    "com_code" AS "归属机构", "business_nature" AS "业务渠道", "car_kind_code" AS "车辆种类",
+    "use_nature_code" AS "使用性质代码", "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号",
+    "val_method" AS "评估方法", "risk_code" AS "险种代码", "class_code" AS "险类代码",
+    SUM("total_premium") AS "保费_本币",
+    SUM("total_iacf_amt") AS "保险获取现金流_本币",
+    SUM("acc_confirmed_premium") AS "保险合同收入",
+    SUM("acc_iacf_premium") AS "当期确认的IACF",
+    SUM("lrc_loss_cost_policy") AS "亏损部分",
+    SUM("ifie_amt") AS "IACF计息"
+"""
+GROUPBY_8 = [
+    "com_code", "business_nature", "car_kind_code", "use_nature_code", "portfolio_id", 
+    "group_id", "val_method", "risk_code", "class_code"
+]
+
+SQL_11 = """
+SELECT
+    "com_code" AS "归属机构", "car_kind_code" AS "车辆种类", "use_nature_code" AS "使用性质代码", 
+    "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号", "val_method" AS "评估方法", 
+    "risk_code" AS "险种代码", "class_code" AS "险类代码", "contract_flag" AS "合同标识", 
+    "enquiry_type" AS "临分类型", "contract_type" AS "合约类型", "rein_type" AS "分出类型",
+    SUM("premium") AS "分保费收入",
+    SUM("commission") AS "分保费用",
+    SUM("brokerage") AS "经纪费",
+    SUM("net_premium_amortization") AS "预收净保费摊销",
+    SUM("cumulative_ifie_amt_amortization") AS "累积计息摊销",
+    SUM("cumulative_no_iacf_amortization") AS "获取费用摊销",
+    SUM("no_iacf_cash_flow") AS "业务及管理费结转",
+    SUM("loss_component_allocation") AS "亏损部分",
+    SUM("cumulative_ifie_amt") AS "计息"
+"""
+GROUPBY_11 = [
+    "com_code", "car_kind_code", "use_nature_code", "portfolio_id", "group_id", 
+    "val_method", "risk_code", "class_code", "contract_flag", "enquiry_type", 
+    "contract_type", "rein_type"
+]
+
+SQL_10 = """
+SELECT
+    "com_code" AS "归属机构", "car_kind_code" AS "车辆种类", "use_nature_code" AS "使用性质代码", 
+    "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号", "val_method" AS "评估方法", 
+    "risk_code" AS "险种代码", "class_code" AS "险类代码", "contract_flag" AS "合同标识", 
+    "enquiry_type" AS "临分类型", "contract_type" AS "合约类型", "rein_type" AS "分出类型",
+    SUM("premium") AS "分出保费",
+    SUM("commission") AS "手续费_本币",
+    SUM("brokerage") AS "经纪费_本币",
+    SUM("net_premium_amortization") AS "预收净保费摊销",
+    SUM("cumulative_ifie_amt_amortization") AS "累积计息摊销",
+    SUM("loss_component") AS "亏损摊回部分",
+    SUM("base_investment_amortization") AS "投资成分",
+    SUM("cumulative_ifie_amt") AS "计息"
+"""
+GROUPBY_10 = [
+    "com_code", "car_kind_code", "use_nature_code", "portfolio_id", "group_id", 
+    "val_method", "risk_code", "class_code", "contract_flag", "enquiry_type", 
+    "contract_type", "rein_type"
+]
+
+# 三个 val_method 的提取定义，顺序即结果保存顺序。
+# additional_where_clause 是模板：{cutoff_iso} 为评估月末（yyyy-mm-dd，直保表格式），
+# {cutoff_compact} 为评估月末（yyyymmdd，再保表格式），按期间填入字面量或绑定参数。
+EXTRACTION_SPECS = {
+    '8': {
+        'sql_query': SQL_8, 'group_by_columns': GROUPBY_8,
+        'table_name': '"measure_platform"."measure_cx_unexpired"',
+        'additional_where_clause': 'AND "end_date" > {cutoff_iso} AND "start_date" <= {cutoff_iso}',
+    },
+    # 分入业务（val_method=11）不做筛选
+    '11': {
+        'sql_query': SQL_11, 'group_by_columns': GROUPBY_11,
+        'table_name': '"measure_platform"."int_measure_cx_unexpired_rein"',
+        'additional_where_clause': 'AND "end_date" > {cutoff_compact}',
+    },
+    # 分出业务不做任何额外筛选，只做前两步筛选（val_month 为评估月份 且 end_date > 评估月末）
+    '10': {
+        'sql_query': SQL_10, 'group_by_columns': GROUPBY_10,
+        'table_name': '"measure_platform"."int_measure_cx_unexpired_rein"',
+        'additional_where_clause': 'AND "end_date" > {cutoff_compact}',
+    },
+}
+
+# --- Database Extraction Functions ---
 
 def save_to_excel(df, filename):
     """Saves a DataFrame to an Excel file."""
     if df is not None and not df.empty:
         try:
             print(f"正在将数据保存到 {filename}...")
-            df.to_excel(filename, index=False)
+            stats = write_sheets({'Sheet1': df}, filename)
             print(f"数据已成功保存到 {filename}")
+            print_writer_report(stats)
         except Exception as e:
             print(f"保存到Excel文件 {filename} 时出错: {e}")
     else:
         print(f"没有为 {filename} 查询到数据，或查询出错。")
 
-def execute_raw_query(sql_query, description):
-    """
-    Connects to the database, executes a raw SQL query, and returns a DataFrame.
-    """
-    conn = None
-    try:
-        conn = psycopg2.connect(**DB_PARAMS)
-        print(f"数据库连接成功！正在执行: {description}...")
-        
-        df = pd.read_sql_query(sql_query, conn)
-        print(f"查询 '{description}' 完成！")
-        return df
-        
-    except OperationalError as e:
-        print(f"数据库连接失败: {e}")
-        return None
-    except Exception as e:
-        print(f"查询 '{description}' 时发生错误: {e}")
-        return None
-    finally:
-        if conn is not None:
-            conn.close()
-            print("数据库连接已关闭。")
-
 # --- Data Processing Functions ---
 
 def process_direct_business(df_direct, filter_enabled=False):
@@ -92,50 +148,8 @@ def process_direct_business(df_direct, filter_enabled=False):
     """
     print("正在处理直保业务...")
 
-    i17_names = {
-        '2606010801': "未到期责任负债-未来现金流-现金流/保费-保费收入",
-        '2606011002': "未到期责任负债-未来现金流-现金流/获取费用-手续费及佣金支出/佣金",
-        '2606011102': "未到期责任负债-未来现金流-保费分配法分摊的收入-保费收入/直接业务",
-        '2606011603': "未到期责任负债-未来现金流-获取费用摊销计入支出-保费分配法/直接业务",
-        '2606011202': "未到期责任负债-未来现金流-保费分配法亏损合同损益-亏损提转差/直接业务",
-        '2606011302': "未到期责任负债-未来现金流-保险财务费用-当期计提利息/保费分配法/直接业务",
-    }
-    
-    rules = [
-        {'类型': '签单保费', '借贷方向': '贷', 'I17科目代码': '2606010801', '取数口径': '正数', '金额来源': '保费_本币', '符号': 1},
-        {'类型': '获取费用', '借贷方向': '贷', 'I17科目代码': '2606011002', '取数口径': '负数', '金额来源': '保险获取现金流_本币', '符号': -1},
-        {'类型': '已经过保费', '借贷方向': '贷', 'I17科目代码': '2606011102', '取数口径': '负数', '金额来源': '保险合同收入', '符号': -1},
-        {'类型': '获取费用摊销', '借贷方向': '贷', 'I17科目代码': '2606011603', '取数口径': '正数', '金额来源': '当期确认的IACF', '符号': 1},
-        {'类型': '亏损(保费不足)', '借贷方向': '贷', 'I17科目代码': '2606011202', '取数口径': '正数', '金额来源': '亏损部分', '符号': 1},
-        {'类型': '计息', '借贷方向': '贷', 'I17科目代码': '2606011302', '取数口径': '正数', '金额来源': 'IACF计息', '符号': 1},
-    ]
-    skip_codes_when_filtered = {'2606010801', '2606011002'}
-    
-    measure_dimension_cols = ['归属机构', '业务渠道', '车辆种类', '使用性质代码', '合同分组编号', '险种代码', '险类代码', '合同组合编号']
-    all_entries = []
-    
-    for rule in rules:
-        if rule['金额来源'] not in df_direct.columns:
-            print(f"警告：在直保数据中找不到源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
-            continue
-
-        # 起期>20241231的保单已在WHERE条件中排除，直接使用聚合结果生成分录
-        source_df = df_direct
-
-        temp_df = source_df[measure_dimension_cols].copy()
-        temp_df['类型'] = rule['类型']
-        temp_df['借贷方向'] = rule['借贷方向']
-        temp_df['I17科目代码'] = rule['I17科目代码']
-        temp_df['I17科目名称'] = i17_names.get(rule['I17科目代码'])
-        temp_df['取数口径'] = rule['取数口径']
-        temp_df['金额'] = source_df[rule['金额来源']] * rule['符号']
-        
-        all_entries.append(temp_df)
-        
-    if not all_entries:
-        return pd.DataFrame()
-        
-    final_df = pd.concat(all_entries, ignore_index=True)
+    # 起期>20241231的保单已在WHERE条件中排除，直接使用聚合结果生成分录
+    final_df = process_business_line(df_direct, 'direct')
     
     print("直保业务处理完成。")
     return final_df
@@ -146,72 +160,7 @@ def process_assumed_reinsurance(df_assumed):
     """
     print("正在处理分入业务...")
 
-    i17_names = {
-        '2606010901': '未到期责任负债-未来现金流-现金流/分入保费-分保费收入/比例合同',
-        '2606010904': '未到期责任负债-未来现金流-现金流/分入保费-分保费收入/比例临分',
-        '2606010911': '未到期责任负债-未来现金流-现金流/分入保费-分保费用/比例合同',
-        '2606010913': '未到期责任负债-未来现金流-现金流/分入保费-分保费用/比例临分',
-        '2606010921': '未到期责任负债-未来现金流-现金流/分入保费-分保费用/经纪费/比例合同',
-        '2606010923': '未到期责任负债-未来现金流-现金流/分入保费-分保费用/经纪费/比例临分',
-        '2606010990': '未到期责任负债-未来现金流-现金流/分入保费-分保费用/业务及管理费结转',
-        '2606011101': '未到期责任负债-未来现金流-保费分配法分摊的收入-保费收入/分入业务',
-        '2606011602': '未到期责任负债-未来现金流-获取费用摊销计入支出-保费分配法/分入业务',
-        '2606011301': '未到期责任负债-未来现金流-保险财务费用-当期计提利息/保费分配法/分入业务',
-        '2606011201': '未到期责任负债-未来现金流-保费分配法亏损合同损益-亏损提转差/分入业务'
-    }
-
-    # contract_flag: 1 is facultative (临分), 2 is contract (合同)
-    df_assumed['is_contract'] = df_assumed['合同标识'].astype(str) == '2'
-
-    rules = [
-        {'类型': '分保费收入', '金额来源': '分保费收入', '符号': 1, '取数口径': '正数', 'contract_code': '2606010901', 'facultative_code': '2606010904'},
-        {'类型': '分保费用', '金额来源': '分保费用', '符号': -1, '取数口径': '负数', 'contract_code': '2606010911', 'facultative_code': '2606010913'},
-        {'类型': '经纪费', '金额来源': '经纪费', '符号': -1, '取数口径': '负数', 'contract_code': '2606010921', 'facultative_code': '2606010923'},
-        {'类型': '业务及管理费结转', '金额来源': '业务及管理费结转', '符号': -1, '取数口径': '负数', 'code': '2606010990'},
-        {'类型': '已经过保费', '金额来源': ['预收净保费摊销', '累积计息摊销'], '符号': -1, '取数口径': '负数', 'code': '2606011101'},
-        {'类型': '获取费用摊销', '金额来源': '获取费用摊销', '符号': 1, '取数口径': '正数', 'code': '2606011602'},
-        {'类型': '亏损', '金额来源': '亏损部分', '符号': 1, '取数口径': '正数', 'code': '2606011201'},
-        {'类型': '计息', '金额来源': '计息', '符号': 1, '取数口径': '正数', 'code': '2606011301'},
-    ]
-    
-    measure_dimension_cols = ['归属机构', '车辆种类', '使用性质代码', '合同组合编号', '合同分组编号', '评估方法', '险种代码', '险类代码', '合同标识', '临分类型', '合约类型', '分出类型']
-    all_entries = []
-
-    for rule in rules:
-        # Check for multiple source columns
-        if isinstance(rule['金额来源'], list):
-            if not all(col in df_assumed.columns for col in rule['金额来源']):
-                print(f"警告：在分入数据中找不到一个或多个源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
-                continue
-        else:
-            if rule['金额来源'] not in df_assumed.columns:
-                print(f"警告：在分入数据中找不到源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
-                continue
-        
-        temp_df = df_assumed[measure_dimension_cols].copy()
-        temp_df['类型'] = rule['类型']
-        temp_df['借贷方向'] = '贷'
-        
-        if 'code' in rule:
-            temp_df['I17科目代码'] = rule['code']
-        else:
-            temp_df['I17科目代码'] = np.where(df_assumed['is_contract'], rule['contract_code'], rule['facultative_code'])
-            
-        temp_df['I17科目名称'] = temp_df['I17科目代码'].map(i17_names)
-        temp_df['取数口径'] = rule['取数口径']
-
-        if isinstance(rule['金额来源'], list):
-            # Sum up columns for the amount
-            temp_df['金额'] = df_assumed[rule['金额来源']].sum(axis=1) * rule['符号']
-        else:
-            temp_df['金额'] = df_assumed[rule['金额来源']] * rule['符号']
-        
-        all_entries.append(temp_df)
-
-    if not all_entries:
-        return pd.DataFrame()
-
-    final_df = pd.concat(all_entries, ignore_index=True)
+    final_df = process_business_line(df_assumed, 'assumed')
     
     print("分入业务处理完成。")
     return final_df
@@ -222,414 +171,956 @@ def process_ceded_reinsurance(df_ceded):
     """
     print("正在处理分出业务...")
 
-    i17_names = {
-        '1252010501': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-直接业务/比例合同",
-        '1252010503': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-直接业务/比例临分",
-        '1252010511': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-分入业务/比例合同",
-        '1252010513': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-分入业务/比例临分",
-        '1252010521': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/直接业务/比例合同",
-        '1252010523': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/直接业务/比例临分",
-        '1252010531': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/分入业务/比例合同",
-        '1252010533': "分保摊回未到期责任资产-未来现金流-现金流/分出保费-摊回分保费用/分入业务/比例临分",
-        '1252010301': "分保摊回未到期责任资产-未来现金流-保费分配法分摊的分出保费-分出保费/直接业务",
-        '1252010302': "分保摊回未到期责任资产-未来现金流-保费分配法分摊的分出保费-分出保费/分入业务",
-        '1252010401': "分保摊回未到期责任资产-未来现金流-保费分配法亏损摊回调整-亏损摊回调整/直接业务",
-        '1252010402': "分保摊回未到期责任资产-未来现金流-保费分配法亏损摊回调整-亏损摊回调整/分入业务",
-        '1252010201': "分保摊回未到期责任资产-未来现金流-摊回赔付/投资成分-摊回赔付支出/直接业务/比例合同",
-        '1252010202': "分保摊回未到期责任资产-未来现金流-摊回赔付/投资成分-摊回赔付支出/直接业务/比例临分",
-        '1253010501': "分保摊回已发生赔款资产-未来现金流-摊回赔付/投资成分-应收分保账款/摊回分保赔款/直接业务/比例合同",
-        '1253010502': "分保摊回已发生赔款资产-未来现金流-摊回赔付/投资成分-应收分保账款/摊回分保赔款/直接业务/比例临分",
-        '1252010101': "分保摊回未到期责任资产-未来现金流-保险财务费用-计息及金融假设的变化/直接业务",
-        '1252010102': "分保摊回未到期责任资产-未来现金流-保险财务费用-计息及金融假设的变化/分入业务"
-    }
-
-    df_ceded['分出类型'] = df_ceded['分出类型'].astype(str)
-    # contract_flag: 1 is facultative (临分), 2 is contract (合同)
-    df_ceded['is_contract'] = df_ceded['合同标识'].astype(str) == '2'
-
-    rules = [
-        {'类型': '分出保费', '金额来源': '分出保费', '符号': 1, '取数口径': '正数',
-         'codes': {'1_True': '1252010501', '1_False': '1252010503', '2_True': '1252010511', '2_False': '1252010513'}},
-        {'类型': '摊回分保费用', '金额来源': ['手续费_本币', '经纪费_本币'], '符号': -1, '取数口径': '负数',
-         'codes': {'1_True': '1252010521', '1_False': '1252010523', '2_True': '1252010531', '2_False': '1252010533'}},
-        {'类型': '分出保费的分摊', '金额来源': ['预收净保费摊销', '累积计息摊销'], '符号': -1, '取数口径': '负数',
-         'codes': {'1': '1252010301', '2': '1252010302'}},
-        {'类型': '亏损摊回', '金额来源': '亏损摊回部分', '符号': 1, '取数口径': '正数',
-         'codes': {'1': '1252010401', '2': '1252010402'}},
-        {'类型': '计息', '金额来源': '计息', '符号': 1, '取数口径': '正数',
-         'codes': {'1': '1252010101', '2': '1252010102'}},
-    ]
-    
-    dimension_cols = ['归属机构', '车辆种类', '使用性质代码', '合同组合编号', '合同分组编号', '评估方法', '险种代码', '险类代码', '合同标识', '临分类型', '合约类型', '分出类型']
-    all_entries = []
-
-    for rule in rules:
-        # Check for multiple source columns
-        if isinstance(rule['金额来源'], list):
-            if not all(col in df_ceded.columns for col in rule['金额来源']):
-                print(f"警告：在分出数据中找不到一个或多个源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
-                continue
-        else:
-            if rule['金额来源'] not in df_ceded.columns:
-                print(f"警告：在分出数据中找不到源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
-                continue
-            
-        temp_df = df_ceded[dimension_cols].copy()
-        temp_df['类型'] = rule['类型']
-        temp_df['借贷方向'] = '借'
-
-        if rule['类型'] in ['分出保费', '摊回分保费用']:
-            key_series = temp_df['分出类型'] + '_' + df_ceded['is_contract'].astype(str)
-            temp_df['I17科目代码'] = key_series.map(rule['codes'])
-        elif rule['类型'] in ['分出保费的分摊', '亏损摊回', '计息']:
-            temp_df['I17科目代码'] = temp_df['分出类型'].map(rule['codes'])
-        
-        temp_df['I17科目名称'] = temp_df['I17科目代码'].map(i17_names)
-        temp_df['取数口径'] = rule['取数口径']
-        
-        if isinstance(rule['金额来源'], list):
-            temp_df['金额'] = df_ceded[rule['金额来源']].sum(axis=1) * rule['符号']
-        else:
-            temp_df['金额'] = df_ceded[rule['金额来源']] * rule['符号']
-
-        all_entries.append(temp_df)
-        
-    # Handle '投资成分' separately as it creates two entries
-    if '投资成分' in df_ceded.columns:
-        is_contract_series = df_ceded['is_contract']
-        
-        # Entry 1
-        temp_df_1 = df_ceded[dimension_cols].copy()
-        temp_df_1['类型'] = '投资成分'
-        temp_df_1['借贷方向'] = '借'
-        temp_df_1['I17科目代码'] = np.where(is_contract_series, '1252010201', '1252010202')
-        temp_df_1['I17科目名称'] = temp_df_1['I17科目代码'].map(i17_names)
-        temp_df_1['取数口径'] = '负数, 已摊销投资成分'
-        temp_df_1['金额'] = df_ceded['投资成分'] * -1
-        all_entries.append(temp_df_1)
-        
-        # Entry 2
-        temp_df_2 = df_ceded[dimension_cols].copy()
-        temp_df_2['类型'] = '投资成分'
-        temp_df_2['借贷方向'] = '借'
-        temp_df_2['I17科目代码'] = np.where(is_contract_series, '1253010501', '1253010502')
-        temp_df_2['I17科目名称'] = temp_df_2['I17科目代码'].map(i17_names)
-        temp_df_2['取数口径'] = '正数, 已摊销投资成分'
-        temp_df_2['金额'] = df_ceded['投资成分']
-        all_entries.append(temp_df_2)
-    
-    if not all_entries:
-        return pd.DataFrame()
-
-    final_df = pd.concat(all_entries, ignore_index=True)
+    final_df = process_business_line(df_ceded, 'ceded')
     
     print("分出业务处理完成。")
     return final_df
 
-def transform_to_final_format(df, insurance_type, mappings):
+FINAL_COLUMNS = [
+    'sj_id', 'account_period', 'dc_cd', 'account_code', 'account_name', 'org_segment',
+    'agriculture_segment', 'cost_center_segment', 'detail_segment', 'product_segment',
+    'coverage_segment', 'channel_segment', 'car_cash_segment', 'reserve1', 'reserve2',
+    'portfolio_id', 'insurance_contract_group_id', 'origin_currency_code', 'origin_currency_amt',
+    'exchange_rate', 'local_currency_code', 'local_currency_amt', 'dc_local_currency_amt',
+    'evaluate_method', 'insurance_type', 'origin_data_type'
+]
+
+def _factorize_keys(values):
     """
-    Transforms the generated entries into the final accounting format.
+    Factorizes a key column and cleans only its unique values.
+    Returns (row codes, cleaned unique keys as a Series).
     """
-    print(f"开始转换最终格式 (insurance_type={insurance_type})...")
-    
-    # Handle missing '业务渠道' for reinsurance data
-    if '业务渠道' not in df.columns:
-        df['业务渠道'] = '0'
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    keys = pd.Series(pd.Index(uniques).astype(str).str.strip())
+    return codes, keys
+
+def _map_uniques(codes, keys, mapping):
+    """
+    Maps the unique keys and takes the result back to row order as a categorical,
+    so each row stores a small integer code rather than its own string object.
+    """
+    segment_codes, segments = pd.factorize(keys.map(mapping))
+    return pd.Categorical.from_codes(segment_codes[codes], categories=segments)
 
-    # Clean and standardize keys before mapping
-    df['险种代码_str'] = df['险种代码'].astype(str).str.strip()
-    df['归属机构_str'] = df['归属机构'].astype(str).str.strip()
-    df['业务渠道_str'] = df['业务渠道'].astype(str).str.strip()
-    df['使用性质代码_str'] = df['使用性质代码'].astype(str).str.strip()
-    df['车辆种类_str'] = df['车辆种类'].astype(str).str.strip()
+def _constant_column(value, n):
+    """A single-category column: one code byte per row instead of one Python object."""
+    return pd.Categorical.from_codes(np.zeros(n, dtype='int8'), categories=[value])
 
-    # 1. Apply mappings
-    df['product_segment'] = df['险种代码_str'].map(mappings['product'])
-    df['org_segment'] = df['归属机构_str'].map(mappings['org'])
-    df['cost_center_segment'] = df['归属机构_str'].map(mappings['cost_center'])
-    df['channel_segment'] = df['业务渠道_str'].map(mappings['channel'])
+def transform_to_final_format(df, insurance_type, mappings, account_period=VAL_MONTH, verbose=True):
+    """
+    Transforms the generated entries into the final accounting format.
+    sj_id is a content hash of each entry's business key (see entry_ids), so chunked
+    and parallel runs produce the same IDs as a single pass.
+    Amounts stay in int64 fen (see amounts); the writers convert them to yuan.
+    """
+    if verbose:
+        print(f"开始转换最终格式 (insurance_type={insurance_type})...")
+    n = len(df)
     
-    # Handle two-column key for car mapping
-    df['car_key'] = df['使用性质代码_str'] + '_' + df['车辆种类_str']
-    df['car_cash_segment'] = df['car_key'].map(mappings['car'])
+    # 1. Apply mappings
+    # Entries fan out 6-11x from a much smaller set of distinct dimension values, so
+    # keys are cleaned and mapped once per unique value, then taken back to rows.
+    product_codes, product_keys = _factorize_keys(df['险种代码'])
+    org_codes, org_keys = _factorize_keys(df['归属机构'])
+    if '业务渠道' in df.columns:
+        channel_codes, channel_keys = _factorize_keys(df['业务渠道'])
+    else:
+        # Handle missing '业务渠道' for reinsurance data
+        channel_codes, channel_keys = np.zeros(n, dtype='intp'), pd.Series(['0'])
+
+    # Handle two-column key for car mapping: combine the two factorized codes
+    use_codes, use_keys = _factorize_keys(df['使用性质代码'])
+    kind_codes, kind_keys = _factorize_keys(df['车辆种类'])
+    car_codes, car_uniques = pd.factorize(use_codes * len(kind_keys) + kind_codes)
+    car_keys = (use_keys.iloc[car_uniques // len(kind_keys)].reset_index(drop=True) + '_'
+                + kind_keys.iloc[car_uniques % len(kind_keys)].reset_index(drop=True))
 
     # 2. Add new columns based on rules
-    df['sj_id'] = [f"RAND_{i}" for i in range(len(df))] # Placeholder for random ID
-    df['account_period'] = '202412'
-    df['dc_cd'] = df['借贷方向'].map({'借': 'D', '贷': 'C'})
-    df['account_name'] = df['I17科目名称']
-    df['agriculture_segment'] = '0'
-    df['detail_segment'] = '0'
-    df['coverage_segment'] = '0'
-    df['reserve1'] = '0'
-    df['reserve2'] = '0'
-    df['portfolio_id'] = df['合同组合编号']
-    df['insurance_contract_group_id'] = df['合同分组编号']
-    df['origin_currency_code'] = 'CNY' # Assuming CNY from context
-    df['origin_currency_amt'] = df['金额']
-    df['exchange_rate'] = 1.00
-    df['local_currency_code'] = 'CNY'
-    df['local_currency_amt'] = df['origin_currency_amt']
-    df['dc_local_currency_amt'] = np.where(df['dc_cd'] == 'C', -df['local_currency_amt'], df['local_currency_amt'])
-    df['evaluate_method'] = '4'
-    df['insurance_type'] = insurance_type
-    df['origin_data_type'] = '9'
-
-    # 3. Select and reorder final columns
-    final_columns = [
-        'sj_id', 'account_period', 'dc_cd', 'account_code', 'account_name', 'org_segment',
-        'agriculture_segment', 'cost_center_segment', 'detail_segment', 'product_segment',
-        'coverage_segment', 'channel_segment', 'car_cash_segment', 'reserve1', 'reserve2',
-        'portfolio_id', 'insurance_contract_group_id', 'origin_currency_code', 'origin_currency_amt',
-        'exchange_rate', 'local_currency_code', 'local_currency_amt', 'dc_local_currency_amt',
-        'evaluate_method', 'insurance_type', 'origin_data_type'
-    ]
-    # Rename account code for final output
-    df.rename(columns={'I17科目代码': 'account_code'}, inplace=True)
-    
-    final_df = df[final_columns]
-    print("最终格式转换完成。")
+    dc_codes, dc_uniques = pd.factorize(df['借贷方向'], use_na_sentinel=False)
+    dc_cd = _map_uniques(dc_codes, pd.Series(dc_uniques), {'借': 'D', '贷': 'C'})
+    amount = df['金额'].to_numpy(dtype='int64')
+    is_credit = np.asarray(dc_cd == 'C')
+
+    final_df = pd.DataFrame({
+        'account_period': _constant_column(account_period, n),
+        'dc_cd': dc_cd,
+        'account_code': df['I17科目代码'].array,
+        'account_name': df['I17科目名称'].array,
+        'org_segment': _map_uniques(org_codes, org_keys, mappings['org']),
+        'agriculture_segment': _constant_column('0', n),
+        'cost_center_segment': _map_uniques(org_codes, org_keys, mappings['cost_center']),
+        'detail_segment': _constant_column('0', n),
+        'product_segment': _map_uniques(product_codes, product_keys, mappings['product']),
+        'coverage_segment': _constant_column('0', n),
+        'channel_segment': _map_uniques(channel_codes, channel_keys, mappings['channel']),
+        'car_cash_segment': _map_uniques(car_codes, car_keys, mappings['car']),
+        'reserve1': _constant_column('0', n),
+        'reserve2': _constant_column('0', n),
+        'portfolio_id': df['合同组合编号'].array,
+        'insurance_contract_group_id': df['合同分组编号'].array,
+        'origin_currency_code': _constant_column('CNY', n),  # Assuming CNY from context
+        'origin_currency_amt': amount,
+        'exchange_rate': np.full(n, 1.00),
+        'local_currency_code': _constant_column('CNY', n),
+        'local_currency_amt': amount,
+        'dc_local_currency_amt': np.where(is_credit, -amount, amount),
+        'evaluate_method': _constant_column('4', n),
+        'insurance_type': _constant_column(insurance_type, n),
+        'origin_data_type': _constant_column('9', n),
+    }, columns=FINAL_COLUMNS[1:])
+    final_df.insert(0, 'sj_id', entry_ids(final_df, df).astype(object))
+
+    if verbose:
+        print("最终格式转换完成。")
     return final_df
 
 # --- Main Execution Logic ---
 
-def build_filter_condition(table_name, val_method, filter_enabled=True, sign_year='2024', start_month='202501'):
+def load_segment_mappings():
+    """Loads the segment mappings, printing the reason and returning None on failure."""
+    try:
+        # Load mapping files (compiled artifact, rebuilt when a source file changes)
+        print("正在加载映射文件...")
+        mappings = load_mappings()
+        print("映射文件加载完成。")
+        return mappings
+
+    except FileNotFoundError as e:
+        print(f"错误：映射文件未找到 - {e}")
+        print(f"请确保所有映射文件都存在于 '{MAPPING_DIR}/' 目录下。")
+        return None
+    except Exception as e:
+        print(f"加载映射文件时发生错误: {e}")
+        return None
+
+def load_allocation(val_month, source=ALLOCATION_SOURCE, driver=DEFAULT_DRIVER):
     """
-    构建过滤条件：排除签单年在指定年份且起期在指定月份的数据
-    
-    Args:
-        table_name: 表名（用于判断是直保还是再保）
-        val_method: 评估方法（'8'=直保, '10'=分出, '11'=分入）
-        filter_enabled: 是否启用过滤
-        sign_year: 签单年份
-        start_month: 起期月份（格式：yyyyMM）
-    
-    Returns:
-        SQL条件字符串
+    Loads the allocation ratios of `val_month` (see allocation), printing the reason
+    and returning None on failure or when the reference is for another period.
     """
-    # 分入业务（val_method=11）不做筛选
-    if val_method == '11' or not filter_enabled:
-        return ""
-    
-    if 'measure_cx_unexpired' in table_name:
-        # 直保：ini_confirm是yyyy-mm-dd格式，start_date是yyyy-mm-dd格式
-        # 签单年2024且起期在2025年1月的数据要排除
-        start_year = start_month[:4]  # 从'202501'提取'2025'
-        start_month_num = start_month[4:6]  # 从'202501'提取'01'
-        next_month = f"{int(start_month_num) + 1:02d}"  # 计算下一个月'02'
-        return f"""
-        AND NOT (
-            LEFT("ini_confirm", 4) = '{sign_year}'
-            AND "start_date" >= '{start_year}-{start_month_num}-01'
-            AND "start_date" < '{start_year}-{next_month}-01'
+    path = allocation_source_for(val_month, source)
+    try:
+        print(f"正在加载分摊参考表 {path}...")
+        return load_allocation_ratios(path, val_month, driver=driver)
+    except FileNotFoundError as e:
+        print(f"错误：分摊参考表未找到 - {e}")
+        return None
+    except Exception as e:
+        print(f"加载分摊参考表时发生错误: {e}")
+        return None
+
+# 追溯索引（汇总行 sj_id -> 原分录 sj_id）的行数是原分录数，不适合 xlsx
+DRILL_BACK_SUFFIX = '_追溯'
+DRILL_BACK_FORMAT = 'parquet' if HAS_PYARROW else 'csv.gz'
+
+def report_reconciliation(reconciled, output_filename):
+    """Prints each line's reconciliation and writes the unbalanced cells, if any, to CSV."""
+    differences = []
+    for line, (line_differences, summary) in reconciled.items():
+        print_reconciliation(line_differences, summary)
+        if len(line_differences):
+            differences.append(line_differences.assign(line=BUSINESS_LINES[line]['label']))
+    if differences:
+        stats = write_sheets({'对账差异': pd.concat(differences, ignore_index=True)}, output_filename,
+                             default_format='csv')
+        print_writer_report(stats)
+    elif reconciled:
+        print("对账通过：所有规则的分录金额与源数据合计一致。")
+
+def load_into_target_table(sheets, target_table, val_month, instr=None):
+    """
+    Loads the final sheets into `target_table` with COPY and replaces that account_period's
+    rows atomically (see table_sink). Returns the load statistics, or None on failure.
+    """
+    instr = instr or Instrumentation()
+    conn = None
+    try:
+        conn = psycopg2.connect(**DB_PARAMS)
+        print(f"正在以 COPY 写入 {target_table} (account_period = '{val_month}')...")
+        with instr.stage('load_target_table', rows_in=sum(len(df) for df in sheets.values()),
+                         val_month=val_month) as rec:
+            sink = CopyTableSink(conn, target_table, val_month)
+            for sheet_name, df in sheets.items():
+                sink.append(sheet_name, df)
+            stats = sink.close()
+            rec['rows_out'] = sum(s['rows'] for s in stats)
+            rec['bytes'] = sum(s['bytes'] for s in stats)
+        return stats
+    except OperationalError as e:
+        print(f"数据库连接失败: {e}")
+        return None
+    except Exception as e:
+        print(f"写入目标表 {target_table} 时发生错误: {e}")
+        return None
+    finally:
+        if conn is not None:
+            conn.close()
+            print("数据库连接已关闭。")
+
+# 各业务线在结果文件中的 sheet 名，也是写出顺序
+SHEET_NAMES = {'direct': '直保', 'assumed': '分入', 'ceded': '分出'}
+
+LINE_PROCESSES = {
+    'direct': (lambda df: process_direct_business(df, filter_enabled=False), '1'),
+    'assumed': (process_assumed_reinsurance, '2'),
+    'ceded': (process_ceded_reinsurance, '2'),
+}
+
+def _checkpointed_stage(instr, checkpoints, stage, key, compute, rows_in, val_month):
+    """Runs one frame-producing stage, through `checkpoints` when given."""
+    with instr.stage(stage, rows_in=rows_in, val_month=val_month) as rec:
+        if checkpoints is None:
+            df = compute()
+        else:
+            df, rec['checkpoint_hit'] = checkpoints.run(stage, key, compute)
+        rec['rows_out'] = len(df)
+    return df
+
+def _restored_stage(instr, checkpoints, stage, key, val_month):
+    """Returns the checkpointed output of `stage` for `key`, or None if it is missing or unreadable."""
+    if not checkpoints.has(stage, key):
+        return None
+    with instr.stage(stage, val_month=val_month) as rec:
+        df = checkpoints.load(stage, key)
+        rec['checkpoint_hit'] = df is not None
+        rec['rows_out'] = None if df is None else len(df)
+    if df is not None:
+        checkpoints.keys[stage] = key
+    return df
+
+def expand_lines(frames, mappings, val_month, instr=None, reconcile=False, checkpoints=None, allocation=None):
+    """
+    Runs process -> transform (and with `reconcile=True` the reconciliation) for each
+    line in `frames` ({line: extracted frame}) in this process.
+    With `checkpoints` (see checkpoints.CheckpointStore) each process/transform stage
+    is keyed by its inputs and restored instead of recomputed when they are unchanged.
+    With `allocation` (see allocation.load_allocation_ratios) the group-level entries
+    are allocated between process and transform; reconciliation checks the entries
+    before allocation.
+    Returns ({line: final frame}, {line: reconciliation result}).
+    """
+    instr = instr or Instrumentation()
+    mapping_key = mappings_digest(mappings) if checkpoints is not None else None
+    allocation_key = frame_digest(allocation) if checkpoints is not None and allocation is not None else None
+    finals, reconciled = {}, {}
+    for line, df in frames.items():
+        process, insurance_type = LINE_PROCESSES[line]
+        process_key = allocate_key = transform_key = None
+        if checkpoints is not None:
+            process_key = digest(f'process_{line}', frame_digest(df), rules_digest())
+            allocate_key = digest(f'allocate_{line}', process_key, allocation_key)
+            transform_key = digest(f'transform_{line}', process_key if allocation is None else allocate_key,
+                                   mapping_key, val_month)
+        # 转换结果可以复用且不对账时，连展开结果也不必读取；读取失败时照常从展开开始重算
+        final = None
+        if checkpoints is not None and not reconcile:
+            final = _restored_stage(instr, checkpoints, f'transform_{line}', transform_key, val_month)
+        if final is None:
+            # Process each business type
+            entries = _checkpointed_stage(instr, checkpoints, f'process_{line}', process_key,
+                                          lambda: process(df), len(df), val_month)
+            allocated = entries
+            if allocation is not None:
+                allocated = _checkpointed_stage(instr, checkpoints, f'allocate_{line}', allocate_key,
+                                                lambda: allocate_entries(entries, allocation, line),
+                                                len(entries), val_month)
+            # Transform to final format
+            final = _checkpointed_stage(
+                instr, checkpoints, f'transform_{line}', transform_key,
+                lambda: transform_to_final_format(allocated, insurance_type, mappings, account_period=val_month),
+                len(allocated), val_month)
+        finals[line] = final
+        if reconcile:
+            with instr.stage(f'reconcile_{line}', rows_in=len(entries), val_month=val_month) as rec:
+                reconciled[line] = reconcile_line(df, entries, finals[line], line)
+                rec['mismatched'] = len(reconciled[line][0])
+    return finals, reconciled
+
+def generate_entry_report(df_8, df_11, df_10, mappings, val_month, output_filename,
+                          output_formats=None, default_output_format='xlsx', instr=None, parallel=False,
+                          target_table=None, rollup=False, reconcile=False, checkpoints=None, allocation=None):
+    """
+    Generates the entries of one period from its extracted frames and writes the report.
+    Each business line's process and transform steps are recorded as stages on `instr`.
+    With `parallel=True` the three lines run in separate worker processes (see parallel_lines).
+    With `target_table` the entries are loaded into that table instead of written to files.
+    With `rollup=True` the entries are summed to ledger granularity (see ledger_rollup) and
+    a drill-back index per sheet is written next to the output.
+    With `reconcile=True` each line's entries are checked against its source sums (see
+    reconciliation); cells that do not balance are written to <output>_对账差异.csv.
+    `checkpoints` makes the in-process expansion and the file output resumable (see
+    expand_lines and write_entry_report); the parallel path does not checkpoint.
+    `allocation` allocates the group-level entries (see allocation); it runs in-process.
+    Returns False if the output could not be written.
+    """
+    instr = instr or Instrumentation()
+    if parallel and allocation is not None:
+        print("分摊在主进程中执行，本期不使用多进程并行。")
+        parallel = False
+    if parallel:
+        jobs = {
+            'direct': (df_8, process_direct_business, '1', '直保'),
+            'assumed': (df_11, process_assumed_reinsurance, '2', '分入'),
+            'ceded': (df_10, process_ceded_reinsurance, '2', '分出'),
+        }
+        # 汇总或写入目标表时，所有 sheet 都以 Arrow IPC 交回主进程再处理
+        collect = bool(target_table or rollup)
+        print("正在以多进程并行处理直保、分入、分出...")
+        xlsx_sheets, stats, reconciled = run_lines_in_processes(
+            jobs, transform_to_final_format, mappings, val_month, output_filename,
+            output_formats={} if collect else output_formats,
+            default_output_format='xlsx' if collect else default_output_format, instr=instr,
+            reconcile=reconcile_line if reconcile else None,
         )
-        """
+        report_reconciliation(reconciled, output_filename)
+        if not collect:
+            # 保持 直保/分入/分出 的 sheet 顺序
+            sheets = {name: xlsx_sheets[name] for name in SHEET_NAMES.values() if name in xlsx_sheets}
+            if xlsx_sheets:
+                print(f"正在写入最终结果到 {output_filename}...")
+                with instr.stage('write_output', rows_in=sum(len(df) for df in sheets.values()),
+                                 val_month=val_month) as rec:
+                    xlsx_stats = write_sheets(sheets, output_filename, default_format='xlsx')
+                    rec['rows_out'] = sum(s['rows'] for s in xlsx_stats)
+                    rec['bytes'] = sum(s['bytes'] for s in xlsx_stats)
+                stats = xlsx_stats + stats
+            print_writer_report(stats)
+            return True
+        finals = {line: xlsx_sheets[name] for line, name in SHEET_NAMES.items()}
     else:
-        # 再保（分出）：under_write_date/certi_write_date是yyyymmdd格式，start_date是yyyymmdd格式
-        # 签单年2024且起期在2025年1月的数据要排除
-        start_date_begin = start_month + '01'  # 如：20250101
-        start_date_end = start_month + '32'    # 如：20250132（用于 < 比较）
-        return f"""
-        AND NOT (
-            (
-                ("certi_no" IS NULL OR "certi_no" = '') AND LEFT("under_write_date", 4) = '{sign_year}'
-                OR
-                ("certi_no" IS NOT NULL AND "certi_no" != '') AND LEFT("certi_write_date", 4) = '{sign_year}'
-            )
-            AND "start_date" >= '{start_date_begin}'
-            AND "start_date" < '{start_date_end}'
-        )
-        """
+        finals, reconciled = expand_lines({'direct': df_8, 'assumed': df_11, 'ceded': df_10}, mappings, val_month,
+                                          instr=instr, reconcile=reconcile, checkpoints=checkpoints,
+                                          allocation=allocation)
+        report_reconciliation(reconciled, output_filename)
 
-def build_direct_filter_case(filter_enabled=True):
+    return write_entry_report(finals, val_month, output_filename, output_formats=output_formats,
+                              default_output_format=default_output_format, instr=instr,
+                              target_table=target_table, rollup=rollup, checkpoints=checkpoints)
+
+def write_entry_report(finals, val_month, output_filename, output_formats=None, default_output_format='xlsx',
+                       instr=None, target_table=None, rollup=False, checkpoints=None):
     """
-    构建直保过滤条件（CASE表达式用）：当过滤启用时，起期大于20241231的保单不做2606010801和2606011002这两个分录。
-    返回SQL片段，可放入CASE WHEN中。
+    Writes the final entries of each line ({line: frame}) as the 直保/分入/分出 sheets,
+    rolled up first with `rollup=True`, or loads them into `target_table`.
+    With `checkpoints` holding the transform keys of all lines, a file output whose
+    inputs and options are unchanged and whose files still exist is not rewritten.
+    Returns False if the output could not be written.
     """
-    if not filter_enabled:
-        return "FALSE"
+    instr = instr or Instrumentation()
+    finals = dict(finals)
+    write_key = None
+    transform_keys = [checkpoints.keys.get(f'transform_{line}') for line in SHEET_NAMES] if checkpoints else [None]
+    if not target_table and all(transform_keys):
+        write_key = digest('write_output', *transform_keys, output_filename, rollup, default_output_format,
+                           sorted((output_formats or {}).items()))
+        if checkpoints.is_done('write_output', write_key):
+            print(f"分录与输出选项均未变化，{output_filename} 等输出文件已存在，跳过写出。")
+            return True
+    drill_sheets = {}
+    if rollup:
+        for line, name in SHEET_NAMES.items():
+            with instr.stage(f'rollup_{line}', rows_in=len(finals[line]), val_month=val_month) as rec:
+                finals[line], drill_sheets[name + DRILL_BACK_SUFFIX] = rollup_entries(finals[line])
+                rec['rows_out'] = len(finals[line])
+            print(f"{name}分录已汇总到总账粒度: {rec['rows_in']} -> {rec['rows_out']} 行")
+
+    sheets = {name: finals[line] for line, name in SHEET_NAMES.items()}
+    stats = []
+    if drill_sheets:
+        print("正在写出追溯索引...")
+        with instr.stage('write_drill_back', rows_in=sum(len(df) for df in drill_sheets.values()),
+                         val_month=val_month) as rec:
+            stats = write_sheets(drill_sheets, output_filename, default_format=DRILL_BACK_FORMAT)
+            rec['rows_out'] = sum(s['rows'] for s in stats)
+            rec['bytes'] = sum(s['bytes'] for s in stats)
 
-    return "\"start_date\" > '2024-12-31'"
+    if target_table:
+        load_stats = load_into_target_table(sheets, target_table, val_month, instr=instr)
+        if load_stats is None:
+            return False
+        print_writer_report(load_stats + stats)
+        return True
 
-def main():
+    # Write to a single Excel file with multiple sheets
+    print(f"正在写入最终结果到 {output_filename}...")
+    with instr.stage('write_output', rows_in=sum(len(df) for df in sheets.values()), val_month=val_month) as rec:
+        sheet_stats = write_sheets(sheets, output_filename, formats=output_formats,
+                                   default_format=default_output_format)
+        rec['rows_out'] = sum(s['rows'] for s in sheet_stats)
+        rec['bytes'] = sum(s['bytes'] for s in sheet_stats)
+        rec['files'] = [s['path'] for s in sheet_stats]
+    if write_key is not None:
+        checkpoints.mark_done('write_output', write_key, files=[s['path'] for s in sheet_stats + stats])
+    print_writer_report(sheet_stats + stats)
+    return True
+
+def extract_sharded(queries, val_month, n_shards, shard_key='group_id', shard_val_methods=('8',),
+                    max_workers=3, ingest='pandas', verify=False):
     """
-    Main function to orchestrate the entire process from data extraction to final report generation.
+    Runs the extraction with the listed val_methods split into hash shards across
+    several connections, and merges the partial aggregates client-side.
+    With `verify=True` the unsharded queries are also run and compared.
     """
-    # --- SQL Queries and Groupby Definitions ---
-    # 注意：起期大于20241231的保单已在WHERE条件中排除，不参与查询和聚合
-
-    sql_8 = """
-    SELECT
-        "com_code" AS "归属机构", "business_nature" AS "业务渠道", "car_kind_code" AS "车辆种类",
-        "use_nature_code" AS "使用性质代码", "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号",
-        "val_method" AS "评估方法", "risk_code" AS "险种代码", "class_code" AS "险类代码",
-        SUM("total_premium") AS "保费_本币",
-        SUM("total_iacf_amt") AS "保险获取现金流_本币",
-        SUM("acc_confirmed_premium") AS "保险合同收入",
-        SUM("acc_iacf_premium") AS "当期确认的IACF",
-        SUM("lrc_loss_cost_policy") AS "亏损部分",
-        SUM("ifie_amt") AS "IACF计息"
-    """
-    groupby_8 = [
-        "com_code", "business_nature", "car_kind_code", "use_nature_code", "portfolio_id", 
-        "group_id", "val_method", "risk_code", "class_code"
-    ]
-    
-    sql_11 = """
-    SELECT
-        "com_code" AS "归属机构", "car_kind_code" AS "车辆种类", "use_nature_code" AS "使用性质代码", 
-        "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号", "val_method" AS "评估方法", 
-        "risk_code" AS "险种代码", "class_code" AS "险类代码", "contract_flag" AS "合同标识", 
-        "enquiry_type" AS "临分类型", "contract_type" AS "合约类型", "rein_type" AS "分出类型",
-        SUM("premium") AS "分保费收入",
-        SUM("commission") AS "分保费用",
-        SUM("brokerage") AS "经纪费",
-        SUM("net_premium_amortization") AS "预收净保费摊销",
-        SUM("cumulative_ifie_amt_amortization") AS "累积计息摊销",
-        SUM("cumulative_no_iacf_amortization") AS "获取费用摊销",
-        SUM("no_iacf_cash_flow") AS "业务及管理费结转",
-        SUM("loss_component_allocation") AS "亏损部分",
-        SUM("cumulative_ifie_amt") AS "计息"
-    """
-    groupby_11 = [
-        "com_code", "car_kind_code", "use_nature_code", "portfolio_id", "group_id", 
-        "val_method", "risk_code", "class_code", "contract_flag", "enquiry_type", 
-        "contract_type", "rein_type"
-    ]
-
-    sql_10 = """
-    SELECT
-        "com_code" AS "归属机构", "car_kind_code" AS "车辆种类", "use_nature_code" AS "使用性质代码", 
-        "portfolio_id" AS "合同组合编号", "group_id" AS "合同分组编号", "val_method" AS "评估方法", 
-        "risk_code" AS "险种代码", "class_code" AS "险类代码", "contract_flag" AS "合同标识", 
-        "enquiry_type" AS "临分类型", "contract_type" AS "合约类型", "rein_type" AS "分出类型",
-        SUM("premium") AS "分出保费",
-        SUM("commission") AS "手续费_本币",
-        SUM("brokerage") AS "经纪费_本币",
-        SUM("net_premium_amortization") AS "预收净保费摊销",
-        SUM("cumulative_ifie_amt_amortization") AS "累积计息摊销",
-        SUM("loss_component") AS "亏损摊回部分",
-        SUM("base_investment_amortization") AS "投资成分",
-        SUM("cumulative_ifie_amt") AS "计息"
-    """
-    groupby_10 = [
-        "com_code", "car_kind_code", "use_nature_code", "portfolio_id", "group_id", 
-        "val_method", "risk_code", "class_code", "contract_flag", "enquiry_type", 
-        "contract_type", "rein_type"
-    ]
-
-    # --- Step 1: Extract data from database and save for checking ---
-    print("--- 步骤 1: 开始从数据库提取数据 ---")
-    
-    df_8 = get_data_from_db('8', sql_8, groupby_8, table_name='"measure_platform"."measure_cx_unexpired"', 
-                           additional_where_clause='AND "end_date" > \'2024-12-31\' AND "start_date" <= \'2024-12-31\'')
-    save_to_excel(df_8, 'measurement_results_8.xlsx')
-    
-    # 分入业务（val_method=11）不做筛选
-    df_11 = get_data_from_db('11', sql_11, groupby_11, table_name='"measure_platform"."int_measure_cx_unexpired_rein"', 
-                            additional_where_clause='AND "end_date" > \'20241231\'')
-    save_to_excel(df_11, 'measurement_results_11.xlsx')
-    
-    # 分出业务不做任何额外筛选，只做前两步筛选（val_month='202412' 且 end_date > '20241231'）
-    df_10 = get_data_from_db('10', sql_10, groupby_10, table_name='"measure_platform"."int_measure_cx_unexpired_rein"', 
-                            additional_where_clause='AND "end_date" > \'20241231\'')
-    save_to_excel(df_10, 'measurement_results_10.xlsx')
-    
-    # df_alloc = execute_raw_query(sql_alloc, "分摊结果查询") # No longer needed
-    # save_to_excel(df_alloc, 'allocation_results.xlsx') # No longer needed
-    print("--- 步骤 1: 数据库数据提取并保存完成 ---\n")
+    shard_val_methods = [val_method for val_method in shard_val_methods if val_method in queries]
+    run_queries = dict(queries)
+    for val_method in shard_val_methods:
+        del run_queries[val_method]
+        run_queries.update(build_sharded_queries(val_method, EXTRACTION_SPECS[val_method], val_month,
+                                                 n_shards, shard_key=shard_key))
+    # 分片本身就是请求的并行度，连接池至少容纳所有分片
+    workers = max(max_workers, n_shards)
+    results, _ = extract_concurrently(run_queries, DB_PARAMS, max_workers=workers, ingest=ingest)
+    results = merge_shard_results(results)
+
+    if verify:
+        check, _ = extract_concurrently({val_method: queries[val_method] for val_method in shard_val_methods},
+                                        DB_PARAMS, max_workers=workers, ingest=ingest)
+        for val_method in shard_val_methods:
+            if frames_equal_unordered(results[val_method], check[val_method]):
+                print(f"校验通过：val_method = '{val_method}' 分片合并结果与不分片结果一致。")
+            else:
+                print(f"错误：val_method = '{val_method}' 分片合并结果与不分片结果不一致！")
+                results[val_method] = None
+    return results
 
-    # Check if all dataframes were created successfully
-    if df_8 is None or df_11 is None or df_10 is None:
-        print("错误：一个或多个数据提取步骤失败，程序终止。请检查数据库连接和查询。")
-        return
+ENGINES = ('pandas', 'sql')
+
+def run_sql_engine(val_month, ingest='pandas', output_formats=None, default_output_format='xlsx',
+                   target_table=None, instr=None):
+    """
+    Generates all entries inside PostgreSQL: the same rule tables are compiled into SQL
+    and the mappings are uploaded to session temp tables. Entries come back already
+    expanded, or with `target_table` are inserted into a staging table and swapped
+    into the target by account_period (see table_sink), never leaving the server.
+    """
+    instr = instr or Instrumentation()
+    with instr.stage('load_mappings'):
+        mappings = load_segment_mappings()
+    if mappings is None:
+        return False
 
-    # --- Step 2: Load mappings, process data, and generate final report ---
-    print("--- 步骤 2: 开始生成分录结果报告 ---")
+    conn = None
     try:
-        # Load mapping files
-        print("正在加载映射文件...")
-        map_product_df = pd.read_excel(
-            '给翟总/财务段值转换/产品管理导出列表.xls', 
-            header=None, 
-            usecols=[0, 2], 
-            names=['code', 'segment'],
-            dtype=str
-        )
-        map_product_df.dropna(inplace=True)
-        map_product_df.drop_duplicates(subset=['code'], inplace=True)
-        map_product = map_product_df.set_index('code')['segment']
+        conn = psycopg2.connect(**DB_PARAMS)
+        print(f"数据库连接成功！正在数据库中生成分录 (val_month = '{val_month}')...")
+        with instr.stage('upload_mappings'):
+            copy_mappings_to_temp_tables(conn, mappings)
+        sheets, sink = {}, None
+        if target_table is not None:
+            sink = CopyTableSink(conn, target_table, val_month)
+            sink.begin(FINAL_COLUMNS)
+        for line, line_spec in BUSINESS_LINES.items():
+            spec = EXTRACTION_SPECS[line_spec['val_method']]
+            with instr.stage(f'sql_entries_{line}', val_month=val_month) as rec:
+                result = generate_entries_sql(
+                    conn, line, spec, val_month, ingest=ingest, columns=FINAL_COLUMNS,
+                    target_table=None if sink is None else f'pg_temp."{sink.staging_table}"',
+                )
+                if sink is None:
+                    sheets[line_spec['label']] = result
+                    rec['rows_out'], rec['bytes'] = len(result), frame_bytes(result)
+                else:
+                    sink.add_staged_rows(line_spec['label'], result)
+                    rec['rows_out'] = result
+        if sink is not None:
+            with instr.stage('swap_target_table', val_month=val_month) as rec:
+                stats = sink.close()
+                rec['rows_out'] = sum(s['rows'] for s in stats)
+            print_writer_report(stats)
+    except OperationalError as e:
+        print(f"数据库连接失败: {e}")
+        return False
+    except Exception as e:
+        print(f"在数据库中生成分录时发生错误: {e}")
+        return False
+    finally:
+        if conn is not None:
+            conn.close()
+            print("数据库连接已关闭。")
+
+    if target_table is None:
+        output_filename = '未到期分录结果.xlsx'
+        print(f"正在写入最终结果到 {output_filename}...")
+        with instr.stage('write_output', rows_in=sum(len(df) for df in sheets.values())) as rec:
+            stats = write_sheets(sheets, output_filename, formats=output_formats,
+                                 default_format=default_output_format)
+            rec['rows_out'] = sum(s['rows'] for s in stats)
+            rec['bytes'] = sum(s['bytes'] for s in stats)
+        print_writer_report(stats)
+    print("处理完成！")
+    return True
+
+def run_streaming(val_month, ingest='cursor', chunksize=DEFAULT_CHUNKSIZE, replay=False, output_formats=None,
+                  default_output_format='xlsx', output_filename='未到期分录结果.xlsx', target_table=None, instr=None):
+    """
+    Bounded-memory mode: each business line is read in chunks (server-side cursor or
+    COPY, or the snapshot with `replay`), expanded, mapped and appended to the output
+    chunk by chunk. The output is identical to the in-memory path; peak memory is set
+    by `chunksize`. Snapshots and the intermediate Excel files are not written here.
+    With `target_table` the chunks are COPYed into that table instead of files.
+    """
+    instr = instr or Instrumentation()
+    queries = {line: build_period_query(line_spec['val_method'], EXTRACTION_SPECS[line_spec['val_method']], val_month)
+               for line, line_spec in BUSINESS_LINES.items()}
+    if replay:
+        # 在打开输出之前确认快照齐全：缺快照时与非流式回放一样报错，而不是写出空表并报告成功
+        missing = [line_spec['val_method'] for line, line_spec in BUSINESS_LINES.items()
+                   if not HAS_PYARROW or find_snapshot(val_month, line_spec['val_method'], queries[line]) is None]
+        if missing:
+            raise FileNotFoundError(f"未找到 val_month = '{val_month}' 且 SQL 一致的快照 "
+                                    f"(val_method {', '.join(missing)})，无法回放")
+
+    with instr.stage('load_mappings'):
+        mappings = load_segment_mappings()
+    if mappings is None:
+        return False
+
+    # 'pandas' 方式无法分块，流式模式下改用服务端游标
+    method = ingest if ingest in ('cursor', 'copy') else 'cursor'
+    conn = sink_conn = None
+    try:
+        if target_table:
+            # 读取用的服务端游标在事务中，COPY 批次各自提交，所以写入使用单独的连接
+            sink_conn = psycopg2.connect(**DB_PARAMS)
+            writer = CopyTableSink(sink_conn, target_table, val_month)
+        else:
+            writer = StreamingSheetWriter(output_filename, formats=output_formats,
+                                          default_format=default_output_format)
+        if not replay:
+            conn = psycopg2.connect(**DB_PARAMS)
+            print(f"数据库连接成功！正在分块提取并生成分录 (val_month = '{val_month}', 每块 {chunksize} 行)...")
+        for line, line_spec in BUSINESS_LINES.items():
+            if replay:
+                chunks = iter_snapshot_chunks(val_month, line_spec['val_method'], queries[line], chunksize=chunksize)
+            else:
+                chunks = iter_query_chunks(conn, queries[line], method=method, chunksize=chunksize)
+            rows = stream_business_line(chunks, line, line_spec['insurance_type'], mappings, val_month, writer,
+                                        line_spec['label'], transform_to_final_format, instr=instr)
+            print(f"{line_spec['label']}分录已写出: {rows} 行")
+        print(f"正在完成写入 {target_table or output_filename}...")
+        with instr.stage('write_output', val_month=val_month) as rec:
+            stats = writer.close()
+            rec['rows_out'] = sum(s['rows'] for s in stats)
+            rec['bytes'] = sum(s['bytes'] for s in stats)
+    except OperationalError as e:
+        print(f"数据库连接失败: {e}")
+        return False
+    except Exception as e:
+        print(f"流式生成分录时发生错误: {e}")
+        return False
+    finally:
+        if sink_conn is not None:
+            sink_conn.close()
+        if conn is not None:
+            conn.close()
+            print("数据库连接已关闭。")
+    print_writer_report(stats)
+    print("处理完成！")
+    return True
+
+def run_incremental(val_month, max_workers=3, ingest='pandas', output_formats=None, default_output_format='xlsx',
+                    output_filename='未到期分录结果.xlsx', target_table=None, rollup=False, reconcile=False,
+                    allocation_source=None, allocation_driver=DEFAULT_DRIVER, instr=None):
+    """
+    Reruns a period recomputing only the contract groups whose source rows changed
+    since the last incremental run of the same val_month (see incremental): the
+    per-group fingerprints are recomputed server-side, only changed groups are
+    extracted and expanded, and their entries are spliced into the stored ones.
+    Without usable state the period is extracted in full and the state is created.
+    With `reconcile=True` only the recomputed groups are reconciled. Allocation works
+    within one contract group, so allocated entries splice like any others.
+    """
+    instr = instr or Instrumentation()
+    with instr.stage('load_mappings'):
+        mappings = load_segment_mappings()
+    if mappings is None:
+        return False
+    allocation = None
+    if allocation_source:
+        with instr.stage('load_allocation'):
+            allocation = load_allocation(val_month, allocation_source, driver=allocation_driver)
+        if allocation is None:
+            return False
+
+    queries = {val_method: build_period_query(val_method, spec, val_month)
+               for val_method, spec in EXTRACTION_SPECS.items()}
+    key = config_key(queries, mappings, allocation=allocation)
+
+    # 先取指纹再提取：两者之间发生的更正在下次运行时会被识别为变化
+    print(f"--- 步骤 1: 计算各合同分组的源数据指纹 (val_month = '{val_month}') ---")
+    with instr.stage('fingerprint_groups', val_month=val_month) as rec:
+        fingerprints, rec['query_seconds'] = extract_concurrently(
+            {val_method: build_fingerprint_query(val_method, spec, val_month)
+             for val_method, spec in EXTRACTION_SPECS.items()},
+            DB_PARAMS, max_workers=max_workers, ingest=ingest)
+        _extracted_stats(rec, fingerprints)
+    if any(df is None for df in fingerprints.values()):
+        print("错误：计算分组指纹失败，程序终止。请检查数据库连接和查询。")
+        return False
+    fingerprints = {val_method: df[FINGERPRINT_COLUMNS] for val_method, df in fingerprints.items()}
+
+    state = load_state(val_month, key)
+    previous_finals = {}
+    changed = {val_method: None for val_method in queries}  # None 表示整体重新提取
+    if state is not None:
+        previous_fingerprints, previous_finals = state
+        for val_method, df in fingerprints.items():
+            groups = changed_groups(previous_fingerprints[val_method], df)
+            print(f"val_method = '{val_method}': {len(groups)}/{len(df)} 个合同分组有变化")
+            if len(groups) <= FULL_RERUN_FRACTION * len(df):
+                changed[val_method] = groups
+
+    extract_queries = {}
+    for val_method, groups in changed.items():
+        if groups is None:
+            extract_queries[val_method] = queries[val_method]
+        elif groups:
+            extract_queries[val_method] = build_group_query(val_method, EXTRACTION_SPECS[val_method], val_month,
+                                                            groups)
+
+    frames = {}
+    if extract_queries:
+        print(f"--- 步骤 2: 提取需要重算的数据 (val_method {', '.join(extract_queries)}) ---")
+        with instr.stage('extract_changed_groups', val_month=val_month, ingest=ingest) as rec:
+            results, rec['query_seconds'] = extract_concurrently(extract_queries, DB_PARAMS,
+                                                                 max_workers=max_workers, ingest=ingest)
+            _extracted_stats(rec, results)
+        if any(df is None for df in results.values()):
+            print("错误：一个或多个数据提取步骤失败，程序终止。请检查数据库连接和查询。")
+            return False
+        frames = {line: encode_dimensions(results[line_spec['val_method']])
+                  for line, line_spec in BUSINESS_LINES.items() if line_spec['val_method'] in results}
+    else:
+        print("所有合同分组均无变化，直接复用上次的分录。")
+
+    recomputed, reconciled = expand_lines(frames, mappings, val_month, instr=instr, reconcile=reconcile,
+                                          allocation=allocation)
+    report_reconciliation(reconciled, output_filename)
+
+    finals = {}
+    for line, line_spec in BUSINESS_LINES.items():
+        groups = changed[line_spec['val_method']]
+        if groups is None:
+            finals[line] = recomputed[line]
+        elif line in recomputed:
+            with instr.stage(f'splice_{line}', rows_in=len(previous_finals[line]), val_month=val_month) as rec:
+                finals[line] = splice_entries(previous_finals[line], recomputed[line], groups)
+                rec['rows_out'] = len(finals[line])
+                rec['groups'] = len(groups)
+            print(f"{line_spec['label']}: 重算 {len(groups)} 个合同分组，替换为 {len(recomputed[line])} 行分录")
+        else:
+            finals[line] = previous_finals[line]
+
+    with instr.stage('save_incremental_state', val_month=val_month):
+        save_state(val_month, key, fingerprints, finals)
+    return write_entry_report(finals, val_month, output_filename, output_formats=output_formats,
+                              default_output_format=default_output_format, instr=instr,
+                              target_table=target_table, rollup=rollup)
+
+def _extracted_stats(rec, results):
+    frames = [df for df in results.values() if df is not None]
+    rec['rows_out'] = sum(len(df) for df in frames)
+    rec['bytes'] = sum(frame_bytes(df) for df in frames)
+
+def main(max_workers=3, ingest='pandas', replay=False, save_intermediate_excel=True,
+         output_formats=None, default_output_format='xlsx', val_month=VAL_MONTH,
+         shards=1, shard_key='group_id', verify_shards=False, engine='pandas', target_table=None,
+         run_report=None, profile_stages=(), trace_memory_stages=(), parallel_lines=False,
+         stream=False, chunksize=DEFAULT_CHUNKSIZE, rollup=False, reconcile=False, incremental=False,
+         checkpoint=False, resume=False, allocation_source=None, allocation_driver=DEFAULT_DRIVER):
+    """
+    Main function to orchestrate the entire process from data extraction to final report generation.
+
+    With `replay=True` step 1 is served entirely from the snapshot cache and no
+    database connection is made. `output_formats` maps sheet name to one of
+    OUTPUT_FORMATS; unlisted sheets use `default_output_format`. With `shards > 1`
+    the direct-business query is split into hash shards by `shard_key`.
+    `engine='sql'` expands the entries inside PostgreSQL instead (see run_sql_engine).
+    With `target_table` the entries replace that period's rows in a PostgreSQL table
+    instead of being written to files (see table_sink).
+    Every stage is measured; `run_report` writes the metrics as JSON lines, and
+    `profile_stages` / `trace_memory_stages` switch on cProfile / tracemalloc per stage.
+    `parallel_lines` runs the three business lines in separate processes, and
+    `stream=True` switches to the bounded-memory chunked mode (see run_streaming).
+    `rollup=True` sums the entries to ledger granularity before output, and `reconcile=True`
+    checks them against the source sums (both pandas engine only).
+    `incremental=True` recomputes only the contract groups changed since the last
+    incremental run of the period (see run_incremental).
+    With `checkpoint=True` the pandas path checkpoints each stage (see checkpoints); with
+    `resume=True` (which also checkpoints) stages whose inputs are unchanged are restored
+    from their checkpoints, the extraction from the snapshot cache, so a rerun continues
+    from the first changed or failed stage.
+    `allocation_source` names the allocation reference workbook (a `{val_month}` template
+    is filled in with the period; see allocation.allocation_source_for); its ratios are loaded
+    once and applied to the group-level entries by `allocation_driver` (see allocation).
+    """
+    validate_val_month(val_month)
+    instr = Instrumentation(run_report, profile_stages=profile_stages, trace_memory_stages=trace_memory_stages,
+                            run_info={'mode': 'single', 'val_month': val_month, 'engine': engine, 'ingest': ingest,
+                                      'replay': replay, 'shards': shards, 'max_workers': max_workers,
+                                      'parallel_lines': parallel_lines, 'stream': stream, 'chunksize': chunksize,
+                                      'target_table': target_table, 'rollup': rollup, 'reconcile': reconcile,
+                                      'incremental': incremental, 'resume': resume,
+                                      'allocation_source': allocation_source})
+    completed = False
+    try:
+        if stream:
+            completed = run_streaming(val_month, ingest=ingest, chunksize=chunksize, replay=replay,
+                                      output_formats=output_formats, default_output_format=default_output_format,
+                                      target_table=target_table, instr=instr)
+            return
+
+        if engine == 'sql':
+            completed = run_sql_engine(val_month, ingest=ingest, output_formats=output_formats,
+                                       default_output_format=default_output_format, target_table=target_table,
+                                       instr=instr)
+            return
+
+        if incremental:
+            completed = run_incremental(val_month, max_workers=max_workers, ingest=ingest,
+                                        output_formats=output_formats, default_output_format=default_output_format,
+                                        target_table=target_table, rollup=rollup, reconcile=reconcile,
+                                        allocation_source=allocation_source, allocation_driver=allocation_driver,
+                                        instr=instr)
+            return
+
+        queries = {
+            val_method: build_period_query(val_method, spec, val_month)
+            for val_method, spec in EXTRACTION_SPECS.items()
+        }
+        checkpoints = open_checkpoints(val_month, resume=resume) if checkpoint or resume else None
+        pending = {}
+
+        if replay:
+            print("--- 步骤 1: 从快照缓存回放提取结果（不连接数据库） ---")
+            with instr.stage('replay_snapshots', val_month=val_month) as rec:
+                results = {val_method: load_snapshot(val_month, val_method, query)
+                           for val_method, query in queries.items()}
+                _extracted_stats(rec, results)
+        else:
+            results = {}
+            if checkpoints is not None and checkpoints.resume:
+                # 提取阶段的检查点就是快照：SQL 一致的 val_method 不再查询数据库
+                print("--- 步骤 1: 从检查点（快照）恢复提取结果 ---")
+                with instr.stage('resume_snapshots', val_month=val_month) as rec:
+                    results = {val_method: df for val_method, query in queries.items()
+                               if (df := load_snapshot(val_month, val_method, query)) is not None}
+                    _extracted_stats(rec, results)
+            pending = {val_method: query for val_method, query in queries.items() if val_method not in results}
+
+        if pending:
+            # --- Step 1: Extract data from database and save for checking ---
+            print(f"--- 步骤 1: 开始从数据库提取数据 (val_month = '{val_month}', val_method {', '.join(pending)}) ---")
+
+            # 三个 val_method 相互独立，在共享连接池上并发查询
+            with instr.stage('extract', val_month=val_month, ingest=ingest, shards=shards) as rec:
+                if shards > 1:
+                    extracted = extract_sharded(pending, val_month, shards, shard_key=shard_key,
+                                                max_workers=max_workers, ingest=ingest, verify=verify_shards)
+                else:
+                    extracted, rec['query_seconds'] = extract_concurrently(pending, DB_PARAMS,
+                                                                           max_workers=max_workers, ingest=ingest)
+                _extracted_stats(rec, extracted)
+            results.update(extracted)
+            with instr.stage('save_snapshots', val_month=val_month):
+                for val_method, query in pending.items():
+                    save_snapshot(results[val_method], val_month, val_method, query)
+
+        # 维度列在整个流程中保持字典编码，只在写出时解码为文本
+        with instr.stage('encode_dimensions', val_month=val_month) as rec:
+            df_8, df_11, df_10 = (encode_dimensions(results[val_method]) for val_method in ('8', '11', '10'))
+            _extracted_stats(rec, results)
+
+        if save_intermediate_excel and pending:
+            # 从快照恢复的 val_method 在上次运行时已经写出过
+            with instr.stage('save_intermediate_excel', val_month=val_month):
+                for val_method, df in (('8', df_8), ('11', df_11), ('10', df_10)):
+                    if val_method in pending:
+                        save_to_excel(df, f'measurement_results_{val_method}.xlsx')
         
-        map_org_cost = pd.read_excel(
-            '给翟总/财务段值转换/机构&成本中心.xlsx', 
-            header=None, 
-            usecols=[0, 3, 4],
-            names=['code', 'org', 'cost'],
-            dtype=str
-        )
-        map_org_cost.dropna(inplace=True)
-        map_org_cost.drop_duplicates(subset=['code'], inplace=True)
-        map_org = map_org_cost.set_index('code')['org']
-        map_cost = map_org_cost.set_index('code')['cost']
+        print("--- 步骤 1: 数据库数据提取并保存完成 ---\n")
+
+        # Check if all dataframes were created successfully
+        if df_8 is None or df_11 is None or df_10 is None:
+            print("错误：一个或多个数据提取步骤失败，程序终止。请检查数据库连接和查询。")
+            return
+
+        # --- Step 2: Load mappings, process data, and generate final report ---
+        print("--- 步骤 2: 开始生成分录结果报告 ---")
+        with instr.stage('load_mappings'):
+            mappings = load_segment_mappings()
+        if mappings is None:
+            return
+        allocation = None
+        if allocation_source:
+            with instr.stage('load_allocation') as rec:
+                allocation = load_allocation(val_month, allocation_source, driver=allocation_driver)
+                rec['rows_out'] = None if allocation is None else len(allocation)
+            if allocation is None:
+                return
+
+        if not generate_entry_report(df_8, df_11, df_10, mappings, val_month, '未到期分录结果.xlsx',
+                                     output_formats=output_formats, default_output_format=default_output_format,
+                                     instr=instr, parallel=parallel_lines, target_table=target_table,
+                                     rollup=rollup, reconcile=reconcile, checkpoints=checkpoints,
+                                     allocation=allocation):
+            return
         
-        map_channel_df = pd.read_excel(
-            '给翟总/财务段值转换/渠道管理导出列表.xls', 
-            header=None, 
-            usecols=[0, 2], 
-            names=['code', 'segment'],
-            dtype=str
-        )
-        map_channel_df.dropna(inplace=True)
-        map_channel_df.drop_duplicates(subset=['code'], inplace=True)
-        map_channel = map_channel_df.set_index('code')['segment']
-
-        map_car_df = pd.read_excel(
-            '给翟总/财务段值转换/车型、使用性质映射表.xls', 
-            header=None, 
-            usecols=[0, 2, 4], 
-            names=['use', 'type', 'segment'],
-            dtype=str
-        )
-        map_car_df.dropna(inplace=True)
-        map_car_df['key'] = map_car_df['use'].str.strip() + '_' + map_car_df['type'].str.strip()
-        map_car_df.drop_duplicates(subset=['key'], inplace=True)
-        map_car = map_car_df.set_index('key')['segment']
-
-        mappings = {
-            'product': map_product, 'org': map_org, 'cost_center': map_cost,
-            'channel': map_channel, 'car': map_car
+        print("处理完成！")
+        print("--- 步骤 2: 分录结果报告生成完毕 ---")
+        completed = True
+    finally:
+        instr.close('ok' if completed else 'failed')
+
+def run_batch(val_months, max_workers=3, ingest='pandas', output_formats=None, default_output_format='xlsx',
+              run_report=None, profile_stages=(), trace_memory_stages=(), parallel_lines=False, target_table=None,
+              rollup=False, reconcile=False, allocation_source=None, allocation_driver=DEFAULT_DRIVER):
+    """
+    Processes several periods with one parameterized `val_month = ANY(...)` query per
+    val_method, splits the results by period in memory and generates each period's
+    report against a single loaded mapping set (and the period's allocation table).
+    """
+    val_months = [validate_val_month(val_month) for val_month in dict.fromkeys(val_months)]
+    instr = Instrumentation(run_report, profile_stages=profile_stages, trace_memory_stages=trace_memory_stages,
+                            run_info={'mode': 'batch', 'val_months': val_months, 'ingest': ingest,
+                                      'max_workers': max_workers, 'parallel_lines': parallel_lines,
+                                      'target_table': target_table, 'rollup': rollup, 'reconcile': reconcile,
+                                      'allocation_source': allocation_source})
+    completed = False
+    try:
+        print(f"--- 批量模式: {', '.join(val_months)} ---")
+
+        print("--- 步骤 1: 开始从数据库批量提取数据 ---")
+        queries = {
+            val_method: build_batch_query(val_method, spec, val_months)
+            for val_method, spec in EXTRACTION_SPECS.items()
         }
-        print("映射文件加载完成。")
+        with instr.stage('extract', val_months=val_months, ingest=ingest) as rec:
+            results, rec['query_seconds'] = extract_concurrently(queries, DB_PARAMS, max_workers=max_workers,
+                                                                 ingest=ingest)
+            _extracted_stats(rec, results)
+        if any(results[val_method] is None for val_method in queries):
+            print("错误：一个或多个数据提取步骤失败，程序终止。请检查数据库连接和查询。")
+            return
+        by_period = {val_method: split_by_period(df, val_months) for val_method, df in results.items()}
 
-    except FileNotFoundError as e:
-        print(f"错误：映射文件未找到 - {e}")
-        print("请确保所有映射文件都存在于 '给翟总/财务段值转换/' 目录下。")
-        return
-    except Exception as e:
-        print(f"加载映射文件时发生错误: {e}")
-        return
+        # 按单期查询的 SQL 保存快照，之后可以用 --replay --val-month 单独重跑某一期
+        with instr.stage('save_snapshots', val_months=val_months):
+            for val_method, spec in EXTRACTION_SPECS.items():
+                for val_month in val_months:
+                    save_snapshot(by_period[val_method][val_month], val_month, val_method,
+                                  build_period_query(val_method, spec, val_month))
+        print("--- 步骤 1: 数据库数据提取完成 ---\n")
 
-    # Process each business type
-    direct_entries = process_direct_business(df_8, filter_enabled=False)
-    assumed_entries = process_assumed_reinsurance(df_11)
-    ceded_entries = process_ceded_reinsurance(df_10)
-    
-    # Transform to final format
-    final_direct = transform_to_final_format(direct_entries, '1', mappings)
-    final_assumed = transform_to_final_format(assumed_entries, '2', mappings)
-    final_ceded = transform_to_final_format(ceded_entries, '2', mappings)
+        print("--- 步骤 2: 开始生成各期分录结果报告 ---")
+        with instr.stage('load_mappings'):
+            mappings = load_segment_mappings()
+        if mappings is None:
+            return
 
-    # Write to a single Excel file with multiple sheets
-    output_filename = '未到期分录结果.xlsx'
-    print(f"正在写入最终结果到 {output_filename}...")
-    with pd.ExcelWriter(output_filename, engine='openpyxl') as writer:
-        final_direct.to_excel(writer, sheet_name='直保', index=False)
-        final_assumed.to_excel(writer, sheet_name='分入', index=False)
-        final_ceded.to_excel(writer, sheet_name='分出', index=False)
-    
-    print("处理完成！")
-    print("--- 步骤 2: 分录结果报告生成完毕 ---")
+        for val_month in val_months:
+            print(f"--- 评估月份 {val_month} ---")
+            # 分摊参考表按期间区分，每期加载自己的参考表
+            allocation = None
+            if allocation_source:
+                with instr.stage('load_allocation', val_months=[val_month]) as rec:
+                    allocation = load_allocation(val_month, allocation_source, driver=allocation_driver)
+                    rec['rows_out'] = None if allocation is None else len(allocation)
+                if allocation is None:
+                    return
+            df_8, df_11, df_10 = (encode_dimensions(by_period[val_method][val_month])
+                                  for val_method in ('8', '11', '10'))
+            if not generate_entry_report(df_8, df_11, df_10, mappings, val_month, f'未到期分录结果_{val_month}.xlsx',
+                                         output_formats=output_formats, default_output_format=default_output_format,
+                                         instr=instr, parallel=parallel_lines, target_table=target_table,
+                                         rollup=rollup, reconcile=reconcile, allocation=allocation):
+                return
 
+        print("处理完成！")
+        print("--- 步骤 2: 各期分录结果报告生成完毕 ---")
+        completed = True
+    finally:
+        instr.close('ok' if completed else 'failed')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='未到期责任负债分录生成')
+    parser.add_argument('--max-workers', type=int, default=3, help='并发提取的最大连接数')
+    parser.add_argument('--ingest', choices=INGEST_METHODS, default='pandas', help='数据库取数方式')
+    parser.add_argument('--val-month', default=VAL_MONTH, help='评估月份（yyyyMM）')
+    parser.add_argument('--batch', nargs='+', metavar='VAL_MONTH',
+                        help='批量处理多个评估月份，如 --batch 202410 202411 202412')
+    parser.add_argument('--replay', action='store_true', help='从快照缓存回放步骤 1，不连接数据库')
+    parser.add_argument('--engine', choices=ENGINES, default='pandas',
+                        help='分录生成引擎：pandas（客户端）或 sql（在 PostgreSQL 中展开）')
+    parser.add_argument('--target-table',
+                        help='将分录以 COPY 写入该 PostgreSQL 结果表（按 account_period 原子替换），不写出文件')
+    parser.add_argument('--shards', type=int, default=1, help='直保查询按哈希拆分的分片数，分片在多个连接上并行执行')
+    parser.add_argument('--shard-key', choices=SHARD_KEYS, default='group_id', help='分片键')
+    parser.add_argument('--verify-shards', action='store_true', help='额外执行不分片查询，校验合并结果一致')
+    parser.add_argument('--no-intermediate-excel', action='store_true',
+                        help='不写出 measurement_results_*.xlsx')
+    parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='xlsx',
+                        help='最终结果的默认输出格式')
+    parser.add_argument('--sheet-format', action='append', default=[], metavar='SHEET=FORMAT',
+                        help='单个 sheet 的输出格式，如 直保=parquet，可重复指定')
+    parser.add_argument('--parallel-lines', action='store_true',
+                        help='直保、分入、分出在独立进程中并行处理（需 pyarrow）')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式模式：分块读取、展开、写出，内存峰值只取决于 --chunksize')
+    parser.add_argument('--rollup', action='store_true',
+                        help='按科目、段值、合同组合/分组汇总金额后输出，并写出 <sheet>_追溯 追溯索引（仅 pandas 引擎）')
+    parser.add_argument('--reconcile', action='store_true',
+                        help='按规则核对分录金额与源数据合计（按科目、归属机构、合同分组），并统计科目/段值空值行数')
+    parser.add_argument('--incremental', action='store_true',
+                        help='增量重跑：只重新提取和展开源数据指纹有变化的合同分组，拼接进上次的分录（状态保存在 .incremental_state）')
+    parser.add_argument('--allocate', nargs='?', const=ALLOCATION_SOURCE, metavar='XLSX',
+                        help=f'按分摊参考表把亏损部分等合同分组级金额分摊到各维度行（默认 {ALLOCATION_SOURCE}，'
+                             '{val_month} 替换为评估月份；参考表期间须与评估月份一致）')
+    parser.add_argument('--allocation-driver', default=DEFAULT_DRIVER, help='分摊动因列（参考表中的列名）')
+    parser.add_argument('--resume', action='store_true',
+                        help='从检查点续跑：输入未变化的阶段（提取快照、规则展开、转换、写出）直接复用，从第一个变化或失败的阶段开始')
+    parser.add_argument('--checkpoint', action='store_true',
+                        help='写出阶段检查点（.checkpoints），供之后 --resume 续跑；--resume 本身也会写出')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE, help='流式模式每块的聚合行数')
+    parser.add_argument('--run-report', help='各阶段耗时/行数/内存的运行报告（JSON lines，追加写入）')
+    parser.add_argument('--profile-stage', action='append', default=[], metavar='STAGE',
+                        help="对该阶段开启 cProfile（如 transform_direct，或 all），可重复指定")
+    parser.add_argument('--trace-memory-stage', action='append', default=[], metavar='STAGE',
+                        help="对该阶段开启 tracemalloc（如 process_ceded，或 all），可重复指定")
+    args = parser.parse_args(argv)
+    args.sheet_formats = {}
+    for item in args.sheet_format:
+        sheet, _, fmt = item.partition('=')
+        if fmt not in OUTPUT_FORMATS:
+            parser.error(f"--sheet-format {item}: 格式必须是 {', '.join(OUTPUT_FORMATS)} 之一")
+        args.sheet_formats[sheet] = fmt
+    for flag in ('rollup', 'reconcile', 'allocate'):
+        if getattr(args, flag) and (args.stream or args.engine == 'sql'):
+            parser.error(f"--{flag} 需要完整的分录结果，不能与 --stream 或 --engine sql 同时使用")
+    if args.incremental and (args.stream or args.engine == 'sql' or args.replay or args.batch or args.shards > 1):
+        parser.error("--incremental 只支持单期的 pandas 引擎，不能与 --stream、--engine sql、--replay、--batch 或 --shards 同时使用")
+    if (args.resume or args.checkpoint) and (args.stream or args.engine == 'sql' or args.batch or args.incremental):
+        parser.error("--checkpoint / --resume 只支持单期的 pandas 引擎，不能与 --stream、--engine sql、--batch 或 --incremental 同时使用")
+    return args
 
 if __name__ == '__main__':
-    main()
+    args = parse_args()
+    if args.batch:
+        run_batch(args.batch, max_workers=args.max_workers, ingest=args.ingest,
+                  output_formats=args.sheet_formats, default_output_format=args.output_format,
+                  run_report=args.run_report, profile_stages=args.profile_stage,
+                  trace_memory_stages=args.trace_memory_stage, parallel_lines=args.parallel_lines,
+                  target_table=args.target_table, rollup=args.rollup, reconcile=args.reconcile,
+                  allocation_source=args.allocate, allocation_driver=args.allocation_driver)
+    else:
+        main(max_workers=args.max_workers, ingest=args.ingest, replay=args.replay,
+             save_intermediate_excel=not args.no_intermediate_excel,
+             output_formats=args.sheet_formats, default_output_format=args.output_format,
+             val_month=args.val_month, shards=args.shards, shard_key=args.shard_key,
+             verify_shards=args.verify_shards, engine=args.engine, target_table=args.target_table,
+             run_report=args.run_report, profile_stages=args.profile_stage,
+             trace_memory_stages=args.trace_memory_stage, parallel_lines=args.parallel_lines,
+             stream=args.stream, chunksize=args.chunksize, rollup=args.rollup, reconcile=args.reconcile,
+             incremental=args.incremental, checkpoint=args.checkpoint, resume=args.resume,
+             allocation_source=args.allocate, allocation_driver=args.allocation_driver)
@@ -0,0 +1,180 @@
+import json
+import os
+import shutil
+import time
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from checkpoints import digest, frame_digest, mappings_digest, rules_digest
+from extraction import build_extraction_query, build_period_query, render_where_clause
+from snapshot_cache import HAS_PYARROW, query_hash
+
+# --- Incremental Recompute by Contract Group ---
+# 每次运行为每个 (val_method, group_id) 记录聚合源行的指纹：服务端对该组每个聚合行的文本取 md5 前 64 位，
+# 按组求和（numeric 精确求和，与行序无关），连同行数一起传回；客户端只收到每组一行。
+# 重跑同一 val_month 时先重新计算指纹，与上次的比较，只对新增、变化、消失的组重新提取和展开，
+# 再拼接进上次的分录（删除这些组的旧分录，追加新分录），重跑的开销取决于更正的规模而不是全部业务。
+# 提取 SQL、规则表、科目表、映射或分摊比例有任何变化，上次的状态都作废，退回全量运行。
+# 源列是浮点数时，服务端 SUM 的末位可能随聚合顺序变化，表现为组被误判为变化——只会多算，不会算错。
+
+INCREMENTAL_DIR = '.incremental_state'
+STATE_VERSION = 2
+
+# 源表的分组列、提取结果中的分组列、最终格式中的分组列
+GROUP_KEY = 'group_id'
+GROUP_COLUMN = '合同分组编号'
+FINAL_GROUP_COLUMN = 'insurance_contract_group_id'
+
+FINGERPRINT_COLUMNS = ['group_id', 'n_rows', 'fingerprint']
+
+# 变化的组超过该比例时，该 val_method 直接整体重新提取（比很长的 ANY(...) 列表更快）
+FULL_RERUN_FRACTION = 0.5
+
+def build_fingerprint_query(val_method, spec, val_month):
+    """Builds the per-group fingerprint query over one val_method's aggregated rows."""
+    return f"""
+        SELECT
+            q."{GROUP_COLUMN}" AS "group_id",
+            count(*) AS "n_rows",
+            sum(('x' || left(md5(q::text), 16))::bit(64)::bigint::numeric)::text AS "fingerprint"
+        FROM ({build_period_query(val_method, spec, val_month)}) AS q
+        GROUP BY 1
+        """
+
+def build_group_query(val_method, spec, val_month, group_ids):
+    """
+    Builds the period query restricted to `group_ids` (a NaN/None entry selects the
+    NULL group). Returns (query, params) for psycopg2.
+    """
+    keys = [group_id for group_id in group_ids if not pd.isna(group_id)]
+    predicate = f'"{GROUP_KEY}" = ANY(%(group_ids)s)'
+    if len(keys) < len(group_ids):
+        predicate = f'({predicate} OR "{GROUP_KEY}" IS NULL)'
+    where_clause = f"{render_where_clause(spec['additional_where_clause'], val_month)} AND {predicate}"
+    query = build_extraction_query(val_method, spec['sql_query'], spec['group_by_columns'], spec['table_name'],
+                                   where_clause, val_month=val_month)
+    return query, {'group_ids': keys}
+
+def config_key(queries, mappings, allocation=None):
+    """
+    Hashes everything besides the source rows that determines the entries: the
+    extraction SQL, the rule tables, the chart of accounts, the segment mappings and
+    the allocation ratios, if any.
+    """
+    query_keys = [f"{val_method}:{query_hash(queries[val_method])}" for val_method in sorted(queries)]
+    allocation_key = frame_digest(allocation) if allocation is not None else None
+    return digest(STATE_VERSION, *query_keys, rules_digest(), mappings_digest(mappings), allocation_key)
+
+def changed_groups(previous, current):
+    """
+    Returns the group ids whose row count or fingerprint differ between two
+    fingerprint frames, including groups that appear in only one of them.
+    """
+    merged = previous.merge(current, on='group_id', how='outer', suffixes=('_prev', ''), indicator=True)
+    changed = ((merged['_merge'] != 'both')
+               | (merged['n_rows_prev'] != merged['n_rows'])
+               | (merged['fingerprint_prev'] != merged['fingerprint']))
+    return merged.loc[changed, 'group_id'].tolist()
+
+# --- Splicing ---
+
+def concat_entries(frames):
+    """Concatenates final-format frames, keeping categorical columns categorical."""
+    frames = [df for df in frames if df is not None]
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for col in frames[0].columns:
+        values = [df[col] for df in frames]
+        if all(isinstance(v.dtype, pd.CategoricalDtype) for v in values):
+            arrays = [v.array for v in values]
+            if len({a.categories.dtype for a in arrays}) > 1:
+                # 从 parquet 读回的类别可能是 str，新算出的是 object；统一为 object 再合并
+                arrays = [pd.Categorical.from_codes(a.codes, categories=pd.Index(a.categories, dtype=object))
+                          for a in arrays]
+            columns[col] = union_categoricals(arrays)
+        else:
+            columns[col] = pd.concat(values, ignore_index=True)
+    return pd.DataFrame(columns, columns=frames[0].columns)
+
+def splice_entries(previous, recomputed, group_ids):
+    """
+    Drops the entries of `group_ids` from `previous` and appends `recomputed`.
+    sj_id is content-derived, so the kept entries keep their IDs.
+    """
+    kept = previous[~previous[FINAL_GROUP_COLUMN].isin(group_ids).to_numpy()]
+    return concat_entries([kept, recomputed])
+
+# --- State Files ---
+
+def state_dir(val_month, state_root=INCREMENTAL_DIR):
+    return os.path.join(state_root, str(val_month))
+
+def load_state(val_month, key, state_root=INCREMENTAL_DIR):
+    """
+    Loads the previous run's fingerprints ({val_method: frame}) and final entries
+    ({line: frame}) for `val_month`, or returns None if there is no usable state.
+    """
+    if not HAS_PYARROW:
+        print("警告：未安装 pyarrow，无法读取增量状态，将全量运行。")
+        return None
+    path = state_dir(val_month, state_root)
+    manifest_path = os.path.join(path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        print(f"未找到 val_month = '{val_month}' 的增量状态，将全量运行。")
+        return None
+    try:
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != STATE_VERSION or manifest.get('config_key') != key:
+            print("提取 SQL、规则或映射已变化，上次的增量状态作废，将全量运行。")
+            return None
+        fingerprints = {val_method: pd.read_parquet(os.path.join(path, f'fingerprints_{val_method}.parquet'))
+                        for val_method in manifest['val_methods']}
+        finals = {line: pd.read_parquet(os.path.join(path, f'entries_{line}.parquet'))
+                  for line in manifest['lines']}
+    except Exception as e:
+        print(f"读取增量状态 {path} 时出错，将全量运行: {e}")
+        return None
+    print(f"已加载 {manifest['created_at']} 的增量状态: {path}")
+    return fingerprints, finals
+
+def save_state(val_month, key, fingerprints, finals, state_root=INCREMENTAL_DIR):
+    """
+    Stores this run's fingerprints and (pre-roll-up) final entries for the next
+    incremental run. The directory is written aside and swapped in whole.
+    Returns the state directory, or None if nothing was written.
+    """
+    if not HAS_PYARROW:
+        print("警告：未安装 pyarrow，跳过增量状态写入。")
+        return None
+    path = state_dir(val_month, state_root)
+    tmp_path, old_path = path + '.tmp', path + '.old'
+    try:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for val_method, df in fingerprints.items():
+            df.to_parquet(os.path.join(tmp_path, f'fingerprints_{val_method}.parquet'), index=False)
+        for line, df in finals.items():
+            df.to_parquet(os.path.join(tmp_path, f'entries_{line}.parquet'), index=False)
+        manifest = {
+            'version': STATE_VERSION, 'config_key': key, 'val_month': val_month,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'val_methods': list(fingerprints), 'lines': list(finals),
+            'groups': {val_method: len(df) for val_method, df in fingerprints.items()},
+            'rows': {line: len(df) for line, df in finals.items()},
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, old_path)
+        os.rename(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+    except Exception as e:
+        print(f"写入增量状态 {path} 时出错: {e}")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return None
+    print(f"增量状态已保存: {path}")
+    return path
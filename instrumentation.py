@@ -0,0 +1,188 @@
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# --- Run Instrumentation ---
+# 每个阶段记录一条：墙钟/CPU 时间、输入输出行数、字节数、峰值内存（RSS），
+# 以 JSON lines 写入运行报告（每条记录写完即 flush，中途失败也保留已完成的阶段）。
+# 可对指定阶段开启 cProfile（输出 .prof）或 tracemalloc（记录 Python 分配峰值和前几处分配）。
+
+ALL_STAGES = 'all'
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+def current_rss():
+    """Resident set size in bytes (Linux /proc; elsewhere the process-lifetime peak)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class PeakRSSSampler:
+    """Samples RSS on a background thread; `peak` is the maximum seen while active."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+def frame_bytes(df):
+    """In-memory size of a DataFrame, or 0 for None."""
+    if df is None:
+        return 0
+    return int(df.memory_usage(index=False, deep=True).sum())
+
+def _mb(n_bytes):
+    return round(n_bytes / 1024 / 1024, 3)
+
+class Instrumentation:
+    """
+    Collects per-stage metrics for one run and optionally writes them as JSON lines.
+
+    Usage:
+        instr = Instrumentation('run_report.jsonl', profile_stages=['transform_direct'])
+        with instr.stage('process_direct', rows_in=len(df)) as rec:
+            entries = process_direct_business(df)
+            rec['rows_out'] = len(entries)
+        instr.close()
+
+    Args:
+        report_path: JSON lines 报告路径，None 时只在内存中保留记录
+        profile_stages: 开启 cProfile 的阶段名（或 'all'），.prof 写在报告旁边
+        trace_memory_stages: 开启 tracemalloc 的阶段名（或 'all'）
+        run_info: 写入报告首行的运行参数
+    """
+
+    def __init__(self, report_path=None, profile_stages=(), trace_memory_stages=(), run_info=None):
+        self.report_path = report_path
+        self.profile_stages = set(profile_stages or ())
+        self.trace_memory_stages = set(trace_memory_stages or ())
+        self.run_id = uuid.uuid4().hex[:12]
+        self.records = []
+        self._start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        self._file = None
+        if report_path:
+            os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+            self._file = open(report_path, 'a', encoding='utf-8')
+        self._emit({'type': 'run', 'run_id': self.run_id, 'started_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'pid': os.getpid(), 'run_info': run_info or {}})
+
+    def _emit(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+            self._file.flush()
+
+    def _enabled(self, stages, name):
+        return ALL_STAGES in stages or name in stages
+
+    def _profile_path(self, name):
+        base = os.path.splitext(self.report_path or 'run_report')[0]
+        return f"{base}_{self.run_id}_{name}.prof"
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **fields):
+        """
+        Measures one stage. The yielded record can be updated by the caller, typically
+        with 'rows_out' and 'bytes'; any extra keyword fields are stored as-is.
+        """
+        record = {'type': 'stage', 'run_id': self.run_id, 'stage': name, **fields,
+                  'rows_in': rows_in, 'rows_out': None, 'bytes': None}
+        profiler = cProfile.Profile() if self._enabled(self.profile_stages, name) else None
+        trace = self._enabled(self.trace_memory_stages, name) and not tracemalloc.is_tracing()
+        if trace:
+            tracemalloc.start()
+        rss = PeakRSSSampler()
+        rss_before = current_rss()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            with rss:
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    yield record
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+            record['status'] = 'ok'
+        except BaseException as e:
+            record['status'] = 'error'
+            record['error'] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record['wall_seconds'] = round(time.perf_counter() - wall_start, 6)
+            record['cpu_seconds'] = round(time.process_time() - cpu_start, 6)
+            record['peak_rss_mb'] = _mb(rss.peak)
+            record['rss_delta_mb'] = _mb(current_rss() - rss_before)
+            if profiler is not None:
+                record['profile_path'] = self._profile_path(name)
+                profiler.dump_stats(record['profile_path'])
+            if trace:
+                _, peak = tracemalloc.get_traced_memory()
+                top = tracemalloc.take_snapshot().statistics('lineno')[:5]
+                tracemalloc.stop()
+                record['tracemalloc_peak_mb'] = _mb(peak)
+                record['tracemalloc_top'] = [f"{stat.traceback[0]}: {_mb(stat.size)} MB" for stat in top]
+            self.records.append(record)
+            self._emit(record)
+
+    def merge(self, records, **fields):
+        """Adds stage records measured elsewhere (e.g. in a worker process) to this run."""
+        for record in records:
+            record = {**record, 'run_id': self.run_id, **fields}
+            self.records.append(record)
+            self._emit(record)
+
+    def close(self, status='ok'):
+        """Writes the closing run record and prints the stage summary."""
+        self._emit({'type': 'run_end', 'run_id': self.run_id, 'status': status,
+                    'wall_seconds': round(time.perf_counter() - self._start, 6),
+                    'cpu_seconds': round(time.process_time() - self._cpu_start, 6),
+                    'peak_rss_mb': max((r['peak_rss_mb'] or 0 for r in self.records), default=0)})
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print_stage_summary(self.records)
+        if self.report_path:
+            print(f"运行报告已写入 {self.report_path} (run_id = {self.run_id})")
+
+def print_stage_summary(records):
+    """Prints one line per stage: wall/CPU seconds, rows and peak memory."""
+    if not records:
+        return
+    print("各阶段统计：")
+    for r in records:
+        rows = ''
+        if r['rows_in'] is not None or r['rows_out'] is not None:
+            rows = f", 行数 {r['rows_in'] if r['rows_in'] is not None else '-'} -> " \
+                   f"{r['rows_out'] if r['rows_out'] is not None else '-'}"
+        size = f", {r['bytes'] / 1024 / 1024:.2f} MB" if r['bytes'] else ''
+        print(f"  [{r['stage']}] 墙钟 {r['wall_seconds']:.2f} 秒, CPU {r['cpu_seconds']:.2f} 秒{rows}{size}, "
+              f"峰值内存 {r['peak_rss_mb']:.0f} MB{'' if r['status'] == 'ok' else ' (失败)'}")
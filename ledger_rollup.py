@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+
+from amounts import FEN_COLUMNS
+from entry_ids import content_ids
+
+# --- Ledger-granularity Roll-up ---
+# 最终分录每个（源维度组合 × 规则）一行，但很多行的科目、各段值、组合/分组编号完全相同。
+# 汇总阶段按除 sj_id 和金额以外的全部列（借贷方向、科目、段值、合同组合/分组、币种等）分组，
+# 对三个金额列（以分存储，求和是精确的整数运算）求和。分组在编码后的键上做哈希聚合：
+# 每列取 categorical 编码（或 factorize），按混合进制合成一个 int64 键，再 factorize 成组号，
+# 按组排序后分段求和。
+# 同时输出追溯索引：每个汇总行的 sj_id -> 参与汇总的原分录 sj_id（原 sj_id 唯一确定规则和源行）。
+
+def _column_codes(values):
+    """Returns (non-negative integer codes, number of distinct codes) for one key column."""
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        # 缺失值的编码是 -1，整体加 1
+        return values.cat.codes.to_numpy().astype('int64') + 1, len(values.cat.categories) + 1
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes.astype('int64'), max(len(uniques), 1)
+
+def group_codes(df, columns):
+    """
+    Hash-groups `df` on `columns`. Returns (group id per row, number of groups); group
+    ids follow the order in which each key first appears.
+    """
+    key = np.zeros(len(df), dtype='int64')
+    cardinality = 1
+    for col in columns:
+        codes, n = _column_codes(df[col])
+        if cardinality * n >= 2 ** 62:
+            # 合成键将溢出时先压缩为已出现的组合编号
+            key, uniques = pd.factorize(key)
+            cardinality = max(len(uniques), 1)
+        key = key * n + codes
+        cardinality *= n
+    groups, uniques = pd.factorize(key)
+    return groups, len(uniques)
+
+def rollup_entries(final_df):
+    """
+    Sums the amount columns of final-format entries over all other columns.
+
+    Args:
+        final_df: transform_to_final_format 的输出
+
+    Returns:
+        (ledger_df, drill_back)：ledger_df 与输入列相同、每个分组一行（按首次出现的顺序）；
+        drill_back 两列 ledger_sj_id、sj_id，按汇总行排列
+    """
+    key_columns = [col for col in final_df.columns if col != 'sj_id' and col not in FEN_COLUMNS]
+    groups, n_groups = group_codes(final_df, key_columns)
+    order = np.argsort(groups, kind='stable')
+    # 组号按首次出现的顺序编号，排序后每组的起点就是该组首次出现的行
+    starts = np.flatnonzero(np.r_[True, np.diff(groups[order]) != 0]) if n_groups else np.empty(0, dtype='intp')
+
+    ledger_df = final_df.iloc[order[starts]].reset_index(drop=True)
+    for col in FEN_COLUMNS:
+        values = final_df[col].to_numpy()[order]
+        ledger_df[col] = np.add.reduceat(values, starts) if n_groups else values
+    # 汇总行的 sj_id 是其全部键列的内容哈希
+    ledger_ids = content_ids([ledger_df[col] for col in key_columns]).astype(object)
+    ledger_df['sj_id'] = ledger_ids
+
+    drill_back = pd.DataFrame({
+        'ledger_sj_id': pd.Categorical.from_codes(groups[order], categories=ledger_ids),
+        'sj_id': final_df['sj_id'].to_numpy()[order],
+    })
+    return ledger_df, drill_back
@@ -0,0 +1,169 @@
+import hashlib
+import io
+import os
+import pickle
+
+import pandas as pd
+
+# --- Mapping Source Files ---
+MAPPING_DIR = '给翟总/财务段值转换'
+
+MAPPING_SOURCES = {
+    'product': os.path.join(MAPPING_DIR, '产品管理导出列表.xls'),
+    'org_cost': os.path.join(MAPPING_DIR, '机构&成本中心.xlsx'),
+    'channel': os.path.join(MAPPING_DIR, '渠道管理导出列表.xls'),
+    'car': os.path.join(MAPPING_DIR, '车型、使用性质映射表.xls'),
+}
+
+# 编译后的映射产物，源文件的 mtime/大小/哈希变化时自动重建
+COMPILED_MAPPINGS_PATH = os.path.join('.mapping_cache', 'mappings.pkl')
+
+ARTIFACT_VERSION = 1
+
+# 上传到数据库会话中的临时映射表（key, segment）
+SEGMENT_TABLES = {
+    'product': 'seg_product', 'org': 'seg_org', 'cost_center': 'seg_cost_center',
+    'channel': 'seg_channel', 'car': 'seg_car',
+}
+
+# --- Parsing ---
+
+def _read_code_segment(path, usecols):
+    df = pd.read_excel(path, header=None, usecols=usecols, names=['code', 'segment'], dtype=str)
+    df.dropna(inplace=True)
+    df.drop_duplicates(subset=['code'], inplace=True)
+    return df.set_index('code')['segment']
+
+def parse_mapping_sources(sources=MAPPING_SOURCES):
+    """
+    Parses the legacy mapping spreadsheets into the five segment lookup Series.
+    """
+    map_product = _read_code_segment(sources['product'], [0, 2])
+
+    map_org_cost = pd.read_excel(
+        sources['org_cost'],
+        header=None,
+        usecols=[0, 3, 4],
+        names=['code', 'org', 'cost'],
+        dtype=str
+    )
+    map_org_cost.dropna(inplace=True)
+    map_org_cost.drop_duplicates(subset=['code'], inplace=True)
+    map_org = map_org_cost.set_index('code')['org']
+    map_cost = map_org_cost.set_index('code')['cost']
+
+    map_channel = _read_code_segment(sources['channel'], [0, 2])
+
+    map_car_df = pd.read_excel(
+        sources['car'],
+        header=None,
+        usecols=[0, 2, 4],
+        names=['use', 'type', 'segment'],
+        dtype=str
+    )
+    map_car_df.dropna(inplace=True)
+    map_car_df['key'] = map_car_df['use'].str.strip() + '_' + map_car_df['type'].str.strip()
+    map_car_df.drop_duplicates(subset=['key'], inplace=True)
+    map_car = map_car_df.set_index('key')['segment']
+
+    return {
+        'product': map_product, 'org': map_org, 'cost_center': map_cost,
+        'channel': map_channel, 'car': map_car
+    }
+
+# --- Compiled Artifact ---
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _source_fingerprint(path, with_hash=True):
+    st = os.stat(path)
+    fp = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if with_hash:
+        fp['sha256'] = _file_sha256(path)
+    return fp
+
+def _is_fresh(manifest, sources):
+    """
+    Checks each source against the manifest: a matching size and mtime is trusted,
+    otherwise the content hash decides (a touched but unchanged file stays fresh).
+    """
+    if set(manifest) != set(sources):
+        return False
+    for name, path in sources.items():
+        recorded = manifest[name]
+        if recorded.get('path') != path:
+            return False
+        current = _source_fingerprint(path, with_hash=False)
+        if current['size'] != recorded['size']:
+            return False
+        if current['mtime_ns'] != recorded['mtime_ns'] and _file_sha256(path) != recorded['sha256']:
+            return False
+    return True
+
+def _pack(mappings):
+    # 只存键和值两个字符串数组，重载时直接重建 Series
+    return {name: (series.index.to_numpy(dtype=object), series.to_numpy(dtype=object))
+            for name, series in mappings.items()}
+
+def _unpack(packed):
+    return {name: pd.Series(values, index=keys, dtype=object) for name, (keys, values) in packed.items()}
+
+def compile_mappings(sources=MAPPING_SOURCES, artifact_path=COMPILED_MAPPINGS_PATH):
+    """Parses the source spreadsheets and writes the compiled lookup artifact."""
+    mappings = parse_mapping_sources(sources)
+    manifest = {name: {'path': path, **_source_fingerprint(path)} for name, path in sources.items()}
+    os.makedirs(os.path.dirname(artifact_path) or '.', exist_ok=True)
+    tmp_path = artifact_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump({'version': ARTIFACT_VERSION, 'manifest': manifest, 'mappings': _pack(mappings)},
+                    f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, artifact_path)
+    return mappings
+
+def load_mappings(sources=MAPPING_SOURCES, artifact_path=COMPILED_MAPPINGS_PATH, force_rebuild=False):
+    """
+    Returns the segment mappings, reusing the compiled artifact while every source
+    file is unchanged and rebuilding it otherwise.
+    Raises FileNotFoundError if a source file is missing.
+    """
+    for path in sources.values():
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+
+    if not force_rebuild and os.path.exists(artifact_path):
+        try:
+            with open(artifact_path, 'rb') as f:
+                artifact = pickle.load(f)
+            if artifact.get('version') == ARTIFACT_VERSION and _is_fresh(artifact['manifest'], sources):
+                print(f"已从编译缓存加载映射: {artifact_path}")
+                return _unpack(artifact['mappings'])
+            print("映射源文件已变化，正在重新编译映射...")
+        except Exception as e:
+            print(f"读取映射编译缓存失败，将重新编译: {e}")
+
+    mappings = compile_mappings(sources, artifact_path)
+    print(f"映射已编译并缓存到 {artifact_path}")
+    return mappings
+
+# --- Database Upload ---
+
+def copy_mappings_to_temp_tables(conn, mappings):
+    """
+    Uploads the compiled mapping keys into session temp tables (see SEGMENT_TABLES)
+    with COPY FROM STDIN, so joins against them can run server-side.
+    """
+    with conn.cursor() as cur:
+        for name, table in SEGMENT_TABLES.items():
+            cur.execute(f'DROP TABLE IF EXISTS pg_temp."{table}"')
+            cur.execute(f'CREATE TEMP TABLE "{table}" ("key" text PRIMARY KEY, "segment" text)')
+            buf = io.StringIO()
+            mappings[name].to_csv(buf, header=False, na_rep='\\N')
+            buf.seek(0)
+            cur.copy_expert(f'COPY "{table}" ("key", "segment") FROM STDIN WITH (FORMAT csv, NULL \'\\N\')', buf)
+            cur.execute(f'ANALYZE "{table}"')
+    print(f"映射表已上传到临时表: {', '.join(SEGMENT_TABLES.values())}")
@@ -0,0 +1,213 @@
+import gzip
+import os
+import time
+
+from openpyxl import Workbook
+
+from amounts import with_yuan_amounts
+
+# --- Output Writers ---
+# 每个 sheet 可单独选择输出格式：
+#   'xlsx'   - openpyxl write-only 模式逐行流式写入，不构建完整的单元格对象模型
+#   'csv'    - UTF-8（带 BOM，Excel 可直接打开中文）
+#   'csv.gz' - gzip 压缩的 CSV
+#   'parquet'- 列式格式（需 pyarrow）
+# 以分存储的金额列（amounts.FEN_COLUMNS）在写出时换算为元。
+OUTPUT_FORMATS = ('xlsx', 'csv', 'csv.gz', 'parquet')
+
+XLSX_ROW_BATCH = 50000
+
+def _excel_rows(df, batch_size=XLSX_ROW_BATCH):
+    """Yields rows as lists of plain Python values, with missing values as empty cells."""
+    for start in range(0, len(df), batch_size):
+        part = df.iloc[start:start + batch_size]
+        values = part.astype(object).where(part.notna(), None).to_numpy()
+        yield from values.tolist()
+
+def _write_xlsx(sheets, path):
+    """Writes several sheets into one workbook using openpyxl's write-only mode."""
+    wb = Workbook(write_only=True)
+    for sheet_name, df in sheets.items():
+        ws = wb.create_sheet(title=sheet_name)
+        ws.append(list(df.columns))
+        for row in _excel_rows(df):
+            ws.append(row)
+    wb.save(path)
+
+def _write_csv(df, path, compression=None):
+    df.to_csv(path, index=False, encoding='utf-8-sig', compression=compression)
+
+def _write_parquet(df, path):
+    df.to_parquet(path, index=False)
+
+def output_path_for(base_path, sheet_name, fmt):
+    """Returns the output path for a sheet; xlsx sheets share the base workbook."""
+    if fmt == 'xlsx':
+        return base_path
+    stem = os.path.splitext(base_path)[0]
+    return f"{stem}_{sheet_name}.{fmt}"
+
+def _record(stats, sheet_names, fmt, path, rows, seconds):
+    size = os.path.getsize(path)
+    seconds = max(seconds, 1e-9)
+    stats.append({
+        'sheets': sheet_names, 'format': fmt, 'path': path, 'rows': rows, 'bytes': size,
+        'seconds': seconds, 'rows_per_sec': rows / seconds, 'bytes_per_sec': size / seconds,
+    })
+
+def write_sheets(sheets, base_path, formats=None, default_format='xlsx'):
+    """
+    Writes each sheet in its selected format and reports throughput per writer.
+
+    Args:
+        sheets: dict，sheet 名 -> DataFrame（列顺序原样保留）
+        base_path: 输出文件路径，xlsx 格式的 sheet 写入该工作簿，其他格式写为 <stem>_<sheet>.<ext>
+        formats: dict，sheet 名 -> 输出格式；未指定的 sheet 使用 default_format
+
+    Returns:
+        每个写出文件一条统计记录（行数、字节数、耗时、rows/s、bytes/s）
+    """
+    formats = formats or {}
+    chosen = {name: formats.get(name, default_format) for name in sheets}
+    unknown = {fmt for fmt in chosen.values() if fmt not in OUTPUT_FORMATS}
+    if unknown:
+        raise ValueError(f"未知的输出格式: {', '.join(sorted(unknown))}，可选: {', '.join(OUTPUT_FORMATS)}")
+
+    sheets = {name: with_yuan_amounts(df) for name, df in sheets.items()}
+    stats = []
+    xlsx_sheets = {name: df for name, df in sheets.items() if chosen[name] == 'xlsx'}
+    if xlsx_sheets:
+        start = time.perf_counter()
+        _write_xlsx(xlsx_sheets, base_path)
+        _record(stats, list(xlsx_sheets), 'xlsx', base_path,
+                sum(len(df) for df in xlsx_sheets.values()), time.perf_counter() - start)
+
+    for name, df in sheets.items():
+        fmt = chosen[name]
+        if fmt == 'xlsx':
+            continue
+        path = output_path_for(base_path, name, fmt)
+        start = time.perf_counter()
+        if fmt == 'parquet':
+            _write_parquet(df, path)
+        else:
+            _write_csv(df, path, compression='gzip' if fmt == 'csv.gz' else None)
+        _record(stats, [name], fmt, path, len(df), time.perf_counter() - start)
+
+    return stats
+
+def print_writer_report(stats):
+    """Prints throughput for each written file."""
+    for s in stats:
+        print(f"  {s['path']} [{s['format']}] ({', '.join(s['sheets'])}): {s['rows']} 行, "
+              f"{s['bytes'] / 1024 / 1024:.2f} MB, {s['seconds']:.2f} 秒, "
+              f"{s['rows_per_sec']:,.0f} rows/s, {s['bytes_per_sec'] / 1024 / 1024:.2f} MB/s")
+
+# --- Streaming Output ---
+
+def _stream_schema(df):
+    """
+    Parquet schema of a streamed sheet from its first chunk. Categorical columns are
+    int32-indexed string dictionaries and object columns strings whatever the chunk holds,
+    so a column that is all-null in the first chunk does not fix a null/double type.
+    """
+    import pyarrow as pa
+
+    # 各块的字典（categorical）大小不同，统一用 int32 索引保证 schema 一致；
+    # 首块全为空值的列推断出的类型（null、double 字典）与后续块不兼容，按列的 dtype 指定为字符串
+    schema = pa.Schema.from_pandas(df, preserve_index=False)
+    for i, field in enumerate(schema):
+        dtype = df[field.name].dtype
+        if dtype.name == 'category':
+            schema = schema.set(i, field.with_type(pa.dictionary(pa.int32(), pa.string())))
+        elif dtype == object:
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+class StreamingSheetWriter:
+    """
+    Appends DataFrame chunks to sheets so a sheet never has to be held in memory whole.
+
+    Each sheet's chunks must be appended consecutively (xlsx sheets are written one
+    after another into one workbook). The files are identical in content to
+    write_sheets on the concatenated frames.
+    """
+
+    def __init__(self, base_path, formats=None, default_format='xlsx'):
+        self.base_path = base_path
+        self.formats = formats or {}
+        self.default_format = default_format
+        self._workbook = None
+        self._open = {}      # sheet 名 -> (格式, 句柄)
+        self._rows = {}
+        self._seconds = {}
+
+    def _format(self, sheet_name):
+        fmt = self.formats.get(sheet_name, self.default_format)
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"未知的输出格式: {fmt}，可选: {', '.join(OUTPUT_FORMATS)}")
+        return fmt
+
+    def _start_sheet(self, sheet_name, df):
+        fmt = self._format(sheet_name)
+        path = output_path_for(self.base_path, sheet_name, fmt)
+        if fmt == 'xlsx':
+            if self._workbook is None:
+                self._workbook = Workbook(write_only=True)
+            handle = self._workbook.create_sheet(title=sheet_name)
+            handle.append(list(df.columns))
+        elif fmt == 'parquet':
+            import pyarrow.parquet as pq
+
+            schema = _stream_schema(df)
+            handle = (pq.ParquetWriter(path, schema), schema)
+        else:
+            opener = gzip.open if fmt == 'csv.gz' else open
+            handle = opener(path, 'wt', encoding='utf-8-sig', newline='')
+            df.iloc[0:0].to_csv(handle, index=False)
+        self._open[sheet_name] = (fmt, handle)
+        self._rows[sheet_name] = 0
+        self._seconds[sheet_name] = 0.0
+
+    def append(self, sheet_name, df):
+        """Appends one chunk; the first chunk of a sheet also writes its header."""
+        start = time.perf_counter()
+        df = with_yuan_amounts(df)
+        if sheet_name not in self._open:
+            self._start_sheet(sheet_name, df)
+        fmt, handle = self._open[sheet_name]
+        if fmt == 'xlsx':
+            for row in _excel_rows(df):
+                handle.append(row)
+        elif fmt == 'parquet':
+            import pyarrow as pa
+
+            writer, schema = handle
+            if len(df):
+                writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+        else:
+            df.to_csv(handle, index=False, header=False)
+        self._rows[sheet_name] += len(df)
+        self._seconds[sheet_name] += time.perf_counter() - start
+
+    def close(self):
+        """Finishes every file and returns the same statistics as write_sheets."""
+        stats = []
+        xlsx_sheets = [name for name, (fmt, _) in self._open.items() if fmt == 'xlsx']
+        if self._workbook is not None:
+            start = time.perf_counter()
+            self._workbook.save(self.base_path)
+            seconds = time.perf_counter() - start + sum(self._seconds[name] for name in xlsx_sheets)
+            _record(stats, xlsx_sheets, 'xlsx', self.base_path, sum(self._rows[name] for name in xlsx_sheets), seconds)
+        for name, (fmt, handle) in self._open.items():
+            if fmt == 'xlsx':
+                continue
+            start = time.perf_counter()
+            if fmt == 'parquet':
+                handle[0].close()
+            else:
+                handle.close()
+            _record(stats, [name], fmt, output_path_for(self.base_path, name, fmt), self._rows[name],
+                    self._seconds[name] + time.perf_counter() - start)
+        self._open, self._workbook = {}, None
+        return stats
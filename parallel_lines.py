@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import Instrumentation
+from output_writers import write_sheets
+from snapshot_cache import HAS_PYARROW
+
+# --- Process-pool Execution of Business Lines ---
+# 直保、分入、分出三条线互不依赖，各自的 process -> transform -> 序列化在独立进程中执行。
+# 进出进程的 DataFrame 以 Arrow IPC 文件交接，放在共享内存（/dev/shm）中并以内存映射读取，
+# 不经过 pickle；字典编码的列以 Arrow dictionary 传递，取回后仍是 categorical。
+# 非 xlsx 格式的 sheet 由工作进程直接写出；xlsx 的 sheet 共用一个工作簿，由主进程统一写入。
+
+SHARED_MEMORY_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def write_arrow_ipc(df, path):
+    """Writes a DataFrame as an Arrow IPC file."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def read_arrow_ipc(path):
+    """Memory-maps an Arrow IPC file and returns it as a DataFrame."""
+    import pyarrow as pa
+
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.to_pandas()
+
+def _run_line(line, source_path, result_path, process, transform, insurance_type, mappings, val_month,
+              sheet_name, output_filename, output_format, reconcile=None):
+    """
+    Worker: process -> transform -> serialize for one business line, reconciling the
+    entries against the source first when `reconcile` (reconciliation.reconcile_line) is given.
+    Returns (result path or None, writer stats, stage records, reconciliation result or None).
+    """
+    instr = Instrumentation()
+    with instr.stage(f'read_input_{line}') as rec:
+        df = read_arrow_ipc(source_path)
+        rec['rows_out'] = len(df)
+    with instr.stage(f'process_{line}', rows_in=len(df)) as rec:
+        entries = process(df)
+        rec['rows_out'] = len(entries)
+    if reconcile is None:
+        df = None  # 对账时才需要保留源数据
+    with instr.stage(f'transform_{line}', rows_in=len(entries)) as rec:
+        final = transform(entries, insurance_type, mappings, account_period=val_month)
+        rec['rows_out'] = len(final)
+    reconciled = None
+    if reconcile is not None:
+        with instr.stage(f'reconcile_{line}', rows_in=len(entries)) as rec:
+            reconciled = reconcile(df, entries, final, line)
+            rec['mismatched'] = len(reconciled[0])
+    del df, entries
+
+    if output_format == 'xlsx':
+        with instr.stage(f'serialize_{line}', rows_in=len(final)) as rec:
+            write_arrow_ipc(final, result_path)
+            rec['bytes'] = os.path.getsize(result_path)
+        return result_path, [], instr.records, reconciled
+
+    with instr.stage(f'write_{line}', rows_in=len(final)) as rec:
+        stats = write_sheets({sheet_name: final}, output_filename, formats={sheet_name: output_format})
+        rec['rows_out'] = sum(s['rows'] for s in stats)
+        rec['bytes'] = sum(s['bytes'] for s in stats)
+    return None, stats, instr.records, reconciled
+
+def run_lines_in_processes(jobs, transform, mappings, val_month, output_filename, output_formats=None,
+                           default_output_format='xlsx', max_workers=None, instr=None, reconcile=None):
+    """
+    Runs each business line's chain in its own worker process.
+
+    Args:
+        jobs: dict，业务线 -> (源 DataFrame, process 函数, insurance_type, sheet 名)
+        transform: transform_to_final_format
+        reconcile: 对账函数（reconciliation.reconcile_line），None 表示不对账
+        其余参数同 generate_entry_report
+
+    Returns:
+        (xlsx_sheets, stats, reconciled)：需写入 xlsx 工作簿的 sheet 名 -> 最终 DataFrame，
+        工作进程的写出统计，以及业务线 -> 对账结果
+    """
+    if not HAS_PYARROW:
+        raise RuntimeError("并行执行需要 pyarrow 进行 Arrow IPC 交接")
+    output_formats = output_formats or {}
+    instr = instr or Instrumentation()
+    work_dir = tempfile.mkdtemp(prefix='entry_lines_', dir=SHARED_MEMORY_DIR)
+    try:
+        with instr.stage('handoff_inputs') as rec:
+            for line, (df, _, _, _) in jobs.items():
+                write_arrow_ipc(df, os.path.join(work_dir, f'{line}_source.arrow'))
+            rec['rows_out'] = sum(len(df) for df, _, _, _ in jobs.values())
+            rec['bytes'] = sum(os.path.getsize(os.path.join(work_dir, f'{line}_source.arrow')) for line in jobs)
+
+        # spawn：子进程不继承主进程的线程（内存采样线程）和连接等状态
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers or len(jobs), mp_context=context) as executor:
+            futures = {
+                line: executor.submit(
+                    _run_line, line, os.path.join(work_dir, f'{line}_source.arrow'),
+                    os.path.join(work_dir, f'{line}_final.arrow'), process, transform, insurance_type,
+                    mappings, val_month, sheet_name, output_filename,
+                    output_formats.get(sheet_name, default_output_format), reconcile,
+                )
+                for line, (_, process, insurance_type, sheet_name) in jobs.items()
+            }
+            outcomes = {line: future.result() for line, future in futures.items()}
+
+        xlsx_sheets, stats, reconciled = {}, [], {}
+        for line, (result_path, line_stats, records, line_reconciled) in outcomes.items():
+            instr.merge(records, worker=line)
+            stats.extend(line_stats)
+            if line_reconciled is not None:
+                reconciled[line] = line_reconciled
+            if result_path is not None:
+                with instr.stage(f'handoff_result_{line}') as rec:
+                    xlsx_sheets[jobs[line][3]] = read_arrow_ipc(result_path)
+                    rec['rows_out'] = len(xlsx_sheets[jobs[line][3]])
+        return xlsx_sheets, stats, reconciled
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,30 @@
+import calendar
+
+# --- Accounting Period Parameters ---
+
+def validate_val_month(val_month):
+    """Raises ValueError unless val_month is a yyyyMM string."""
+    if not (isinstance(val_month, str) and len(val_month) == 6 and val_month.isdigit()
+            and 1 <= int(val_month[4:]) <= 12):
+        raise ValueError(f"评估月份格式应为 yyyyMM: {val_month!r}")
+    return val_month
+
+def period_params(val_month):
+    """
+    Derives the period-dependent values that used to be hard-coded for 202412.
+
+    Returns:
+        dict：val_month、月末日期 cutoff_iso（yyyy-mm-dd，直保表格式）、
+        cutoff_compact（yyyymmdd，再保表格式）、签单年 sign_year、下一月 next_month（yyyyMM）
+    """
+    validate_val_month(val_month)
+    year, month = int(val_month[:4]), int(val_month[4:])
+    last_day = calendar.monthrange(year, month)[1]
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return {
+        'val_month': val_month,
+        'cutoff_iso': f"{year:04d}-{month:02d}-{last_day:02d}",
+        'cutoff_compact': f"{year:04d}{month:02d}{last_day:02d}",
+        'sign_year': f"{year:04d}",
+        'next_month': f"{next_year:04d}{next_month:02d}",
+    }
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+
+from amounts import to_fen, to_yuan
+from rule_engine import BUSINESS_LINES, account_index_matrix, active_rules, source_columns
+
+# --- Reconciliation of Entries against Source Aggregates ---
+# 对每条规则，源数据 金额来源 列（按分取整、乘符号）的合计应等于生成分录的 金额 合计。
+# 按 规则 × I17科目代码、规则 × 归属机构、规则 × 合同分组编号 三个视图对账：
+# 两侧都先编码为（规则序号, 键序号），合成一个整数下标后用一次 bincount 求和，再逐格比较。
+# 另外统计最终格式中科目代码或段值为空的行数。
+
+RECONCILE_VIEWS = {'account': 'I17科目代码', 'org': '归属机构', 'group': '合同分组编号'}
+
+# 最终格式中不应为空的列
+REQUIRED_FINAL_COLUMNS = ['account_code', 'account_name', 'org_segment', 'cost_center_segment',
+                          'product_segment', 'channel_segment', 'car_cash_segment']
+
+DIFFERENCE_COLUMNS = ['view', '类型', '取数口径', 'key', 'source_amt', 'entry_amt', 'difference']
+
+def _grid_totals(rule_idx, key_idx, amounts, n_rules, n_keys):
+    """Sums fen amounts into an (n_rules, n_keys) grid (exact below 2**53 fen per cell)."""
+    flat = rule_idx * n_keys + key_idx
+    totals = np.bincount(flat, weights=amounts.astype('float64'), minlength=n_rules * n_keys)
+    return np.rint(totals).astype('int64').reshape(n_rules, n_keys)
+
+def _entry_rule_index(entries, rules):
+    """Maps each entry to its rule's position via (类型, 取数口径); -1 if no rule matches."""
+    type_codes, types = pd.factorize(entries['类型'], use_na_sentinel=True)
+    basis_codes, bases = pd.factorize(entries['取数口径'], use_na_sentinel=True)
+    position = {(rule['类型'], rule['取数口径']): r for r, rule in enumerate(rules)}
+    lookup = np.array([[position.get((t, b), -1) for b in bases] for t in types], dtype='intp').reshape(
+        len(types), len(bases))
+    valid = (type_codes >= 0) & (basis_codes >= 0)
+    rule_idx = np.full(len(entries), -1, dtype='intp')
+    rule_idx[valid] = lookup[type_codes[valid], basis_codes[valid]]
+    return rule_idx
+
+def _view_keys(source_df, entries, rules, view):
+    """
+    Returns (source key index per (rule, row), entry key index, key labels). Entries whose
+    key does not occur in the source fall into one extra trailing bucket.
+    """
+    col = RECONCILE_VIEWS[view]
+    if view == 'account':
+        # 科目代码为空（NaN）的放入最后一个桶
+        matrix = account_index_matrix(source_df, rules).astype('intp')
+        labels = list(entries[col].cat.categories) + ['<空值>']
+        matrix[matrix < 0] = len(labels) - 1
+        entry_idx = entries[col].cat.codes.to_numpy().astype('intp')
+        entry_idx[entry_idx < 0] = len(labels) - 1
+        return matrix, entry_idx, labels
+    codes, uniques = pd.factorize(source_df[col], use_na_sentinel=False)
+    labels = ['<空值>' if pd.isna(u) else u for u in uniques] + ['<源数据中不存在>']
+    entry_idx = pd.Index(uniques).get_indexer(entries[col].to_numpy())
+    entry_idx[entry_idx < 0] = len(labels) - 1
+    return np.broadcast_to(codes, (len(rules), len(source_df))), entry_idx, labels
+
+def reconcile_line(source_df, entries, final_df, line):
+    """
+    Reconciles one business line's entries against its source aggregates.
+
+    Args:
+        source_df: 提取结果（聚合后的源数据）
+        entries: process_* 的输出（含 类型、取数口径、金额 列）
+        final_df: transform_to_final_format 的输出
+
+    Returns:
+        (differences, summary)：differences 每个不平的格一行（金额为元）；
+        summary 含各视图的格数、不平格数，未匹配到规则的分录数和各列空值行数
+    """
+    spec = BUSINESS_LINES[line]
+    rules = active_rules(source_df.columns, spec['rules'], spec['label'], verbose=False)
+    n_rules = len(rules)
+    if not n_rules:
+        return pd.DataFrame(columns=DIFFERENCE_COLUMNS), {
+            'line': line, 'unmatched_rule_rows': len(entries), 'views': {}, 'nan_rows': {}}
+    fen = {col: to_fen(source_df[col]) for rule in rules for col in source_columns(rule)}
+    expected = np.empty((n_rules, len(source_df)), dtype='int64')
+    for r, rule in enumerate(rules):
+        expected[r] = rule['符号'] * np.sum([fen[col] for col in source_columns(rule)], axis=0)
+    source_rule_idx = np.repeat(np.arange(n_rules), len(source_df)).reshape(n_rules, len(source_df))
+
+    entry_rule_idx = _entry_rule_index(entries, rules)
+    matched = entry_rule_idx >= 0
+    entry_amounts = entries['金额'].to_numpy(dtype='int64')
+
+    summary = {'line': line, 'unmatched_rule_rows': int((~matched).sum()), 'views': {}}
+    frames = []
+    for view in RECONCILE_VIEWS:
+        source_keys, entry_keys, labels = _view_keys(source_df, entries, rules, view)
+        n_keys = len(labels)
+        source_totals = _grid_totals(source_rule_idx.ravel(), source_keys.ravel(), expected.ravel(),
+                                     n_rules, n_keys)
+        entry_totals = _grid_totals(entry_rule_idx[matched], entry_keys[matched], entry_amounts[matched],
+                                    n_rules, n_keys)
+        rule_pos, key_pos = np.nonzero(source_totals != entry_totals)
+        summary['views'][view] = {
+            'cells': int(np.count_nonzero((source_totals != 0) | (entry_totals != 0))),
+            'mismatched': len(rule_pos),
+        }
+        if len(rule_pos):
+            frames.append(pd.DataFrame({
+                'view': view,
+                '类型': [rules[r]['类型'] for r in rule_pos],
+                '取数口径': [rules[r]['取数口径'] for r in rule_pos],
+                'key': [labels[k] for k in key_pos],
+                'source_amt': to_yuan(source_totals[rule_pos, key_pos]),
+                'entry_amt': to_yuan(entry_totals[rule_pos, key_pos]),
+                'difference': to_yuan(entry_totals[rule_pos, key_pos] - source_totals[rule_pos, key_pos]),
+            }))
+
+    summary['nan_rows'] = {col: int(final_df[col].isna().sum())
+                           for col in REQUIRED_FINAL_COLUMNS if col in final_df.columns}
+    differences = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=DIFFERENCE_COLUMNS)
+    return differences, summary
+
+def print_reconciliation(differences, summary, max_rows=10):
+    """Prints the reconciliation summary and the largest differences."""
+    label = BUSINESS_LINES[summary['line']]['label']
+    views = ', '.join(f"{view} {s['cells'] - s['mismatched']}/{s['cells']} 平" for view, s in summary['views'].items())
+    print(f"{label}对账: {views}")
+    if summary['unmatched_rule_rows']:
+        print(f"  警告！{summary['unmatched_rule_rows']} 行分录匹配不到规则（类型/取数口径）")
+    if len(differences):
+        print(f"  警告！{len(differences)} 个格金额不平，差额最大的 {min(max_rows, len(differences))} 个:")
+        top = differences.reindex(differences['difference'].abs().sort_values(ascending=False).index[:max_rows])
+        for row in top.itertuples(index=False):
+            print(f"    [{row.view}] {row.类型}（{row.取数口径}） {row.key}: 源 {row.source_amt:,.2f}，"
+                  f"分录 {row.entry_amt:,.2f}，差额 {row.difference:,.2f}")
+    nan_rows = {col: n for col, n in summary['nan_rows'].items() if n}
+    if nan_rows:
+        print(f"  空值行数: {', '.join(f'{col} {n}' for col, n in nan_rows.items())}")
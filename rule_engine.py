@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+from amounts import to_fen
+from chart_of_accounts import account_code_indices, account_codes_from_indices, account_names_from_indices
+
+# --- Declarative Rule Tables ---
+# 每条规则生成一组分录：
+#   金额来源: 源列名，或需要按行求和的多个源列
+#   符号:     金额乘数（1 / -1）
+#   科目代码: 固定科目用 'code'；按维度选择科目用 'code_key' + 'codes'
+#             code_key 取值：'is_contract'（合同/临分）、'分出类型'、'分出类型_is_contract'
+# contract_flag: 1 is facultative (临分), 2 is contract (合同)
+
+DIRECT_RULES = [
+    {'类型': '签单保费', '借贷方向': '贷', '取数口径': '正数', '金额来源': '保费_本币', '符号': 1, 'code': '2606010801'},
+    {'类型': '获取费用', '借贷方向': '贷', '取数口径': '负数', '金额来源': '保险获取现金流_本币', '符号': -1, 'code': '2606011002'},
+    {'类型': '已经过保费', '借贷方向': '贷', '取数口径': '负数', '金额来源': '保险合同收入', '符号': -1, 'code': '2606011102'},
+    {'类型': '获取费用摊销', '借贷方向': '贷', '取数口径': '正数', '金额来源': '当期确认的IACF', '符号': 1, 'code': '2606011603'},
+    {'类型': '亏损(保费不足)', '借贷方向': '贷', '取数口径': '正数', '金额来源': '亏损部分', '符号': 1, 'code': '2606011202'},
+    {'类型': '计息', '借贷方向': '贷', '取数口径': '正数', '金额来源': 'IACF计息', '符号': 1, 'code': '2606011302'},
+]
+
+ASSUMED_RULES = [
+    {'类型': '分保费收入', '借贷方向': '贷', '取数口径': '正数', '金额来源': '分保费收入', '符号': 1,
+     'code_key': 'is_contract', 'codes': {True: '2606010901', False: '2606010904'}},
+    {'类型': '分保费用', '借贷方向': '贷', '取数口径': '负数', '金额来源': '分保费用', '符号': -1,
+     'code_key': 'is_contract', 'codes': {True: '2606010911', False: '2606010913'}},
+    {'类型': '经纪费', '借贷方向': '贷', '取数口径': '负数', '金额来源': '经纪费', '符号': -1,
+     'code_key': 'is_contract', 'codes': {True: '2606010921', False: '2606010923'}},
+    {'类型': '业务及管理费结转', '借贷方向': '贷', '取数口径': '负数', '金额来源': '业务及管理费结转', '符号': -1, 'code': '2606010990'},
+    {'类型': '已经过保费', '借贷方向': '贷', '取数口径': '负数', '金额来源': ['预收净保费摊销', '累积计息摊销'], '符号': -1, 'code': '2606011101'},
+    {'类型': '获取费用摊销', '借贷方向': '贷', '取数口径': '正数', '金额来源': '获取费用摊销', '符号': 1, 'code': '2606011602'},
+    {'类型': '亏损', '借贷方向': '贷', '取数口径': '正数', '金额来源': '亏损部分', '符号': 1, 'code': '2606011201'},
+    {'类型': '计息', '借贷方向': '贷', '取数口径': '正数', '金额来源': '计息', '符号': 1, 'code': '2606011301'},
+]
+
+CEDED_RULES = [
+    {'类型': '分出保费', '借贷方向': '借', '取数口径': '正数', '金额来源': '分出保费', '符号': 1,
+     'code_key': '分出类型_is_contract',
+     'codes': {'1_True': '1252010501', '1_False': '1252010503', '2_True': '1252010511', '2_False': '1252010513'}},
+    {'类型': '摊回分保费用', '借贷方向': '借', '取数口径': '负数', '金额来源': ['手续费_本币', '经纪费_本币'], '符号': -1,
+     'code_key': '分出类型_is_contract',
+     'codes': {'1_True': '1252010521', '1_False': '1252010523', '2_True': '1252010531', '2_False': '1252010533'}},
+    {'类型': '分出保费的分摊', '借贷方向': '借', '取数口径': '负数', '金额来源': ['预收净保费摊销', '累积计息摊销'], '符号': -1,
+     'code_key': '分出类型', 'codes': {'1': '1252010301', '2': '1252010302'}},
+    {'类型': '亏损摊回', '借贷方向': '借', '取数口径': '正数', '金额来源': '亏损摊回部分', '符号': 1,
+     'code_key': '分出类型', 'codes': {'1': '1252010401', '2': '1252010402'}},
+    {'类型': '计息', '借贷方向': '借', '取数口径': '正数', '金额来源': '计息', '符号': 1,
+     'code_key': '分出类型', 'codes': {'1': '1252010101', '2': '1252010102'}},
+    # 投资成分生成两条分录
+    {'类型': '投资成分', '借贷方向': '借', '取数口径': '负数, 已摊销投资成分', '金额来源': '投资成分', '符号': -1,
+     'code_key': 'is_contract', 'codes': {True: '1252010201', False: '1252010202'}},
+    {'类型': '投资成分', '借贷方向': '借', '取数口径': '正数, 已摊销投资成分', '金额来源': '投资成分', '符号': 1,
+     'code_key': 'is_contract', 'codes': {True: '1253010501', False: '1253010502'}},
+]
+
+DIRECT_DIMENSION_COLS = ['归属机构', '业务渠道', '车辆种类', '使用性质代码', '合同分组编号', '险种代码', '险类代码', '合同组合编号']
+REIN_DIMENSION_COLS = ['归属机构', '车辆种类', '使用性质代码', '合同组合编号', '合同分组编号', '评估方法', '险种代码', '险类代码', '合同标识', '临分类型', '合约类型', '分出类型']
+
+# 每条业务线的规则表、维度列、来源 val_method 和 insurance_type（科目名称统一取自 chart_of_accounts）
+BUSINESS_LINES = {
+    'direct': {'label': '直保', 'rules': DIRECT_RULES, 'dimension_cols': DIRECT_DIMENSION_COLS, 'str_cols': [],
+               'val_method': '8', 'insurance_type': '1'},
+    'assumed': {'label': '分入', 'rules': ASSUMED_RULES, 'dimension_cols': REIN_DIMENSION_COLS, 'str_cols': [],
+                'val_method': '11', 'insurance_type': '2'},
+    'ceded': {'label': '分出', 'rules': CEDED_RULES, 'dimension_cols': REIN_DIMENSION_COLS, 'str_cols': ['分出类型'],
+              'val_method': '10', 'insurance_type': '2'},
+}
+
+# --- Rule Expansion ---
+
+def source_columns(rule):
+    """Returns the rule's amount source columns as a list."""
+    cols = rule['金额来源']
+    return list(cols) if isinstance(cols, (list, tuple)) else [cols]
+
+def active_rules(columns, rules, label, verbose=True):
+    """Drops rules whose source columns are not in `columns`, with the same warning as before."""
+    active = []
+    for rule in rules:
+        cols = source_columns(rule)
+        if not all(col in columns for col in cols):
+            if not verbose:
+                continue
+            if isinstance(rule['金额来源'], list):
+                print(f"警告：在{label}数据中找不到一个或多个源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
+            else:
+                print(f"警告：在{label}数据中找不到源列 '{rule['金额来源']}'，跳过规则 '{rule['类型']}'。")
+            continue
+        active.append(rule)
+    return active
+
+def _str_codes(series):
+    """Factorizes a column and converts only its unique values to str: (row codes, str uniques)."""
+    codes, uniques = pd.factorize(series, use_na_sentinel=False)
+    return codes, pd.Index(uniques).astype(str)
+
+def str_categorical(series):
+    """Equivalent of series.astype(str) that stays dictionary-encoded."""
+    codes, uniques = _str_codes(series)
+    category_codes, categories = pd.factorize(uniques)
+    return pd.Categorical.from_codes(category_codes[codes], categories=categories)
+
+def _selector_keys(df, code_key):
+    """Factorizes the code-selection key once: returns (row codes, unique key values)."""
+    flag_codes, flag_uniques = _str_codes(df['合同标识'])
+    is_contract = np.asarray(flag_uniques == '2')[flag_codes]
+    if code_key == 'is_contract':
+        return is_contract.astype('intp'), [False, True]
+    rein_codes, rein_uniques = _str_codes(df['分出类型'])
+    if code_key == '分出类型':
+        return rein_codes, list(rein_uniques)
+    if code_key == '分出类型_is_contract':
+        codes, combined = pd.factorize(rein_codes * 2 + is_contract)
+        return codes, [f"{rein_uniques[c // 2]}_{bool(c % 2)}" for c in combined]
+    raise ValueError(f"未知的科目选择键: {code_key}")
+
+def account_index_matrix(df, rules):
+    """
+    Builds the (n_rules, n_rows) matrix of account-code category indices, resolving
+    selection keys on unique values only.
+    """
+    n = len(df)
+    matrix = np.empty((len(rules), n), dtype='int16')
+    selectors = {}
+    for r, rule in enumerate(rules):
+        if 'code' in rule:
+            matrix[r] = account_code_indices([rule['code']])[0]
+            continue
+        key = rule['code_key']
+        if key not in selectors:
+            selectors[key] = _selector_keys(df, key)
+        row_codes, uniques = selectors[key]
+        lookup = account_code_indices([rule['codes'].get(u) for u in uniques])
+        matrix[r] = lookup[row_codes]
+    return matrix
+
+def _rule_attribute(rules, col, rule_idx):
+    """A per-rule constant column, dictionary-encoded over the rule table's values."""
+    codes, uniques = pd.factorize(pd.Index([rule[col] for rule in rules], dtype=object))
+    return pd.Categorical.from_codes(codes[rule_idx], categories=uniques)
+
+def _amount_matrix(df, rules):
+    """Builds the (n_rules, n_rows) signed amount matrix in int64 fen (see amounts)."""
+    matrix = np.empty((len(rules), len(df)), dtype='int64')
+    fen = {}
+    for r, rule in enumerate(rules):
+        cols = source_columns(rule)
+        for col in cols:
+            if col not in fen:
+                fen[col] = to_fen(df[col])
+        # Sum up columns for the amount (each column rounded to fen first)
+        amount = fen[cols[0]] if len(cols) == 1 else np.sum([fen[col] for col in cols], axis=0)
+        np.multiply(amount, rule['符号'], out=matrix[r])
+    return matrix
+
+def expand_rules(df, rules, dimension_cols, label, str_cols=()):
+    """
+    Expands every source row into one entry per rule in a single vectorized pass.
+
+    Rows are emitted rule-major (all rows of rule 1, then rule 2, ...), matching the
+    order of the former per-rule copy-and-concat implementation. Rule attributes and
+    account codes/names are categorical; dimension columns keep their source dtype.
+    """
+    rules = active_rules(df.columns, rules, label)
+    if not rules:
+        return pd.DataFrame()
+
+    n, n_rules = len(df), len(rules)
+    row_idx = np.tile(np.arange(n), n_rules)
+    rule_idx = np.repeat(np.arange(n_rules), n)
+
+    entries = df[dimension_cols].take(row_idx)
+    entries.reset_index(drop=True, inplace=True)
+    for col in str_cols:
+        entries[col] = str_categorical(entries[col])
+
+    entries['类型'] = _rule_attribute(rules, '类型', rule_idx)
+    entries['借贷方向'] = _rule_attribute(rules, '借贷方向', rule_idx)
+
+    account_indices = account_index_matrix(df, rules).ravel()
+    entries['I17科目代码'] = account_codes_from_indices(account_indices)
+    entries['I17科目名称'] = account_names_from_indices(account_indices)
+
+    entries['取数口径'] = _rule_attribute(rules, '取数口径', rule_idx)
+    entries['金额'] = _amount_matrix(df, rules).ravel()
+    return entries
+
+def process_business_line(df, line):
+    """Generates the entries for one business line ('direct', 'assumed' or 'ceded')."""
+    spec = BUSINESS_LINES[line]
+    return expand_rules(df, spec['rules'], spec['dimension_cols'], spec['label'], str_cols=spec['str_cols'])
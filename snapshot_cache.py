@@ -0,0 +1,117 @@
+import hashlib
+import importlib.util
+import json
+import os
+import time
+
+import pandas as pd
+
+# --- Snapshot Cache Configuration ---
+# 提取结果的列式快照目录，按 val_month / val_method / SQL 哈希区分
+SNAPSHOT_DIR = '.snapshot_cache'
+
+# Parquet 和 Feather 都依赖 pyarrow；未安装时快照功能自动关闭
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+SNAPSHOT_FORMATS = {'parquet': '.parquet', 'feather': '.feather'}
+
+def query_hash(query):
+    """Returns a short, whitespace-insensitive hash of the generated SQL text."""
+    normalized = ' '.join(query.split())
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()[:16]
+
+def snapshot_path(val_month, val_method, query, fmt='parquet', cache_dir=SNAPSHOT_DIR):
+    """Returns the snapshot file path for one extraction."""
+    name = f"{val_month}_vm{val_method}_{query_hash(query)}{SNAPSHOT_FORMATS[fmt]}"
+    return os.path.join(cache_dir, name)
+
+def save_snapshot(df, val_month, val_method, query, fmt='parquet', cache_dir=SNAPSHOT_DIR):
+    """
+    Stores an extracted frame in columnar format, with a JSON sidecar describing it.
+    Returns the snapshot path, or None if nothing was written.
+    """
+    if df is None:
+        return None
+    if not HAS_PYARROW:
+        print("警告：未安装 pyarrow，跳过快照缓存写入。")
+        return None
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = snapshot_path(val_month, val_method, query, fmt=fmt, cache_dir=cache_dir)
+    tmp_path = path + '.tmp'
+    try:
+        if fmt == 'parquet':
+            df.to_parquet(tmp_path, index=False)
+        else:
+            df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"写入快照 {path} 时出错: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+    meta = {
+        'val_month': val_month, 'val_method': val_method, 'query_hash': query_hash(query),
+        'rows': len(df), 'created_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'query': query,
+    }
+    with open(path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    print(f"快照已保存: {path} ({len(df)} 行)")
+    return path
+
+def find_snapshot(val_month, val_method, query, cache_dir=SNAPSHOT_DIR):
+    """Returns (path, fmt) of the snapshot matching val_month, val_method and the exact SQL, or None."""
+    for fmt in SNAPSHOT_FORMATS:
+        path = snapshot_path(val_month, val_method, query, fmt=fmt, cache_dir=cache_dir)
+        if os.path.exists(path):
+            return path, fmt
+    return None
+
+def load_snapshot(val_month, val_method, query, cache_dir=SNAPSHOT_DIR):
+    """
+    Loads the snapshot matching val_month, val_method and the exact SQL, or returns None.
+    """
+    if not HAS_PYARROW:
+        print("警告：未安装 pyarrow，无法读取快照缓存。")
+        return None
+
+    for fmt in SNAPSHOT_FORMATS:
+        path = snapshot_path(val_month, val_method, query, fmt=fmt, cache_dir=cache_dir)
+        if not os.path.exists(path):
+            continue
+        try:
+            df = pd.read_parquet(path) if fmt == 'parquet' else pd.read_feather(path)
+        except Exception as e:
+            print(f"读取快照 {path} 时出错: {e}")
+            return None
+        print(f"已从快照加载 val_method = '{val_method}': {path} ({len(df)} 行)")
+        return df
+
+    print(f"未找到 val_month = '{val_month}', val_method = '{val_method}' 且 SQL 一致的快照。")
+    return None
+
+def iter_snapshot_chunks(val_month, val_method, query, chunksize=100000, cache_dir=SNAPSHOT_DIR):
+    """
+    Yields the matching snapshot in DataFrame chunks without loading it whole.
+    Parquet snapshots are read batch by batch; Feather snapshots are memory-mapped.
+    Raises FileNotFoundError if no snapshot matches (or pyarrow is missing), so a
+    replay never silently produces empty output.
+    """
+    if not HAS_PYARROW:
+        raise FileNotFoundError("未安装 pyarrow，无法读取快照缓存")
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+
+    found = find_snapshot(val_month, val_method, query, cache_dir=cache_dir)
+    if found is None:
+        raise FileNotFoundError(f"未找到 val_month = '{val_month}', val_method = '{val_method}' 且 SQL 一致的快照")
+    path, fmt = found
+    print(f"正在分块读取快照 val_method = '{val_method}': {path}")
+    if fmt == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        table = feather.read_table(path, memory_map=True)
+        for batch in table.to_batches(max_chunksize=chunksize):
+            yield batch.to_pandas()
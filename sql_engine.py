@@ -0,0 +1,179 @@
+import re
+import time
+
+from amounts import FEN_COLUMNS, to_fen
+from chart_of_accounts import I17_ACCOUNTS
+from entry_ids import BUSINESS_KEY_COLUMNS, RULE_KEY_COLUMNS, sql_content_hash, sql_hex_id
+from extraction import build_period_query, fetch_dataframe
+from mapping_registry import SEGMENT_TABLES
+from rule_engine import BUSINESS_LINES, active_rules, source_columns
+
+# --- Server-side Entry Expansion ---
+# 与 rule_engine 使用同一套规则表：规则展开用 CROSS JOIN LATERAL (VALUES ...)，
+# 按合同/临分、分出类型选择科目用 CASE，段值映射与临时映射表 LEFT JOIN。
+# 需要先用 mapping_registry.copy_mappings_to_temp_tables 在同一会话中上传映射。
+
+def _lit(value):
+    """Quotes a Python string as an SQL literal."""
+    return "'" + str(value).replace("'", "''") + "'"
+
+def _col(name):
+    return f'n."{name}"'
+
+def _select_aliases(sql_query):
+    """Returns the output column aliases of an extraction SELECT list."""
+    return re.findall(r'AS "([^"]+)"', sql_query)
+
+def _group_aliases(spec):
+    """Returns the output aliases of the extraction's GROUP BY columns, in GROUP BY order."""
+    aliases = dict(re.findall(r'"([^"]+)" AS "([^"]+)"', spec['sql_query']))
+    return [aliases[col] for col in spec['group_by_columns']]
+
+def _is_contract_expr():
+    # contract_flag: 1 is facultative (临分), 2 is contract (合同)
+    return f"COALESCE({_col('合同标识')}::text = '2', FALSE)"
+
+def _code_expr(rule):
+    """CASE expression selecting the rule's account code; NULL where pandas would give NaN."""
+    if 'code' in rule:
+        return _lit(rule['code'])
+    key = rule['code_key']
+    whens = []
+    for value, code in rule['codes'].items():
+        if key == 'is_contract':
+            cond = _is_contract_expr() if value else f"NOT {_is_contract_expr()}"
+        elif key == '分出类型':
+            cond = f"{_col('分出类型')}::text = {_lit(value)}"
+        elif key == '分出类型_is_contract':
+            rein_type, _, flag = value.partition('_')
+            contract = _is_contract_expr() if flag == 'True' else f"NOT {_is_contract_expr()}"
+            cond = f"{_col('分出类型')}::text = {_lit(rein_type)} AND {contract}"
+        else:
+            raise ValueError(f"未知的科目选择键: {key}")
+        whens.append(f"WHEN {cond} THEN {_lit(code)}")
+    return f"(CASE {' '.join(whens)} END)"
+
+def _amount_expr(rule):
+    """
+    Signed amount in yuan, rounded per source column like amounts.to_fen: half away
+    from zero to two decimals, NULL as 0.
+    """
+    amount = ' + '.join(f"round(COALESCE({_col(col)}, 0)::numeric, 2)" for col in source_columns(rule))
+    return f"({rule['符号']} * ({amount}))"
+
+def build_entry_sql(line, spec, val_month):
+    """
+    Builds the SELECT that aggregates one business line's source rows and expands them
+    into final-format entries inside PostgreSQL.
+
+    Rows are ordered rule-major over the source rows in group-key order, and sj_id is the
+    same content hash as transform_to_final_format's (entry_ids.sql_content_hash over
+    the business key, the rule and the source dimensions).
+    """
+    line_spec = BUSINESS_LINES[line]
+    val_method = line_spec['val_method']
+    rules = active_rules(_select_aliases(spec['sql_query']), line_spec['rules'], line_spec['label'])
+    if not rules:
+        raise ValueError(f"{line_spec['label']} 没有可用的规则。")
+
+    source = build_period_query(val_method, spec, val_month)
+    rule_values = ',\n            '.join(
+        f"({i}, {_lit(rule['类型'])}, {_lit(rule['取数口径'])}, {_lit(rule['借贷方向'])}, {_code_expr(rule)}, "
+        f"{_amount_expr(rule)})"
+        for i, rule in enumerate(rules)
+    )
+    account_values = ', '.join(f"({_lit(code)}, {_lit(name)})" for code, name in I17_ACCOUNTS.items())
+    if '业务渠道' in _select_aliases(spec['sql_query']):
+        channel_key = f"btrim({_col('业务渠道')}::text)"
+    else:
+        # Handle missing '业务渠道' for reinsurance data
+        channel_key = "'0'"
+
+    # 源行按分组键编号，与 pandas 引擎读到的提取结果顺序一致（提取查询按同样的键排序）
+    group_order = ', '.join(f'src."{alias}"' for alias in _group_aliases(spec))
+    dimension_cols = line_spec['dimension_cols']
+    dimension_list = ', '.join(f'{_col(col)} AS "{col}"' for col in dimension_cols)
+    hash_columns = [f'e."{col}"' for col in BUSINESS_KEY_COLUMNS + RULE_KEY_COLUMNS + dimension_cols]
+    final_select = f"""
+            {_lit(val_month)} AS "account_period",
+            CASE r.dc WHEN '借' THEN 'D' WHEN '贷' THEN 'C' END AS "dc_cd",
+            r.account_code AS "account_code",
+            acct.name AS "account_name",
+            m_org."segment" AS "org_segment",
+            '0' AS "agriculture_segment",
+            m_cost."segment" AS "cost_center_segment",
+            '0' AS "detail_segment",
+            m_product."segment" AS "product_segment",
+            '0' AS "coverage_segment",
+            m_channel."segment" AS "channel_segment",
+            m_car."segment" AS "car_cash_segment",
+            '0' AS "reserve1",
+            '0' AS "reserve2",
+            {_col('合同组合编号')} AS "portfolio_id",
+            {_col('合同分组编号')} AS "insurance_contract_group_id",
+            'CNY' AS "origin_currency_code",
+            r.amount AS "origin_currency_amt",
+            1.00 AS "exchange_rate",
+            'CNY' AS "local_currency_code",
+            r.amount AS "local_currency_amt",
+            CASE WHEN r.dc = '贷' THEN -r.amount ELSE r.amount END AS "dc_local_currency_amt",
+            '4' AS "evaluate_method",
+            {_lit(line_spec['insurance_type'])} AS "insurance_type",
+            '9' AS "origin_data_type"
+    """
+    final_list = ', '.join(f'h."{col}"' for col in _select_aliases(final_select))
+
+    return f"""
+        WITH src AS ({source}),
+        numbered AS (
+            SELECT src.*, row_number() OVER (ORDER BY {group_order}) AS src_rn FROM src
+        ),
+        expanded AS (
+        SELECT
+            r.rule_ord, n.src_rn, r.rule_type AS "类型", r.basis AS "取数口径",
+            {dimension_list},{final_select.rstrip()}
+        FROM numbered AS n
+        CROSS JOIN LATERAL (VALUES
+            {rule_values}
+        ) AS r(rule_ord, rule_type, basis, dc, account_code, amount)
+        LEFT JOIN (VALUES {account_values}) AS acct(code, name) ON acct.code = r.account_code
+        LEFT JOIN pg_temp."{SEGMENT_TABLES['product']}" AS m_product ON m_product."key" = btrim({_col('险种代码')}::text)
+        LEFT JOIN pg_temp."{SEGMENT_TABLES['org']}" AS m_org ON m_org."key" = btrim({_col('归属机构')}::text)
+        LEFT JOIN pg_temp."{SEGMENT_TABLES['cost_center']}" AS m_cost ON m_cost."key" = btrim({_col('归属机构')}::text)
+        LEFT JOIN pg_temp."{SEGMENT_TABLES['channel']}" AS m_channel ON m_channel."key" = {channel_key}
+        LEFT JOIN pg_temp."{SEGMENT_TABLES['car']}" AS m_car
+            ON m_car."key" = btrim({_col('使用性质代码')}::text) || '_' || btrim({_col('车辆种类')}::text)
+        ),
+        hashed AS (
+            SELECT e.*, {sql_content_hash(hash_columns)} AS sj_hash FROM expanded AS e
+        )
+        SELECT {sql_hex_id('h.sj_hash')} AS "sj_id", {final_list}
+        FROM hashed AS h
+        ORDER BY h.rule_ord, h.src_rn
+        """
+
+def generate_entries_sql(conn, line, spec, val_month, ingest='pandas', target_table=None, columns=None):
+    """
+    Runs one business line through the server-side engine.
+
+    Returns the final-format DataFrame, or, with `target_table`, inserts the entries
+    into that table's `columns` without sending them to the client and returns the
+    row count.
+    """
+    label = BUSINESS_LINES[line]['label']
+    query = build_entry_sql(line, spec, val_month)
+    start = time.perf_counter()
+    if target_table is None:
+        df = fetch_dataframe(conn, query, method=ingest)
+        # 与 pandas 引擎一致，内存中的金额以分存储
+        for col in FEN_COLUMNS:
+            df[col] = to_fen(df[col])
+        print(f"{label} 分录已在数据库中生成: {len(df)} 行，耗时 {time.perf_counter() - start:.2f} 秒")
+        return df
+    with conn.cursor() as cur:
+        column_list = ' (' + ', '.join(f'"{col}"' for col in columns) + ')' if columns else ''
+        cur.execute(f"INSERT INTO {target_table}{column_list} {query}")
+        rows = cur.rowcount
+    conn.commit()
+    print(f"{label} 分录已在数据库中写入 {target_table}: {rows} 行，耗时 {time.perf_counter() - start:.2f} 秒")
+    return rows
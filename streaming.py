@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from entry_ids import RULE_OUTPUT_COLUMNS
+from extraction import encode_dimensions
+from instrumentation import Instrumentation
+from rule_engine import BUSINESS_LINES, active_rules, expand_rules
+
+# --- Bounded-memory Streaming Pipeline ---
+# 分录按规则优先（先输出规则 1 的全部行，再输出规则 2 ...）排列，因此不能对每个取数块直接展开后追加。
+# 这里先把聚合结果逐块落盘（比分录小 6-11 倍），再对每条规则依次扫描这些块：展开该规则、解析段值、写出。
+# sj_id 是分录内容的哈希（见 entry_ids），与分块方式无关，和一次性运行的结果相同。
+# 内存峰值只与块大小有关，与当月数据量无关。
+
+def spool_chunks(chunks, spool_dir, prefix):
+    """Writes source chunks to disk one at a time. Returns (paths, total rows)."""
+    paths, total = [], 0
+    for i, chunk in enumerate(chunks):
+        if not len(chunk):
+            continue
+        path = os.path.join(spool_dir, f"{prefix}_{i:06d}.pkl")
+        pd.to_pickle(encode_dimensions(chunk), path)
+        paths.append(path)
+        total += len(chunk)
+    return paths, total
+
+def stream_business_line(chunks, line, insurance_type, mappings, val_month, writer, sheet_name, transform,
+                         spool_dir=None, instr=None):
+    """
+    Generates one business line's final entries chunk by chunk and appends them to
+    `writer` (an output_writers.StreamingSheetWriter).
+
+    Args:
+        chunks: 聚合结果的 DataFrame 块（如 iter_query_chunks 的输出）
+        transform: transform_to_final_format
+        spool_dir: 落盘目录，默认使用系统临时目录
+
+    Returns:
+        写出的分录行数
+    """
+    spec = BUSINESS_LINES[line]
+    instr = instr or Instrumentation()
+    work_dir = tempfile.mkdtemp(prefix=f'stream_{line}_', dir=spool_dir)
+    try:
+        with instr.stage(f'spool_{line}', val_month=val_month) as rec:
+            paths, n = spool_chunks(chunks, work_dir, line)
+            rec['rows_out'] = n
+            rec['bytes'] = sum(os.path.getsize(path) for path in paths)
+        print(f"{spec['label']}聚合结果已分块落盘: {n} 行，{len(paths)} 块")
+
+        written = 0
+        with instr.stage(f'stream_entries_{line}', rows_in=n, val_month=val_month) as rec:
+            if not paths:
+                # 没有数据时仍输出表头
+                empty = transform(pd.DataFrame(columns=spec['dimension_cols'] + RULE_OUTPUT_COLUMNS),
+                                  insurance_type, mappings, account_period=val_month, verbose=False)
+                writer.append(sheet_name, empty)
+            else:
+                columns = pd.read_pickle(paths[0]).columns
+                rules = active_rules(columns, spec['rules'], spec['label'])
+                for rule in rules:
+                    for path in paths:
+                        chunk = pd.read_pickle(path)
+                        entries = expand_rules(chunk, [rule], spec['dimension_cols'], spec['label'],
+                                               str_cols=spec['str_cols'])
+                        final = transform(entries, insurance_type, mappings, account_period=val_month,
+                                          verbose=False)
+                        writer.append(sheet_name, final)
+                        written += len(final)
+            rec['rows_out'] = written
+        return written
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,151 @@
+import tempfile
+import time
+
+from amounts import with_yuan_amounts
+
+# --- PostgreSQL Target-table Sink ---
+# 最终分录以 COPY FROM STDIN 分批写入会话临时表（临时表不写 WAL），全部写完后在一个事务中
+# 按 account_period 替换目标表：删除该期间的旧行、插入暂存表的全部行、提交。
+# 读者要么看到旧的整期数据，要么看到新的，重跑同一期间是幂等的；中途失败时目标表不受影响。
+# 以分存储的金额列在写入前换算为元。
+
+DEFAULT_COPY_BATCH_ROWS = 500000
+
+_COPY_NULL = r'\N'
+# CSV 超过该大小才落盘，较小的批次留在内存中
+_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+
+class CopyTableSink:
+    """
+    Loads final-format entry frames into a PostgreSQL table, replacing one account_period.
+
+    Has the same append/close interface as output_writers.StreamingSheetWriter, so it
+    can stand in for it; the sheet name only labels the statistics.
+
+    Args:
+        conn: psycopg2 连接（需有目标表的 DELETE/INSERT 权限）
+        target_table: 目标表名，可带 schema（如 'ledger.unexpired_entries'），列名与 FINAL_COLUMNS 一致
+        account_period: 本次替换的期间，暂存的每一行都必须属于该期间
+        batch_rows: 每次 COPY 的行数
+    """
+
+    def __init__(self, conn, target_table, account_period, batch_rows=DEFAULT_COPY_BATCH_ROWS):
+        self.conn = conn
+        self.target_table = target_table
+        self.account_period = account_period
+        self.batch_rows = batch_rows
+        self.staging_table = f"stage_entries_{account_period}"
+        self._columns = None
+        self._pending = []
+        self._pending_rows = 0
+        self._rows = {}
+        self._bytes = 0
+        self._copy_seconds = 0.0
+        self._started = False
+
+    def _column_list(self):
+        return ', '.join(f'"{col}"' for col in self._columns)
+
+    def begin(self, columns=None):
+        """
+        Creates the session temp staging table with the target's column types.
+        Without `columns` all of the target table's columns are staged.
+        """
+        with self.conn.cursor() as cur:
+            if columns is None:
+                cur.execute(f'SELECT * FROM {self.target_table} LIMIT 0')
+                columns = [desc[0] for desc in cur.description]
+            self._columns = list(columns)
+            cur.execute(f'DROP TABLE IF EXISTS pg_temp."{self.staging_table}"')
+            cur.execute(f'CREATE TEMP TABLE "{self.staging_table}" AS '
+                        f'SELECT {self._column_list()} FROM {self.target_table} WITH NO DATA')
+        self.conn.commit()
+        self._started = True
+
+    def append(self, sheet_name, df):
+        """Buffers one frame and COPYs whenever a full batch has accumulated."""
+        if not self._started:
+            self.begin(df.columns)
+        self._rows[sheet_name] = self._rows.get(sheet_name, 0) + len(df)
+        if len(df):
+            self._pending.append(with_yuan_amounts(df))
+            self._pending_rows += len(df)
+        if self._pending_rows >= self.batch_rows:
+            self._flush()
+
+    def add_staged_rows(self, sheet_name, rows):
+        """Counts rows that were inserted into the staging table server-side (e.g. by the SQL engine)."""
+        self._rows[sheet_name] = self._rows.get(sheet_name, 0) + rows
+
+    def _flush(self):
+        if not self._pending:
+            return
+        start = time.perf_counter()
+        with tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_BYTES, mode='w+', encoding='utf-8') as buf:
+            for df in self._pending:
+                df.to_csv(buf, columns=self._columns, index=False, header=False, na_rep=_COPY_NULL)
+            self._bytes += buf.tell()
+            buf.seek(0)
+            with self.conn.cursor() as cur:
+                cur.copy_expert(f'COPY "{self.staging_table}" ({self._column_list()}) '
+                                f"FROM STDIN WITH (FORMAT csv, NULL '{_COPY_NULL}')", buf)
+        self.conn.commit()
+        self._copy_seconds += time.perf_counter() - start
+        self._pending, self._pending_rows = [], 0
+
+    def swap(self):
+        """
+        Replaces the account_period's rows in the target table with the staged rows in
+        one transaction. Returns (deleted rows, inserted rows).
+        """
+        with self.conn.cursor() as cur:
+            cur.execute(f'SELECT count(*) FROM pg_temp."{self.staging_table}" '
+                        f'WHERE "account_period" IS DISTINCT FROM %s', (self.account_period,))
+            foreign = cur.fetchone()[0]
+            if foreign:
+                raise ValueError(f"暂存表中有 {foreign} 行不属于期间 {self.account_period}，已中止替换")
+            # 阻止并发的写入（包括同一期间的另一次重跑），不阻塞读取
+            cur.execute(f'LOCK TABLE {self.target_table} IN SHARE ROW EXCLUSIVE MODE')
+            cur.execute(f'DELETE FROM {self.target_table} WHERE "account_period" = %s', (self.account_period,))
+            deleted = cur.rowcount
+            cur.execute(f'INSERT INTO {self.target_table} ({self._column_list()}) '
+                        f'SELECT {self._column_list()} FROM pg_temp."{self.staging_table}"')
+            inserted = cur.rowcount
+            cur.execute(f'DROP TABLE pg_temp."{self.staging_table}"')
+        self.conn.commit()
+        return deleted, inserted
+
+    def abort(self):
+        """Discards the staged rows; the target table is left untouched."""
+        self.conn.rollback()
+        if self._started:
+            with self.conn.cursor() as cur:
+                cur.execute(f'DROP TABLE IF EXISTS pg_temp."{self.staging_table}"')
+            self.conn.commit()
+        self._pending, self._pending_rows, self._started = [], 0, False
+
+    def close(self):
+        """
+        Flushes the last batch and swaps the period in. Returns one statistics record in
+        the shape of output_writers.write_sheets (path is the target table).
+        """
+        try:
+            if not self._started:
+                # 没有追加任何行：暂存表为空，替换时只清空该期间
+                self.begin()
+            self._flush()
+            start = time.perf_counter()
+            deleted, inserted = self.swap()
+        except Exception:
+            self.abort()
+            raise
+        swap_seconds = time.perf_counter() - start
+        seconds = max(self._copy_seconds + swap_seconds, 1e-9)
+        print(f"{self.target_table}: 期间 {self.account_period} 已替换，删除 {deleted} 行，插入 {inserted} 行 "
+              f"(COPY {self._copy_seconds:.2f} 秒，替换 {swap_seconds:.2f} 秒)")
+        self._started = False
+        return [{
+            'sheets': list(self._rows), 'format': 'postgres', 'path': self.target_table, 'rows': inserted,
+            'bytes': self._bytes, 'seconds': seconds, 'rows_per_sec': inserted / seconds,
+            'bytes_per_sec': self._bytes / seconds, 'replaced_rows': deleted,
+        }]
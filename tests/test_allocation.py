@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from allocation import ALLOCATION_KEY, allocate_entries, split_fen
+
+# --- split_fen ---
+
+def test_split_fen_largest_remainder():
+    parts = split_fen(np.array([10, -10, 7]), np.array([1 / 3, 1 / 3, 1 / 3, 1 / 3, 1 / 3, 1 / 3, 1.0]),
+                      np.array([3, 3, 1]))
+    assert parts.tolist() == [4, 3, 3, -3, -3, -4, 7]
+
+def test_split_fen_sums_back_exactly():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        counts = rng.integers(1, 8, rng.integers(1, 40))
+        amounts = rng.integers(-10 ** 12, 10 ** 12, len(counts))
+        # 动因可以为负，单个比例可以小于 0 或大于 1，组内合计为 1
+        weights = [rng.normal(1.0, 2.0, n) for n in counts]
+        ratios = np.concatenate([w / w.sum() for w in weights])
+        parts = split_fen(amounts, ratios, counts)
+        assert parts.dtype == np.int64
+        assert (np.add.reduceat(parts, np.cumsum(counts) - counts) == amounts).all()
+        exact = amounts[np.repeat(np.arange(len(counts)), counts)] * ratios
+        assert np.abs(parts - exact).max() < 1 + 1e-3
+
+# --- allocate_entries ---
+
+def _categorical(values):
+    return pd.Categorical(values, categories=pd.Index(pd.unique(pd.Series(values).dropna()), dtype=object))
+
+def _entries(rows):
+    columns = ['归属机构', '业务渠道', '合同组合编号', ALLOCATION_KEY, '险种代码', '类型', '借贷方向', 'I17科目代码']
+    df = pd.DataFrame(rows, columns=columns + ['金额'])
+    for col in columns:
+        df[col] = _categorical(df[col].tolist())
+    df['金额'] = df['金额'].astype('int64')
+    return df
+
+RATIOS = pd.DataFrame({
+    '评估方法': ['8', '8', '8', '8', '8', '11'],
+    ALLOCATION_KEY: ['G1', 'G1', 'G1', 'G2', 'G2', 'G1'],
+    '归属机构': ['O1', 'O2', 'O3', 'O4', 'O5', 'O9'],
+    '业务渠道': ['C1', 'C2', 'C3', 'C4', 'C5', 'C9'],
+    '车辆种类': None, '使用性质代码': None,
+    '险种代码': ['R1', 'R2', 'R3', 'R4', 'R5', 'R9'],
+    '险类代码': None,
+    # G2 的动因一正一负，比例超出 [0, 1]
+    'ratio': [0.5, 0.3, 0.2, 1.5, -0.5, 1.0],
+})
+
+LOSS = '亏损(保费不足)'
+
+def _sums(df):
+    return df.groupby(['类型', ALLOCATION_KEY], observed=True)['金额'].sum()
+
+def test_allocate_entries_keeps_group_totals_and_source_portfolio():
+    entries = _entries([
+        ['X1', 'Y1', 'P1', 'G1', 'Z1', LOSS, '借', 'A1', 1001],
+        ['X2', 'Y2', 'P1', 'G1', 'Z2', LOSS, '借', 'A1', 2],
+        ['X1', 'Y1', 'P1', 'G1', 'Z1', LOSS, '贷', 'A2', -1003],
+        ['X3', 'Y3', 'P2', 'G2', 'Z3', LOSS, '借', 'A1', -777],
+    ])
+    allocated = allocate_entries(entries, RATIOS, 'direct')
+    pd.testing.assert_series_equal(_sums(allocated), _sums(entries))
+    assert (allocated['金额'] != 0).all()
+    # 维度取参考表的值，合同组合编号保留源数据的值
+    g1 = allocated[allocated[ALLOCATION_KEY] == 'G1']
+    assert set(g1['归属机构']) == {'O1', 'O2', 'O3'}
+    assert set(g1['合同组合编号']) == {'P1'}
+    g2 = allocated[allocated[ALLOCATION_KEY] == 'G2'].sort_values('归属机构')
+    assert g2['金额'].tolist() == [-1165, 388]
+    assert set(g2['合同组合编号']) == {'P2'}
+
+def test_allocate_entries_passes_through_unmatched_entries():
+    entries = _entries([
+        ['X1', 'Y1', 'P1', 'G7', 'Z1', LOSS, '借', 'A1', 500],
+        ['X1', 'Y1', 'P1', 'G1', 'Z1', '未到期', '借', 'A3', 300],
+        ['X1', 'Y1', 'P1', 'G1', 'Z1', LOSS, '借', 'A1', 1000],
+    ])
+    allocated = allocate_entries(entries, RATIOS, 'direct')
+    # 参考表中没有的合同分组和其他规则的分录原样保留在前
+    pd.testing.assert_frame_equal(allocated.iloc[:2].astype(object), entries.iloc[:2].astype(object))
+    assert allocated.iloc[2:]['金额'].tolist() == [500, 300, 200]
+
+def test_allocate_entries_leaves_ceded_untouched():
+    entries = _entries([['X1', 'Y1', 'P1', 'G1', 'Z1', '亏损摊回', '借', 'A1', 1000]])
+    assert allocate_entries(entries, RATIOS, 'ceded') is entries
+
+@pytest.mark.parametrize('amount, expected', [(0, []), (1, [1]), (-2, [-1, -1])])
+def test_allocate_entries_drops_zero_fen_parts(amount, expected):
+    entries = _entries([['X1', 'Y1', 'P1', 'G1', 'Z1', LOSS, '借', 'A1', amount]])
+    allocated = allocate_entries(entries, RATIOS, 'direct')
+    assert allocated['金额'].tolist() == expected
+    assert allocated['金额'].sum() == amount
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from output_writers import StreamingSheetWriter, output_path_for
+
+pytest.importorskip('pyarrow')
+
+def _chunk(portfolio_ids, reserve1):
+    n = len(portfolio_ids)
+    return pd.DataFrame({
+        'sj_id': [f'{i:016x}' for i in range(n)],
+        'portfolio_id': pd.Categorical(portfolio_ids),
+        'reserve1': pd.Series(reserve1, dtype=object),
+        'dc_local_currency_amt': np.arange(n, dtype='int64') * 100,
+    })
+
+@pytest.mark.parametrize('chunks', [
+    [([None, None], [None, None]), (['P1'], ['R1'])],
+    [(['P1'], ['R1']), ([None, None], [None, None])],
+], ids=['null-first', 'null-last'])
+def test_parquet_stream_accepts_all_null_chunks(tmp_path, chunks):
+    base = str(tmp_path / 'out.xlsx')
+    writer = StreamingSheetWriter(base, default_format='parquet')
+    for portfolio_ids, reserve1 in chunks:
+        writer.append('直保', _chunk(portfolio_ids, reserve1))
+    stats = writer.close()
+    assert stats[0]['rows'] == 3
+
+    written = pd.read_parquet(output_path_for(base, '直保', 'parquet'))
+    expected = [p for portfolio_ids, _ in chunks for p in portfolio_ids]
+    assert [None if pd.isna(v) else v for v in written['portfolio_id'].astype(object)] == expected
+    assert sorted(written['reserve1'].dropna()) == ['R1']
+    # 金额以分写入，输出为元
+    expected_amounts = [i for portfolio_ids, _ in chunks for i in range(len(portfolio_ids))]
+    assert written['dc_local_currency_amt'].tolist() == expected_amounts
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from chart_of_accounts import account_code_indices, account_names_from_indices
+from rule_engine import BUSINESS_LINES, process_business_line
+
+# --- Rule Expansion per Business Line ---
+# 每条业务线一个小样本：每个源行每条规则一条分录，按规则优先的顺序输出（规则 1 的所有行，再规则 2 ...），
+# 金额为带符号的分，科目按 合同标识（'2' 为合约）和 分出类型 选择。
+
+def _source(dimensions, amounts):
+    return pd.DataFrame({**dimensions, **amounts})
+
+def _check(entries, line, n_rows, types, accounts, amounts, dimensions):
+    n_rules = len(BUSINESS_LINES[line]['rules'])
+    assert len(entries) == n_rules * n_rows
+    assert entries['类型'].astype(object).tolist() == [t for t in types for _ in range(n_rows)]
+    assert entries['I17科目代码'].astype(object).tolist() == [a for rule in accounts for a in rule]
+    assert entries['金额'].dtype == np.int64
+    assert entries['金额'].tolist() == [a for rule in amounts for a in rule]
+    expected_names = account_names_from_indices(account_code_indices(entries['I17科目代码'].astype(object).tolist()))
+    assert entries['I17科目名称'].astype(object).tolist() == list(expected_names)
+    for col, values in dimensions.items():
+        assert entries[col].astype(str).tolist() == [str(v) for v in values] * n_rules
+
+def test_direct_rules():
+    dimensions = {'归属机构': ['3301', '3302'], '业务渠道': ['01', '02'], '车辆种类': ['A0', 'B1'],
+                  '使用性质代码': ['8A', '9B'], '合同分组编号': ['G1', 'G2'], '险种代码': ['0801', '0802'],
+                  '险类代码': ['08', '08'], '合同组合编号': ['P1', 'P2']}
+    df = _source(dimensions, {
+        '保费_本币': [100.01, -2.5], '保险获取现金流_本币': [3.0, 0.0], '保险合同收入': [40.4, 7.0],
+        '当期确认的IACF': [1.23, 4.56], '亏损部分': [0.0, 9.99], 'IACF计息': [0.01, -0.02],
+    })
+    entries = process_business_line(df, 'direct')
+    _check(entries, 'direct', 2,
+           types=['签单保费', '获取费用', '已经过保费', '获取费用摊销', '亏损(保费不足)', '计息'],
+           accounts=[['2606010801'] * 2, ['2606011002'] * 2, ['2606011102'] * 2, ['2606011603'] * 2,
+                     ['2606011202'] * 2, ['2606011302'] * 2],
+           amounts=[[10001, -250], [-300, 0], [-4040, -700], [123, 456], [0, 999], [1, -2]],
+           dimensions=dimensions)
+    assert entries['借贷方向'].astype(object).tolist() == ['贷'] * 12
+
+def test_assumed_rules_select_accounts_by_contract_flag():
+    dimensions = {'归属机构': ['3301', '3302'], '车辆种类': ['A0', 'B1'], '使用性质代码': ['8A', '9B'],
+                  '合同组合编号': ['P1', 'P2'], '合同分组编号': ['G1', 'G2'], '评估方法': ['11', '11'],
+                  '险种代码': ['0801', '0802'], '险类代码': ['08', '08'],
+                  # '1' 临分、'2' 合约
+                  '合同标识': ['1', '2'], '临分类型': ['F', None], '合约类型': [None, 'T'], '分出类型': [None, None]}
+    df = _source(dimensions, {
+        '分保费收入': [10.0, 20.0], '分保费用': [1.0, 2.0], '经纪费': [0.1, 0.2], '业务及管理费结转': [0.5, 0.6],
+        '预收净保费摊销': [3.0, 4.0], '累积计息摊销': [0.25, 0.75], '获取费用摊销': [5.0, 6.0],
+        '亏损部分': [7.0, 8.0], '计息': [0.01, 0.02],
+    })
+    entries = process_business_line(df, 'assumed')
+    _check(entries, 'assumed', 2,
+           types=['分保费收入', '分保费用', '经纪费', '业务及管理费结转', '已经过保费', '获取费用摊销', '亏损', '计息'],
+           accounts=[['2606010904', '2606010901'], ['2606010913', '2606010911'], ['2606010923', '2606010921'],
+                     ['2606010990'] * 2, ['2606011101'] * 2, ['2606011602'] * 2, ['2606011201'] * 2,
+                     ['2606011301'] * 2],
+           # 多个源列先各自取整到分再求和
+           amounts=[[1000, 2000], [-100, -200], [-10, -20], [-50, -60], [-325, -475], [500, 600], [700, 800],
+                    [1, 2]],
+           dimensions={col: dimensions[col] for col in ('合同分组编号', '合同组合编号', '合同标识')})
+
+def test_ceded_rules_select_accounts_by_rein_type_and_contract_flag():
+    dimensions = {'归属机构': ['3301'] * 4, '车辆种类': ['A0'] * 4, '使用性质代码': ['8A'] * 4,
+                  '合同组合编号': ['P1', 'P1', 'P2', 'P2'], '合同分组编号': ['G1', 'G2', 'G3', 'G4'],
+                  '评估方法': ['10'] * 4, '险种代码': ['0801'] * 4, '险类代码': ['08'] * 4,
+                  '合同标识': ['2', '1', '1', '2'], '临分类型': [None] * 4, '合约类型': [None] * 4,
+                  # 分出类型在源数据中可以是数值，分录中为文本
+                  '分出类型': [1, 1, 2, 2]}
+    df = _source(dimensions, {
+        '分出保费': [100.0, 200.0, 300.0, 400.0], '手续费_本币': [1.0, 2.0, 3.0, 4.0],
+        '经纪费_本币': [0.5, 0.5, 0.5, 0.5], '预收净保费摊销': [10.0, 20.0, 30.0, 40.0],
+        '累积计息摊销': [0.01, 0.02, 0.03, 0.04], '亏损摊回部分': [5.0, 6.0, 7.0, 8.0],
+        '计息': [0.1, 0.2, 0.3, 0.4], '投资成分': [50.0, 60.0, 70.0, 80.0],
+    })
+    entries = process_business_line(df, 'ceded')
+    _check(entries, 'ceded', 4,
+           types=['分出保费', '摊回分保费用', '分出保费的分摊', '亏损摊回', '计息', '投资成分', '投资成分'],
+           accounts=[['1252010501', '1252010503', '1252010513', '1252010511'],
+                     ['1252010521', '1252010523', '1252010533', '1252010531'],
+                     ['1252010301', '1252010301', '1252010302', '1252010302'],
+                     ['1252010401', '1252010401', '1252010402', '1252010402'],
+                     ['1252010101', '1252010101', '1252010102', '1252010102'],
+                     ['1252010201', '1252010202', '1252010202', '1252010201'],
+                     ['1253010501', '1253010502', '1253010502', '1253010501']],
+           amounts=[[10000, 20000, 30000, 40000], [-150, -250, -350, -450], [-1001, -2002, -3003, -4004],
+                    [500, 600, 700, 800], [10, 20, 30, 40], [-5000, -6000, -7000, -8000],
+                    [5000, 6000, 7000, 8000]],
+           dimensions={col: dimensions[col] for col in ('合同分组编号', '合同标识', '分出类型')})
+    assert entries['借贷方向'].astype(object).tolist() == ['借'] * 28
+    assert entries['分出类型'].dtype == 'category'
+
+def test_missing_source_column_skips_rule():
+    df = _source({col: ['X'] for col in BUSINESS_LINES['direct']['dimension_cols']},
+                 {'保费_本币': [1.0], '亏损部分': [2.0]})
+    entries = process_business_line(df, 'direct')
+    assert entries['类型'].astype(object).tolist() == ['签单保费', '亏损(保费不足)']
+    assert entries['金额'].tolist() == [100, 200]
@@ -0,0 +1,115 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from amounts import FEN_COLUMNS
+from entry_ids import _HASH_MULTIPLIER, _HASH_SEED, content_ids
+from extraction import build_period_query, encode_dimensions, fetch_dataframe
+from generate_entries import EXTRACTION_SPECS, FINAL_COLUMNS, transform_to_final_format
+from rule_engine import BUSINESS_LINES, process_business_line
+from sql_engine import generate_entries_sql
+
+# 对比 SQL 引擎与 pandas 引擎的测试需要可写临时表的 PostgreSQL，例如
+# ENTRIES_TEST_DSN='dbname=test user=postgres' python -m pytest tests
+TEST_DSN = os.environ.get('ENTRIES_TEST_DSN')
+VAL_MONTH = '202412'
+
+def _sql_row_id(values):
+    """Evaluates entry_ids.sql_content_hash / sql_hex_id step by step as PostgreSQL would."""
+    h = _HASH_SEED
+    for value in values:
+        if value is None:
+            part = 0
+        else:
+            signed = int(hashlib.md5(str(value).strip().encode('utf-8')).hexdigest()[:16], 16)
+            signed -= 2 ** 64 if signed >= 2 ** 63 else 0  # ::bit(64)::bigint
+            part = (signed + 2 ** 64) % 2 ** 64
+        h = (h * _HASH_MULTIPLIER + part) % 2 ** 64
+    signed = h - 2 ** 64 if h >= 2 ** 63 else h
+    return format(signed & (2 ** 64 - 1), '016x')  # to_hex(bigint) 对负数输出补码
+
+def test_sql_hash_formula_matches_content_ids():
+    columns = [pd.Series(['3301', ' 3302 ', None, '3301']), pd.Categorical(['D', 'C', 'C', None]),
+               pd.Series([1.0, 2.0, np.nan, 10.0])]
+    ids = content_ids(columns)
+    rows = [['3301', 'D', '1'], ['3302', 'C', '2'], [None, 'C', None], ['3301', None, '10']]
+    assert list(ids) == [_sql_row_id(row) for row in rows]
+
+# --- SQL Engine vs pandas Engine (PostgreSQL) ---
+
+FIXTURE_DIRECT = pd.DataFrame({
+    'com_code': ['3301', '3301', '3302', ' 3302', '3399', '3301'],
+    'business_nature': ['01', '01', '02', '02', '01', None],
+    'car_kind_code': ['A0', 'A0', 'B1', 'B1', 'A0', 'A0'],
+    'use_nature_code': ['8A', '8A', '9B', '9B', '8A', '8A'],
+    'portfolio_id': ['P1', 'P1', 'P2', 'P2', 'P1', 'P3'],
+    'group_id': ['G1', 'G1', 'G2', 'G2', 'G1', 'G3'],
+    'val_method': '8',
+    'risk_code': ['0801', '0801', '0802', '0802', '0899', '0801'],
+    'class_code': ['08', '08', '08', '08', '08', '08'],
+    'total_premium': [100.005, 200.10, -50.0, 12.34, None, 7.0],
+    'total_iacf_amt': [1.0, 2.0, 3.0, 4.0, 5.0, None],
+    'acc_confirmed_premium': [10.0, 20.0, 30.0, 40.0, 50.0, 60.0],
+    'acc_iacf_premium': [0.01, 0.02, 0.03, 0.04, 0.05, 0.06],
+    'lrc_loss_cost_policy': [5.0, 0.0, -5.0, 1.5, 2.5, 3.5],
+    'ifie_amt': [0.5, 0.5, 0.5, 0.5, 0.5, 0.5],
+    'val_month': VAL_MONTH,
+    'start_date': ['2024-01-01', '2024-06-01', '2024-03-01', '2024-12-31', '2024-02-01', '2025-01-02'],
+    'end_date': ['2025-01-01', '2025-06-01', '2025-03-01', '2025-12-31', '2025-02-01', '2026-01-02'],
+})
+
+FIXTURE_MAPPINGS = {
+    'product': pd.Series({'0801': 'P0801', '0802': 'P0802'}, dtype=object),
+    'org': pd.Series({'3301': 'O3301', '3302': 'O3302'}, dtype=object),
+    'cost_center': pd.Series({'3301': 'C3301', '3302': 'C3302'}, dtype=object),
+    'channel': pd.Series({'01': 'CH01', '02': 'CH02'}, dtype=object),
+    'car': pd.Series({'8A_A0': 'CAR1', '9B_B1': 'CAR2'}, dtype=object),
+}
+
+def _normalized(df):
+    """Comparable columns: fen amounts as int64, the rate as float, the rest as str or None."""
+    out = {}
+    for col in FINAL_COLUMNS:
+        if col in FEN_COLUMNS:
+            out[col] = df[col].to_numpy(dtype='int64')
+        elif col == 'exchange_rate':
+            out[col] = df[col].to_numpy(dtype='float64')
+        else:
+            values = df[col].astype(object)
+            out[col] = [None if pd.isna(v) else str(v) for v in values]
+    return pd.DataFrame(out)
+
+@pytest.fixture
+def conn():
+    if not TEST_DSN:
+        pytest.skip('未设置 ENTRIES_TEST_DSN，跳过需要 PostgreSQL 的测试')
+    psycopg2 = pytest.importorskip('psycopg2')
+    from mapping_registry import copy_mappings_to_temp_tables
+
+    connection = psycopg2.connect(TEST_DSN)
+    with connection.cursor() as cur:
+        columns = ', '.join(f'"{col}" {"numeric" if FIXTURE_DIRECT[col].dtype.kind == "f" else "text"}'
+                            for col in FIXTURE_DIRECT.columns)
+        cur.execute(f'CREATE TEMP TABLE fixture_direct ({columns})')
+        rows = FIXTURE_DIRECT.astype(object).where(FIXTURE_DIRECT.notna(), None).values.tolist()
+        placeholders = ', '.join(['%s'] * len(FIXTURE_DIRECT.columns))
+        cur.executemany(f'INSERT INTO fixture_direct VALUES ({placeholders})', rows)
+    copy_mappings_to_temp_tables(connection, FIXTURE_MAPPINGS)
+    yield connection
+    connection.close()
+
+def test_sql_engine_matches_pandas_engine(conn):
+    spec = dict(EXTRACTION_SPECS['8'], table_name='pg_temp.fixture_direct')
+    source = encode_dimensions(fetch_dataframe(conn, build_period_query('8', spec, VAL_MONTH)))
+    assert len(source)
+    expected = transform_to_final_format(process_business_line(source, 'direct'),
+                                         BUSINESS_LINES['direct']['insurance_type'], FIXTURE_MAPPINGS,
+                                         account_period=VAL_MONTH, verbose=False)
+    actual = generate_entries_sql(conn, 'direct', spec, VAL_MONTH)
+
+    assert actual['sj_id'].is_unique
+    # 行序（规则优先、源行按分组键）和每一列（包括 sj_id）都应一致
+    pd.testing.assert_frame_equal(_normalized(actual), _normalized(expected))